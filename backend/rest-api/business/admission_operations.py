@@ -0,0 +1,190 @@
+# business/admission_operations.py
+# Admission control for the game sockets. Every frame a client sends takes a
+# token from two buckets: its connection's bucket for that action, checked
+# by the socket's receive loop, and the room's bucket, shared by all the
+# room's sockets and checked on the room's owner. A frame that finds a bucket
+# empty is dropped and the client is told to slow down, so one misbehaving
+# client can't flood its room's command queue. Oversized frames close the
+# socket, and each worker takes at most GAME_SOCKET_MAX_CONNECTIONS sockets.
+import json
+import os
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+# Rate limits are "<frames per second>/<burst>", e.g. "5/10"
+RateLimit = Tuple[float, float]
+
+# Per connection; "*" covers every action without a limit of its own
+DEFAULT_ACTION_LIMITS: Dict[str, RateLimit] = {
+    "make_move": (5, 10),
+    "get_board": (1, 5),
+    "resync": (1, 5),
+    "play_again": (1, 3),
+    "*": (5, 10),
+}
+# A client must always be able to leave
+UNLIMITED_ACTIONS = {"leave_room"}
+
+THROTTLED_ERROR = "Too many messages. Slow down."
+MALFORMED_MESSAGE_ERROR = "Messages must be JSON objects with an action."
+MESSAGE_TOO_BIG_ERROR = "Message too big."
+SERVER_FULL_ERROR = "The server is full. Please try again in a moment."
+
+
+def parse_rate_limit(text: str) -> RateLimit:
+    rate, _, burst = text.partition("/")
+    return float(rate), float(burst or rate)
+
+
+def parse_action_limits(text: str) -> Dict[str, RateLimit]:
+    # "make_move=5/10,get_board=1/5" on top of the defaults
+    limits = dict(DEFAULT_ACTION_LIMITS)
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        action, _, limit = item.partition("=")
+        limits[action.strip()] = parse_rate_limit(limit)
+    return limits
+
+
+def parse_command(message: str) -> Optional[dict]:
+    # None for anything but a JSON object with a string action
+    try:
+        data = json.loads(message)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("action"), str):
+        return None
+    return data
+
+
+GAME_SOCKET_ACTION_LIMITS = parse_action_limits(os.getenv("GAME_SOCKET_ACTION_LIMITS", ""))
+GAME_SOCKET_ROOM_LIMIT = parse_rate_limit(os.getenv("GAME_SOCKET_ROOM_LIMIT", "20/40"))
+# Client frames are small JSON commands; this is in characters of JSON text
+GAME_SOCKET_MAX_MESSAGE_BYTES = int(os.getenv("GAME_SOCKET_MAX_MESSAGE_BYTES", "1024"))
+# Open game sockets per worker; 0 for no cap
+GAME_SOCKET_MAX_CONNECTIONS = int(os.getenv("GAME_SOCKET_MAX_CONNECTIONS", "2000"))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, limit: RateLimit):
+        self.rate, self.burst = limit
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        # Refill for the time since the last frame, then spend one token
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class ConnectionLimiter:
+    # One per game socket, with a bucket per action it has sent
+    def __init__(self, limits: Dict[str, RateLimit]):
+        self._limits = limits
+        self._buckets: Dict[str, TokenBucket] = {}
+        # Throttled since the last admitted frame; the client is told once per streak
+        self.throttled_streak = 0
+
+    def admit(self, action: Optional[str]) -> bool:
+        if action in UNLIMITED_ACTIONS:
+            return True
+        key = action if action in self._limits else "*"
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self._limits[key])
+        if bucket.take():
+            self.throttled_streak = 0
+            return True
+        self.throttled_streak += 1
+        return False
+
+
+class AdmissionControl:
+    def __init__(
+        self,
+        action_limits: Dict[str, RateLimit] = GAME_SOCKET_ACTION_LIMITS,
+        room_limit: RateLimit = GAME_SOCKET_ROOM_LIMIT,
+        max_message_bytes: int = GAME_SOCKET_MAX_MESSAGE_BYTES,
+        max_connections: int = GAME_SOCKET_MAX_CONNECTIONS,
+    ):
+        self.action_limits = action_limits
+        self.room_limit = room_limit
+        self.max_message_bytes = max_message_bytes
+        self.max_connections = max_connections
+        # Game sockets open on this worker; lobby feeds and matchmaking don't count
+        self.open_game_sockets = 0
+        # Rooms this worker owns -> their shared bucket
+        self._room_buckets: Dict[int, TokenBucket] = {}
+        self.throttled_frames: Counter = Counter()
+        self.room_throttled_frames = 0
+        self.rejected_frames: Counter = Counter()
+        self.rejected_connections = 0
+
+    def connection_limiter(self) -> ConnectionLimiter:
+        return ConnectionLimiter(self.action_limits)
+
+    def open_game_socket(self) -> bool:
+        # Every admitted socket must be given back with close_game_socket()
+        if self.max_connections and self.open_game_sockets >= self.max_connections:
+            self.rejected_connections += 1
+            return False
+        self.open_game_sockets += 1
+        return True
+
+    def close_game_socket(self):
+        self.open_game_sockets -= 1
+
+    def message_fits(self, message: str) -> bool:
+        if len(message) > self.max_message_bytes:
+            self.rejected_frames["too_big"] += 1
+            return False
+        return True
+
+    def reject_malformed(self):
+        self.rejected_frames["malformed"] += 1
+
+    def admit(self, limiter: ConnectionLimiter, action: Optional[str]) -> bool:
+        # Socket side: the connection's own bucket for this action
+        if limiter.admit(action):
+            return True
+        self.throttled_frames[action if action in self.action_limits else "*"] += 1
+        return False
+
+    def admit_to_room(self, room_id: int, action: Optional[str]) -> bool:
+        # Owner side: the bucket all of the room's sockets share
+        if action in UNLIMITED_ACTIONS:
+            return True
+        bucket = self._room_buckets.get(room_id)
+        if bucket is None:
+            bucket = self._room_buckets[room_id] = TokenBucket(self.room_limit)
+        if bucket.take():
+            return True
+        self.room_throttled_frames += 1
+        return False
+
+    def forget_room(self, room_id: int):
+        self._room_buckets.pop(room_id, None)
+
+    def metrics(self) -> dict:
+        return {
+            "max_connections": self.max_connections,
+            "max_message_bytes": self.max_message_bytes,
+            "action_limits": {action: f"{rate:g}/{burst:g}" for action, (rate, burst) in self.action_limits.items()},
+            "room_limit": "{:g}/{:g}".format(*self.room_limit),
+            "throttled_frames": sum(self.throttled_frames.values()),
+            "throttled_by_action": dict(self.throttled_frames),
+            "room_throttled_frames": self.room_throttled_frames,
+            "rejected_frames": dict(self.rejected_frames),
+            "rejected_connections": self.rejected_connections,
+            "limited_rooms": len(self._room_buckets),
+        }
+
+
+admission_control = AdmissionControl()
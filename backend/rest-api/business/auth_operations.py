@@ -1,8 +1,14 @@
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from typing import Optional
+from typing import Optional, Dict, Set, Tuple
 from datetime import datetime, timedelta
+from dataclasses import dataclass
+from collections import OrderedDict
+from uuid import UUID
+import os
+import threading
+import time
 
 
 # Secret key for JWT encoding/decoding
@@ -10,7 +16,12 @@ SECRET_KEY = "supersecretkeyforsigningtokens"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1500
 
-# OAuth2PasswordBearer instance 
+# Principal cache settings: how long a verified token is trusted without
+# touching the database again, and how many tokens we keep at most.
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+
+# OAuth2PasswordBearer instance
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
 
@@ -25,18 +36,9 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+def decode_access_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-
-        if not username:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid token: Missing 'sub'",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -44,4 +46,85 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    return username  #
\ No newline at end of file
+    if not payload.get("sub"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token: Missing 'sub'",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return payload
+
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    payload = decode_access_token(token)
+    return payload.get("sub")
+
+
+# The authenticated user as seen by the routers. It only carries what the
+# hot path needs, so it can be served from memory instead of the User table.
+@dataclass
+class Principal:
+    user_id: UUID
+    username: str
+    room_id: Optional[int] = None
+
+
+class PrincipalCache:
+    """
+    Bounded LRU of verified tokens -> Principal. Entries expire after the
+    TTL or when the token itself expires, whichever comes first.
+    """
+
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Principal]]" = OrderedDict()
+        self._tokens_by_user: Dict[UUID, Set[str]] = {}
+        # Sync endpoints run in FastAPI's threadpool, so guard the dicts.
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires_at, principal = entry
+            if expires_at <= time.time():
+                self._remove(token)
+                return None
+            self._entries.move_to_end(token)
+            return principal
+
+    def put(self, token: str, principal: Principal, token_exp: Optional[float] = None):
+        expires_at = time.time() + self.ttl_seconds
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (expires_at, principal)
+            self._tokens_by_user.setdefault(principal.user_id, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                oldest_token = next(iter(self._entries))
+                self._remove(oldest_token)
+
+    def invalidate_user(self, user_id: UUID):
+        # Called whenever the user's room changes so the next request reloads it
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def _remove(self, token: str):
+        _, principal = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(principal.user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[principal.user_id]
+
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_TTL_SECONDS, PRINCIPAL_CACHE_MAX_ENTRIES)
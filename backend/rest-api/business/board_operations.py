@@ -0,0 +1,125 @@
+# business/board_operations.py
+# Compact N x N board for k-in-a-row games (tic-tac-toe is 3 x 3, k = 3).
+# Each player's stones live in one integer bitboard, bit i = cell i in the
+# same row-major order as Room.position. Win lines are precomputed masks, so
+# "did this move win?" and "is the board full?" are plain mask comparisons.
+from functools import lru_cache
+from math import isqrt
+from typing import List, Optional, Tuple
+
+EMPTY = 0
+PLAYER_X = 1  # Stored as 1 in Room.position (player_index 0)
+PLAYER_O = 2  # Stored as 2 in Room.position (player_index 1)
+
+
+@lru_cache(maxsize=None)
+def win_masks(size: int, k: int) -> Tuple[int, ...]:
+    # Every run of k cells horizontally, vertically and on both diagonals
+    masks = []
+    directions = ((0, 1), (1, 0), (1, 1), (1, -1))
+    for row in range(size):
+        for col in range(size):
+            for d_row, d_col in directions:
+                end_row = row + d_row * (k - 1)
+                end_col = col + d_col * (k - 1)
+                if not (0 <= end_row < size and 0 <= end_col < size):
+                    continue
+                mask = 0
+                for step in range(k):
+                    mask |= 1 << ((row + d_row * step) * size + col + d_col * step)
+                masks.append(mask)
+    return tuple(masks)
+
+
+@lru_cache(maxsize=None)
+def win_masks_by_cell(size: int, k: int) -> Tuple[Tuple[int, ...], ...]:
+    # Only the lines through the last move can have been completed by it
+    masks = win_masks(size, k)
+    return tuple(
+        tuple(mask for mask in masks if mask >> cell & 1)
+        for cell in range(size * size)
+    )
+
+
+@lru_cache(maxsize=None)
+def full_mask(size: int) -> int:
+    return (1 << (size * size)) - 1
+
+
+class Board:
+    __slots__ = ("size", "k", "x_bits", "o_bits")
+
+    def __init__(self, size: int = 3, k: Optional[int] = None, x_bits: int = 0, o_bits: int = 0):
+        if k is None:
+            k = size
+        if size < 1 or not (1 <= k <= size):
+            raise ValueError(f"Invalid board: {size}x{size} with {k} in a row")
+        self.size = size
+        self.k = k
+        self.x_bits = x_bits
+        self.o_bits = o_bits
+
+    # --- Conversion to/from the Room.position list format ---
+
+    @classmethod
+    def from_list(cls, cells: List[int], k: Optional[int] = None) -> "Board":
+        size = isqrt(len(cells))
+        if size * size != len(cells):
+            raise ValueError(f"Board of {len(cells)} cells is not square")
+        x_bits = o_bits = 0
+        for cell, value in enumerate(cells):
+            if value == PLAYER_X:
+                x_bits |= 1 << cell
+            elif value == PLAYER_O:
+                o_bits |= 1 << cell
+        return cls(size, k, x_bits, o_bits)
+
+    @classmethod
+    def empty(cls, cells: int, k: Optional[int] = None) -> "Board":
+        return cls.from_list([EMPTY] * cells, k)
+
+    def to_list(self) -> List[int]:
+        return [self.cell(cell) for cell in range(self.size * self.size)]
+
+    def copy(self) -> "Board":
+        return Board(self.size, self.k, self.x_bits, self.o_bits)
+
+    # --- Queries and moves ---
+
+    def __len__(self) -> int:
+        return self.size * self.size
+
+    def cell(self, cell: int) -> int:
+        if self.x_bits >> cell & 1:
+            return PLAYER_X
+        if self.o_bits >> cell & 1:
+            return PLAYER_O
+        return EMPTY
+
+    def is_empty(self, cell: int) -> bool:
+        return not ((self.x_bits | self.o_bits) >> cell & 1)
+
+    def place(self, cell: int, mark: int):
+        if mark == PLAYER_X:
+            self.x_bits |= 1 << cell
+        else:
+            self.o_bits |= 1 << cell
+
+    def clear(self):
+        self.x_bits = self.o_bits = 0
+
+    def is_full(self) -> bool:
+        return (self.x_bits | self.o_bits) == full_mask(self.size)
+
+    def winner(self) -> Optional[int]:
+        for mask in win_masks(self.size, self.k):
+            if self.x_bits & mask == mask:
+                return PLAYER_X
+            if self.o_bits & mask == mask:
+                return PLAYER_O
+        return None
+
+    def wins_with(self, cell: int) -> bool:
+        # Whether the stone on `cell` completes a line for its owner
+        bits = self.x_bits if self.x_bits >> cell & 1 else self.o_bits
+        return any(bits & mask == mask for mask in win_masks_by_cell(self.size, self.k)[cell])
@@ -0,0 +1,190 @@
+# business/broadcast_operations.py
+# Outbound side of the game sockets. Every socket gets a bounded queue and a
+# writer task of its own, so a slow or stalled client only ever delays
+# itself: senders enqueue and move on. A client whose queue overflows either
+# loses frames ("drop") or gets disconnected ("disconnect").
+import asyncio
+import json
+import os
+import time
+from typing import Iterable, List, Optional, Set, Union
+
+from fastapi import WebSocket
+
+BROADCAST_QUEUE_SIZE = int(os.getenv("BROADCAST_QUEUE_SIZE", "64"))
+BROADCAST_OVERFLOW_POLICY = os.getenv("BROADCAST_OVERFLOW_POLICY", "disconnect")  # "drop" or "disconnect"
+# How long close() waits for queued frames to go out before giving up
+BROADCAST_CLOSE_TIMEOUT_SECONDS = float(os.getenv("BROADCAST_CLOSE_TIMEOUT_SECONDS", "5"))
+
+# Queue item that tells the writer to close the socket after what's queued
+_CLOSE = object()
+
+Frame = Union[str, bytes]
+
+
+def encode_frame(payload: dict) -> str:
+    # Same encoding as WebSocket.send_json, done once per payload
+    return json.dumps(payload, separators=(",", ":"))
+
+
+class JsonEncoder:
+    # Every socket has an encoder that turns payloads into its frames. This is
+    # the default: one JSON text frame, the same for every recipient, so
+    # fan_out encodes it once for all of them. Binary sockets get a
+    # FrameEncoder (business/frame_protocol_operations.py) instead.
+    binary = False
+
+    def encode(self, payload: dict) -> List[Frame]:
+        return [encode_frame(payload)]
+
+
+JSON_ENCODER = JsonEncoder()
+
+
+class BroadcastMetrics:
+    def __init__(self):
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.frames_dropped = 0
+        self.slow_disconnects = 0
+        self.send_latency_total = 0.0
+        self.send_latency_max = 0.0
+
+    def record_sent(self, latency: float, size: int):
+        self.frames_sent += 1
+        self.bytes_sent += size
+        self.send_latency_total += latency
+        self.send_latency_max = max(self.send_latency_max, latency)
+
+    def snapshot(self, connections: Iterable["OutboundConnection"]) -> dict:
+        connections = list(connections)
+        depths = [connection.queue_depth for connection in connections]
+        return {
+            "open_connections": len(depths),
+            "binary_connections": sum(1 for connection in connections if connection.encoder.binary),
+            "queue_size": BROADCAST_QUEUE_SIZE,
+            "overflow_policy": BROADCAST_OVERFLOW_POLICY,
+            "queued_frames": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+            "frames_dropped": self.frames_dropped,
+            "slow_client_disconnects": self.slow_disconnects,
+            "send_latency_avg_ms": round(self.send_latency_total / (self.frames_sent or 1) * 1000, 3),
+            "send_latency_max_ms": round(self.send_latency_max * 1000, 3),
+        }
+
+
+broadcast_metrics = BroadcastMetrics()
+open_connections: Set["OutboundConnection"] = set()
+
+
+class OutboundConnection:
+    def __init__(
+        self,
+        websocket: WebSocket,
+        queue_size: int = BROADCAST_QUEUE_SIZE,
+        overflow_policy: str = BROADCAST_OVERFLOW_POLICY,
+        encoder=None,
+    ):
+        self.websocket = websocket
+        # Turns payloads into this socket's frames; JSON_ENCODER unless the client asked for binary
+        self.encoder = encoder or JSON_ENCODER
+        self.overflow_policy = overflow_policy
+        self.closed = False
+        self._close_args = (1000, None)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._writer = asyncio.create_task(self._write_loop())
+        open_connections.add(self)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def send_json(self, payload: dict) -> bool:
+        return self.send_frames(self.encoder.encode(payload))
+
+    def send_frames(self, frames: List[Frame]) -> bool:
+        return all([self.send_frame(frame) for frame in frames])
+
+    def send_frame(self, frame: Frame) -> bool:
+        # Never blocks: the frame is queued for this socket's writer task
+        if self.closed:
+            return False
+        try:
+            self._queue.put_nowait((frame, time.perf_counter()))
+        except asyncio.QueueFull:
+            broadcast_metrics.frames_dropped += 1
+            if self.overflow_policy == "disconnect":
+                broadcast_metrics.slow_disconnects += 1
+                self.abort(code=1008, reason="Client too slow")
+            return False
+        return True
+
+    async def _write_loop(self):
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is _CLOSE:
+                    code, reason = self._close_args
+                    await self.websocket.close(code=code, reason=reason)
+                    return
+                frame, enqueued_at = item
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+                broadcast_metrics.record_sent(time.perf_counter() - enqueued_at, len(frame))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The client went away; the receive loop will notice and clean up
+            self.closed = True
+        finally:
+            open_connections.discard(self)
+
+    async def close(self, code: int = 1000, reason: Optional[str] = None):
+        # Let already queued frames (e.g. an error message) go out first
+        if self.closed:
+            return
+        self.closed = True
+        self._close_args = (code, reason)
+        try:
+            self._queue.put_nowait(_CLOSE)
+            await asyncio.wait_for(asyncio.shield(self._writer), BROADCAST_CLOSE_TIMEOUT_SECONDS)
+        except (asyncio.QueueFull, asyncio.TimeoutError):
+            self.abort(code=code, reason=reason)
+        except Exception:
+            pass
+
+    def abort(self, code: int = 1008, reason: Optional[str] = None):
+        # Drop whatever is queued and close the socket without waiting on the client
+        self.closed = True
+        self._writer.cancel()
+        open_connections.discard(self)
+        asyncio.create_task(self._close_socket(code, reason))
+
+    def stop(self):
+        # The client is already gone: just stop the writer
+        self.closed = True
+        self._writer.cancel()
+        open_connections.discard(self)
+
+    async def _close_socket(self, code: int, reason: Optional[str]):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code, reason=reason), BROADCAST_CLOSE_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+
+
+def fan_out(connections: Iterable[OutboundConnection], payload: dict):
+    # Serialize once for every JSON recipient; binary sockets encode their own
+    # (their frames depend on what each one was sent before)
+    json_frames = None
+    for connection in list(connections):
+        if connection.encoder is not JSON_ENCODER:
+            connection.send_json(payload)
+            continue
+        if json_frames is None:
+            json_frames = JSON_ENCODER.encode(payload)
+        connection.send_frames(json_frames)
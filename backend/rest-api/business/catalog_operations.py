@@ -0,0 +1,46 @@
+# business/catalog_operations.py
+# The game catalog (a handful of rows seeded from DEFAULT_GAMES_DATA) held in
+# memory and indexed by name and id, so resolving a game never costs a query.
+# Loaded at startup, and reloaded whenever a worker reports a change.
+from typing import Dict, List, Optional
+
+from sqlmodel import select
+
+from business.database_operations import open_postgresql_session
+from business.event_bus_operations import room_relay
+from business.listing_cache_operations import listing_cache
+from models.games import Game
+
+
+class GameCatalog:
+    def __init__(self):
+        self._by_id: Dict[int, Game] = {}
+        self._by_name: Dict[str, Game] = {}
+
+    async def load(self):
+        async with open_postgresql_session() as session:
+            games = (await session.exec(select(Game).order_by(Game.id))).all()
+        # Swap both indexes at once; readers never see a half-built catalog
+        self._by_id, self._by_name = {game.id: game for game in games}, {game.name: game for game in games}
+        listing_cache.bump_catalog()
+        print(f"Game catalog loaded: {', '.join(self._by_name) or 'no games'}.")
+
+    def announce_change(self):
+        # Call after changing Game rows so every other worker reloads too
+        room_relay.publish("catalog_changed", {})
+
+    async def on_catalog_changed(self, message: dict):
+        await self.load()
+
+    def by_name(self, name: str) -> Optional[Game]:
+        return self._by_name.get(name)
+
+    def by_id(self, game_id: int) -> Optional[Game]:
+        return self._by_id.get(game_id)
+
+    def available_games(self) -> List[Game]:
+        return [game for game in self._by_id.values() if game.available]
+
+
+game_catalog = GameCatalog()
+room_relay.subscribe("catalog_changed", game_catalog.on_catalog_changed)
@@ -0,0 +1,177 @@
+# business/db_metrics_operations.py
+# Visibility into the database layer: pool pressure (checked-out connections,
+# time spent waiting for one) and per-route query counts/durations, with a
+# simple N+1 detector that flags requests going over a query budget.
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Requests issuing more statements than this get flagged as N+1 suspects
+DB_QUERY_BUDGET = int(os.getenv("DB_QUERY_BUDGET", "8"))
+# How many recent offenders we keep around for the metrics endpoint
+DB_QUERY_BUDGET_RECENT_OFFENDERS = 20
+
+
+@dataclass
+class RequestQueryStats:
+    queries: int = 0
+    duration: float = 0.0
+
+
+@dataclass
+class RouteQueryStats:
+    requests: int = 0
+    queries: int = 0
+    duration: float = 0.0
+    max_queries: int = 0
+    budget_exceeded: int = 0
+
+
+@dataclass
+class DatabaseMetrics:
+    pool_checkouts: int = 0
+    pool_waits: int = 0
+    pool_wait_total: float = 0.0
+    pool_wait_max: float = 0.0
+    routes: Dict[str, RouteQueryStats] = field(default_factory=dict)
+    recent_offenders: List[dict] = field(default_factory=list)
+
+    def record_pool_wait(self, seconds: float):
+        self.pool_waits += 1
+        self.pool_wait_total += seconds
+        self.pool_wait_max = max(self.pool_wait_max, seconds)
+
+    def record_request(self, route: str, stats: RequestQueryStats):
+        route_stats = self.routes.setdefault(route, RouteQueryStats())
+        route_stats.requests += 1
+        route_stats.queries += stats.queries
+        route_stats.duration += stats.duration
+        route_stats.max_queries = max(route_stats.max_queries, stats.queries)
+
+        if stats.queries > DB_QUERY_BUDGET:
+            route_stats.budget_exceeded += 1
+            self.recent_offenders.append({
+                "route": route,
+                "queries": stats.queries,
+                "duration_ms": round(stats.duration * 1000, 3),
+                "at": time.time(),
+            })
+            del self.recent_offenders[:-DB_QUERY_BUDGET_RECENT_OFFENDERS]
+            print(f"WARNING: {route} issued {stats.queries} queries (budget {DB_QUERY_BUDGET}), possible N+1.")
+
+    def snapshot(self, pool) -> dict:
+        return {
+            "pool": {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+                "checkouts": self.pool_checkouts,
+                "waits": self.pool_waits,
+                "wait_avg_ms": round(self.pool_wait_total / (self.pool_waits or 1) * 1000, 3),
+                "wait_max_ms": round(self.pool_wait_max * 1000, 3),
+            },
+            "query_budget": DB_QUERY_BUDGET,
+            "routes": {
+                route: {
+                    "requests": stats.requests,
+                    "queries": stats.queries,
+                    "queries_per_request": round(stats.queries / (stats.requests or 1), 2),
+                    "query_time_avg_ms": round(stats.duration / (stats.requests or 1) * 1000, 3),
+                    "max_queries": stats.max_queries,
+                    "budget_exceeded": stats.budget_exceeded,
+                }
+                for route, stats in self.routes.items()
+            },
+            "recent_budget_offenders": list(self.recent_offenders),
+        }
+
+
+database_metrics = DatabaseMetrics()
+
+# Set by QueryMetricsMiddleware for the duration of one HTTP request. The
+# AsyncSession runs its sync internals in a greenlet that shares this context.
+current_request_queries: ContextVar[Optional[RequestQueryStats]] = ContextVar(
+    "current_request_queries", default=None
+)
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    # Times how long callers wait to get a connection out of the pool. A
+    # checkout served by an idle connection isn't a wait; one that has to open
+    # a new connection or queue for one to come back is.
+    def _do_get(self):
+        database_metrics.pool_checkouts += 1
+        if self.checkedin() > 0:
+            return super()._do_get()
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            database_metrics.record_pool_wait(time.perf_counter() - started)
+
+
+def instrument_engine(engine):
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started_at = conn.info["query_started_at"].pop()
+        stats = current_request_queries.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.duration += time.perf_counter() - started_at
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _handle_error(exception_context):
+        # after_cursor_execute doesn't fire for failed statements
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started_at"):
+            connection.info["query_started_at"].pop()
+
+
+class QueryMetricsMiddleware:
+    """
+    ASGI middleware that counts the statements each HTTP request issues and
+    files them under the matched route, e.g. "POST /join_room/{room_id}".
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths: Dict[object, str] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestQueryStats()
+        token = current_request_queries.set(stats)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_request_queries.reset(token)
+            if stats.queries:
+                database_metrics.record_request(self._route_label(scope), stats)
+
+    def _route_label(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return f"{scope['method']} <unmatched>"
+        if endpoint not in self._route_paths:
+            path = scope["path"]
+            for route in getattr(scope.get("app"), "routes", []):
+                if getattr(route, "endpoint", None) is endpoint:
+                    path = route.path
+                    break
+            self._route_paths[endpoint] = path
+        return f"{scope['method']} {self._route_paths[endpoint]}"
@@ -0,0 +1,510 @@
+# business/event_bus_operations.py
+# Lets several uvicorn workers serve the same game room. Every room has one
+# owner worker that holds its live state (the game state engine) and runs its
+# commands; sockets on other workers forward their commands to the owner, and
+# the owner publishes the resulting frames back to every worker with sockets
+# in that room.
+#
+# Backends (ROOM_EVENT_BUS):
+#   memory   - single process; this worker owns every room, nothing is relayed
+#   postgres - LISTEN/NOTIFY on one channel for messages, and a session level
+#              advisory lock per room for ownership. If an owner dies its locks
+#              go with its connection and the next worker to touch the room
+#              claims it, reloading the last flushed board. A dropped LISTEN
+#              connection is reconnected; messages sent meanwhile are lost, and
+#              commands waiting on them are retried under the same command id.
+#              A dropped lock connection takes this worker's room locks with
+#              it: the worker stops acting as owner, reconnects, and claims back
+#              the rooms nobody else took in the meantime.
+import asyncio
+import itertools
+import json
+import os
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy.engine import make_url
+
+from business.broadcast_operations import OutboundConnection, encode_frame, fan_out
+from business.database_operations import POSTGRESQL_DATABASE_URL
+
+ROOM_EVENT_BUS = os.getenv("ROOM_EVENT_BUS", "memory")  # "memory" or "postgres"
+ROOM_EVENT_CHANNEL = os.getenv("ROOM_EVENT_CHANNEL", "game_room_events")
+# How long a worker waits for the owner of a room to answer a forwarded command
+ROOM_COMMAND_TIMEOUT_SECONDS = float(os.getenv("ROOM_COMMAND_TIMEOUT_SECONDS", "5"))
+# First key of the two-key advisory lock, so room locks can't collide with other locks
+ROOM_LOCK_NAMESPACE = 7301
+# NOTIFY payloads are capped at 8000 bytes by Postgres
+NOTIFY_MAX_PAYLOAD_BYTES = 7999
+# How often the LISTEN connection is checked, so a half-open one is noticed too
+ROOM_EVENT_BUS_PING_SECONDS = float(os.getenv("ROOM_EVENT_BUS_PING_SECONDS", "10"))
+# Results of forwarded commands an owner keeps, to answer retries without running them again
+ROOM_COMMAND_RESULTS_KEPT = int(os.getenv("ROOM_COMMAND_RESULTS_KEPT", "1024"))
+
+WORKER_ID = uuid.uuid4().hex[:12]
+
+# Returned by _run_owned when this worker lost the room before the command ran
+_NOT_OWNER = object()
+
+MessageHandler = Callable[[dict], Awaitable[None]]
+CommandHandler = Callable[[int, dict], Awaitable[Optional[dict]]]
+LocksLostHandler = Callable[[], Awaitable[None]]
+
+
+class RoomUnavailableError(Exception):
+    pass
+
+
+class InProcessEventBus:
+    # One process, one owner: every claim succeeds and messages never leave the process
+    distributed = False
+    holds_locks = True
+
+    def __init__(self):
+        self._handler: Optional[MessageHandler] = None
+
+    def set_handler(self, handler: MessageHandler):
+        self._handler = handler
+
+    def set_locks_lost_handler(self, handler: LocksLostHandler):
+        pass  # there are no locks to lose
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def publish(self, message: dict):
+        if self._handler is not None:
+            asyncio.ensure_future(self._handler(message))
+
+    async def claim_room(self, room_id: int) -> bool:
+        return True
+
+    async def claim_rooms(self, room_ids: Iterable[int]) -> Set[int]:
+        return set(room_ids)
+
+    async def release_room(self, room_id: int):
+        pass
+
+
+class PostgresEventBus:
+    distributed = True
+
+    def __init__(self, database_url: str, channel: str = ROOM_EVENT_CHANNEL):
+        # asyncpg wants a plain libpq style URL, without SQLAlchemy's "+asyncpg"
+        self.dsn = make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+        self.channel = channel
+        self._handler: Optional[MessageHandler] = None
+        self._locks_lost_handler: Optional[LocksLostHandler] = None
+        self._listen_connection = None
+        # NOTIFY and advisory locks share one connection; asyncpg runs one statement at a time on it
+        self._command_connection = None
+        self._command_lock = asyncio.Lock()
+        self._outbox: Optional[asyncio.Queue] = None
+        self._publisher: Optional[asyncio.Task] = None
+        self._watchdog: Optional[asyncio.Task] = None
+        # Set when either connection closes, so the watchdog reconnects right away
+        self._connection_lost: Optional[asyncio.Event] = None
+        self._stopping = False
+        self.listen_reconnects = 0
+        self.command_reconnects = 0
+
+    @property
+    def holds_locks(self) -> bool:
+        # The room locks live as long as the session that took them
+        return self._command_connection is not None
+
+    def set_handler(self, handler: MessageHandler):
+        self._handler = handler
+
+    def set_locks_lost_handler(self, handler: LocksLostHandler):
+        # Called once a new lock connection is up, the old one having taken every room lock with it
+        self._locks_lost_handler = handler
+
+    async def start(self):
+        self._stopping = False
+        self._connection_lost = asyncio.Event()
+        await self._listen()
+        await self._connect_commands()
+        self._outbox = asyncio.Queue()
+        self._publisher = asyncio.create_task(self._publish_loop())
+        self._watchdog = asyncio.create_task(self._watch_connections())
+        print(f"Room event bus: worker {WORKER_ID} listening on '{self.channel}'.")
+
+    async def _listen(self):
+        import asyncpg
+
+        connection = await asyncpg.connect(self.dsn)
+        await connection.add_listener(self.channel, self._on_notify)
+        connection.add_termination_listener(self._on_listen_closed)
+        self._listen_connection = connection
+
+    async def _connect_commands(self):
+        import asyncpg
+
+        connection = await asyncpg.connect(self.dsn)
+        connection.add_termination_listener(self._on_command_closed)
+        self._command_connection = connection
+
+    def _on_listen_closed(self, connection):
+        # Also called for our own close() in stop(); the watchdog reconnects
+        if connection is self._listen_connection:
+            self._listen_connection = None
+            self._connection_lost.set()
+
+    def _on_command_closed(self, connection):
+        if connection is self._command_connection:
+            self._command_connection = None
+            self._connection_lost.set()
+
+    async def _ping(self, connection, lock: Optional[asyncio.Lock] = None):
+        # A half-open connection only shows up when it is used
+        if connection is None:
+            return
+        try:
+            if lock is None:
+                await asyncio.wait_for(connection.fetchval("SELECT 1"), ROOM_COMMAND_TIMEOUT_SECONDS)
+            else:
+                async with lock:
+                    await asyncio.wait_for(connection.fetchval("SELECT 1"), ROOM_COMMAND_TIMEOUT_SECONDS)
+        except Exception:
+            connection.terminate()  # its termination listener marks it lost
+
+    async def _watch_connections(self):
+        delay = ROOM_EVENT_BUS_PING_SECONDS
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._connection_lost.wait(), delay)
+            except asyncio.TimeoutError:
+                await self._ping(self._listen_connection)
+                await self._ping(self._command_connection, self._command_lock)
+            self._connection_lost.clear()
+            if self._stopping:
+                return
+            try:
+                if self._listen_connection is None:
+                    print("Room event bus: lost the LISTEN connection, reconnecting.")
+                    await self._listen()
+                    self.listen_reconnects += 1
+                    print(f"Room event bus: worker {WORKER_ID} listening on '{self.channel}' again.")
+                if self._command_connection is None:
+                    print("Room event bus: lost the lock connection and with it every room lock, reconnecting.")
+                    await self._connect_commands()
+                    self.command_reconnects += 1
+                    if self._locks_lost_handler is not None:
+                        await self._locks_lost_handler()
+                delay = ROOM_EVENT_BUS_PING_SECONDS
+            except Exception as e:
+                # Back off while the database is unreachable, checking sooner than usual
+                print(f"Room event bus: reconnecting failed, retrying: {e}")
+                delay = min(ROOM_EVENT_BUS_PING_SECONDS, 1.0)
+
+    async def stop(self):
+        self._stopping = True
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            self._watchdog = None
+        if self._publisher is not None:
+            # Let already queued frames go out before we disappear
+            try:
+                await asyncio.wait_for(self._outbox.join(), ROOM_COMMAND_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._publisher.cancel()
+            self._publisher = None
+        # Closing the session releases every room lock this worker holds
+        for connection in (self._listen_connection, self._command_connection):
+            if connection is not None:
+                await connection.close()
+        self._listen_connection = self._command_connection = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        message = json.loads(payload)
+        if message.get("origin") == WORKER_ID:
+            return  # our own publish; it was already handled locally
+        if self._handler is not None:
+            asyncio.ensure_future(self._handler(message))
+
+    def publish(self, message: dict):
+        # Never blocks the caller; a single task sends messages in order
+        payload = encode_frame({**message, "origin": WORKER_ID})
+        if len(payload.encode()) > NOTIFY_MAX_PAYLOAD_BYTES:
+            print(f"Room event of {len(payload)} bytes is too large to relay, dropped.")
+            return
+        self._outbox.put_nowait(payload)
+
+    async def _publish_loop(self):
+        while True:
+            payloads: List[str] = [await self._outbox.get()]
+            while not self._outbox.empty():
+                payloads.append(self._outbox.get_nowait())
+            try:
+                async with self._command_lock:
+                    if self._command_connection is None:
+                        raise RoomUnavailableError("the lock connection is reconnecting")
+                    # One round trip for everything queued since the last send
+                    await self._command_connection.executemany(
+                        "SELECT pg_notify($1, $2)", [(self.channel, payload) for payload in payloads]
+                    )
+            except Exception as e:
+                print(f"Failed to publish {len(payloads)} room event(s): {e}")
+            finally:
+                for _ in payloads:
+                    self._outbox.task_done()
+
+    async def _run_command(self, query: str, *args):
+        # Driver errors become RoomUnavailableError, which the callers of dispatch handle
+        async with self._command_lock:
+            if self._command_connection is None:
+                raise RoomUnavailableError("The room event bus is reconnecting to the database")
+            try:
+                return await self._command_connection.fetchval(query, *args)
+            except Exception as e:
+                raise RoomUnavailableError(f"Room lock query failed: {e}") from e
+
+    async def claim_room(self, room_id: int) -> bool:
+        return await self._run_command("SELECT pg_try_advisory_lock($1, $2)", ROOM_LOCK_NAMESPACE, room_id)
+
+    async def claim_rooms(self, room_ids: Iterable[int]) -> Set[int]:
+        # One round trip for many rooms; returns the ones we got
+        claimed = await self._run_command(
+            "SELECT coalesce(array_agg(id), '{}') FROM unnest($2::int[]) AS id WHERE pg_try_advisory_lock($1, id)",
+            ROOM_LOCK_NAMESPACE, list(room_ids)
+        )
+        return set(claimed)
+
+    async def release_room(self, room_id: int):
+        try:
+            await self._run_command("SELECT pg_advisory_unlock($1, $2)", ROOM_LOCK_NAMESPACE, room_id)
+        except RoomUnavailableError as e:
+            # Without its session the lock is gone already
+            print(f"Could not release room {room_id}: {e}")
+
+
+class RoomRelay:
+    """
+    Routes game room traffic between workers. Sockets register here under a
+    connection id that is unique across workers; the room's owner addresses
+    frames to rooms or to single connection ids and the relay delivers them,
+    locally or through the bus.
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.bus.set_handler(self._on_message)
+        self.bus.set_locks_lost_handler(self._reclaim_rooms)
+        # room_id -> connection id -> socket, for the sockets of *this* worker
+        self.local_connections: Dict[int, Dict[str, OutboundConnection]] = {}
+        self._owned_rooms: Set[int] = set()
+        # Owned rooms only: the entry goes when the room is released
+        self._room_locks: Dict[int, asyncio.Lock] = {}
+        # Command id -> result, for forwarded commands this worker ran as owner
+        self._command_results: "OrderedDict[str, Optional[dict]]" = OrderedDict()
+        self._command_handler: Optional[CommandHandler] = None
+        # Command type -> handler, for the commands that aren't about a game room
+        self._typed_command_handlers: Dict[str, CommandHandler] = {}
+        self._message_handlers: Dict[str, MessageHandler] = {}
+        self._pending_replies: Dict[str, asyncio.Future] = {}
+        self._connection_ids = itertools.count(1)
+
+    def set_command_handler(self, handler: CommandHandler, command_types: Iterable[str] = ()):
+        # Runs commands for the rooms this worker owns (routers/tictactoe.py).
+        # With command_types, only commands of those types go to this handler;
+        # other owned things (matchmaking queues) use those under ids of their own.
+        if not command_types:
+            self._command_handler = handler
+        for command_type in command_types:
+            self._typed_command_handlers[command_type] = handler
+
+    def subscribe(self, kind: str, handler: MessageHandler):
+        # Extra message kinds, e.g. cache invalidations that every worker must apply
+        self._message_handlers[kind] = handler
+
+    async def start(self):
+        await self.bus.start()
+
+    async def stop(self):
+        await self.bus.stop()
+        self._owned_rooms.clear()
+
+    def snapshot(self) -> dict:
+        return {
+            "backend": ROOM_EVENT_BUS,
+            "worker_id": WORKER_ID,
+            "owned_rooms": len(self._owned_rooms),
+            "room_locks": len(self._room_locks),
+            "local_rooms": len(self.local_connections),
+            "pending_commands": len(self._pending_replies),
+            "listen_reconnects": getattr(self.bus, "listen_reconnects", 0),
+            "command_reconnects": getattr(self.bus, "command_reconnects", 0),
+        }
+
+    # --- Local sockets ---
+
+    def register(self, room_id: int, connection: OutboundConnection) -> str:
+        connection_id = f"{WORKER_ID}:{next(self._connection_ids)}"
+        self.local_connections.setdefault(room_id, {})[connection_id] = connection
+        return connection_id
+
+    def unregister(self, room_id: int, connection_id: str):
+        connections = self.local_connections.get(room_id)
+        if connections is None:
+            return
+        connections.pop(connection_id, None)
+        if not connections:
+            self.local_connections.pop(room_id, None)
+
+    # --- Frames, called by the room's owner ---
+
+    def broadcast(self, room_id: int, payload: dict):
+        fan_out(self.local_connections.get(room_id, {}).values(), payload)
+        if self.bus.distributed:
+            self.bus.publish({"kind": "frame", "room": room_id, "payload": payload})
+
+    def send(self, room_id: int, connection_id: str, payload: dict):
+        connection = self.local_connections.get(room_id, {}).get(connection_id)
+        if connection is not None:
+            connection.send_json(payload)
+        elif self.bus.distributed:
+            self.bus.publish({"kind": "frame", "room": room_id, "to": connection_id, "payload": payload})
+
+    def publish(self, kind: str, message: dict):
+        # Fire-and-forget message to every other worker
+        if self.bus.distributed:
+            self.bus.publish({**message, "kind": kind})
+
+    # --- Room ownership and commands ---
+
+    def owns(self, room_id: int) -> bool:
+        return room_id in self._owned_rooms and self.bus.holds_locks
+
+    async def _claim(self, room_id: int) -> bool:
+        if room_id in self._owned_rooms:
+            return True
+        if not await self.bus.claim_room(room_id):
+            return False
+        if room_id in self._owned_rooms:
+            # Claimed twice at once. Advisory locks are reentrant per session,
+            # so give the extra one back or a release would never free the room.
+            await self.bus.release_room(room_id)
+        self._owned_rooms.add(room_id)
+        return True
+
+    async def _reclaim_rooms(self):
+        # The bus reconnected, and the locks of every room we owned went with its
+        # old session. Another worker may have claimed some of them meanwhile;
+        # the rest are ours again. Nothing runs as owner until they're sorted out.
+        rooms, self._owned_rooms = self._owned_rooms, set()
+        if not rooms:
+            return
+        try:
+            claimed = await self.bus.claim_rooms(rooms)
+        except RoomUnavailableError as e:
+            print(f"Could not claim back {len(rooms)} room(s): {e}")
+            claimed = set()
+        self._owned_rooms.update(claimed)
+        lost = rooms - claimed
+        for room_id in lost:
+            self._room_locks.pop(room_id, None)
+        if lost:
+            # Our copies of those games are stale now; should we own them again,
+            # their next flush conflicts and reloads the saved boards
+            print(f"Lost ownership of room(s) {sorted(lost)} to another worker.")
+
+    async def release(self, room_id: int):
+        # Called by the owner (from its command handler) once the room is empty
+        if room_id in self._owned_rooms:
+            self._owned_rooms.discard(room_id)
+            self._room_locks.pop(room_id, None)
+            await self.bus.release_room(room_id)
+
+    async def _run_owned(self, room_id: int, command: dict, command_id: Optional[str] = None):
+        # Commands for one room run one at a time on its owner
+        if not self.owns(room_id):
+            return _NOT_OWNER
+        lock = self._room_locks.setdefault(room_id, asyncio.Lock())
+        async with lock:
+            if not self.owns(room_id) or self._room_locks.get(room_id) is not lock:
+                # Released while this command was waiting; if it was claimed
+                # again since, that's under a new lock, with commands of its own
+                return _NOT_OWNER
+            if command_id in self._command_results:
+                # A retry of a command we already ran: its reply got lost or was late
+                return self._command_results[command_id]
+            handler = self._typed_command_handlers.get(command.get("type"), self._command_handler)
+            result = await handler(room_id, command)
+            if command_id is not None:
+                self._command_results[command_id] = result
+                while len(self._command_results) > ROOM_COMMAND_RESULTS_KEPT:
+                    self._command_results.popitem(last=False)
+            return result
+
+    async def dispatch(self, room_id: int, command: dict) -> Optional[dict]:
+        # Run a command on the room's owner, claiming the room if nobody has it.
+        # Every attempt carries the same command id, so an owner that already
+        # ran it answers the retry from its results instead of running it twice,
+        # and a late reply to the first attempt still counts.
+        command_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending_replies[command_id] = future
+        try:
+            for _ in range(2):
+                if await self._claim(room_id):
+                    result = await self._run_owned(room_id, command, command_id)
+                    if result is not _NOT_OWNER:
+                        return result
+                    continue
+
+                self.bus.publish({"kind": "command", "room": room_id, "request_id": command_id, "command": command})
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future), ROOM_COMMAND_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    # The owner released the room or died in the meantime; try once to take over
+                    continue
+        finally:
+            self._pending_replies.pop(command_id, None)
+        raise RoomUnavailableError(f"No worker could take ownership of room {room_id}")
+
+    async def _on_message(self, message: dict):
+        kind = message.get("kind")
+        room_id = message.get("room")
+
+        if kind == "frame":
+            connections = self.local_connections.get(room_id, {})
+            if "to" in message:
+                connection = connections.get(message["to"])
+                if connection is not None:
+                    connection.send_json(message["payload"])
+            else:
+                fan_out(connections.values(), message["payload"])
+
+        elif kind == "command":
+            # Every worker sees it; only the owner answers
+            if not self.owns(room_id):
+                return
+            result = await self._run_owned(room_id, message["command"], message["request_id"])
+            if result is _NOT_OWNER:
+                return  # the sender times out and claims the room itself
+            self.bus.publish({"kind": "reply", "to": message["origin"], "request_id": message["request_id"], "result": result})
+
+        elif kind == "reply":
+            future = self._pending_replies.get(message["request_id"])
+            if message["to"] == WORKER_ID and future is not None and not future.done():
+                future.set_result(message["result"])
+
+        elif kind in self._message_handlers:
+            await self._message_handlers[kind](message)
+
+
+def create_event_bus():
+    if ROOM_EVENT_BUS == "postgres":
+        return PostgresEventBus(POSTGRESQL_DATABASE_URL)
+    if ROOM_EVENT_BUS != "memory":
+        raise ValueError(f"Unknown ROOM_EVENT_BUS '{ROOM_EVENT_BUS}', expected 'memory' or 'postgres'")
+    return InProcessEventBus()
+
+
+room_relay = RoomRelay(create_event_bus())
@@ -0,0 +1,170 @@
+# business/frame_protocol_operations.py
+# Compact binary encoding of the game socket frames, for clients that ask
+# for the BINARY_SUBPROTOCOL WebSocket subprotocol. Everyone else keeps
+# getting the JSON frames unchanged.
+#
+# The room code keeps producing the same dict payloads; each binary socket
+# has a FrameEncoder that turns them into struct-packed frames. The encoder
+# remembers the board it last sent to its client, so a move goes out as a
+# delta (one cell plus the board version as sequence number, 13 bytes) and
+# full snapshots are only needed on join, restart and resync. Frames with no
+# binary form (chat-like messages, errors, draw offers) still go out as JSON
+# text frames on the same socket, encoded by encode_frame like everyone's.
+# All integers are big-endian. seq is the room's event number (0 for frames
+# sent to one player only), which is what a reconnecting client resumes from.
+#
+#   SNAPSHOT  B type=1, B action, I seq, I version, b turn, B status, b player_index, H cells, cells packed 2 bits each
+#   DELTA     B type=2, I seq, I version, H cell, B mark (1/2), B current_turn
+#   GAME_OVER B type=3, I seq, I version, B result
+import json
+import struct
+from typing import Dict, List, Optional
+
+from business.broadcast_operations import Frame, encode_frame
+from business.game_state_operations import FINISHED_STATUSES
+
+BINARY_SUBPROTOCOL = "tictactoe.binary.v1"
+
+FRAME_SNAPSHOT = 1
+FRAME_DELTA = 2
+FRAME_GAME_OVER = 3
+
+SNAPSHOT_HEADER = struct.Struct("!BBIIbBbH")
+DELTA = struct.Struct("!BIIHBB")
+GAME_OVER = struct.Struct("!BIIB")
+
+# Which frame a snapshot stands in for
+SNAPSHOT_ACTIONS = ["initial_state", "game_ready", "game_restart", "board_sync", "update"]
+STATUSES = ["ongoing", *FINISHED_STATUSES]
+GAME_RESULTS = ["Player 0 wins!", "Player 1 wins!", "It's a draw!", "draw_agreed"]
+
+
+def pack_cells(cells: List[int]) -> bytes:
+    # 2 bits per cell (0 empty, 1 X, 2 O), four cells per byte
+    packed = bytearray((len(cells) + 3) // 4)
+    for index, cell in enumerate(cells):
+        packed[index // 4] |= cell << (2 * (index % 4))
+    return bytes(packed)
+
+
+def unpack_cells(packed: bytes, count: int) -> List[int]:
+    return [packed[index // 4] >> (2 * (index % 4)) & 3 for index in range(count)]
+
+
+class FrameEncoder:
+    # Drop-in for broadcast_operations.JsonEncoder on binary sockets
+    binary = True
+
+    def __init__(self):
+        # What this client has been told: the board it holds and its version
+        self.board: Optional[List[int]] = None
+        self.version: Optional[int] = None
+
+    def encode(self, payload: dict) -> List[Frame]:
+        action = payload.get("action")
+        board = payload.get("board", payload.get("current_board"))
+        version = payload.get("version")
+        seq = payload.get("seq", 0)
+
+        if action == "update" and board is not None and version is not None:
+            cell = self._single_new_cell(board, version)
+            frames = [
+                DELTA.pack(FRAME_DELTA, seq, version, cell, board[cell], payload["current_turn"])
+                if cell is not None else self._snapshot(payload, board, version)
+            ]
+        elif action in SNAPSHOT_ACTIONS and board is not None and version is not None:
+            frames = [self._snapshot(payload, board, version)]
+        elif action == "game_over" and version is not None and payload.get("result") in GAME_RESULTS:
+            frames = []
+            if board is not None and (board != self.board or version != self.version):
+                # The client missed the final board: send it before the result
+                frames.append(self._snapshot({"action": "update"}, board, version))
+            frames.append(GAME_OVER.pack(FRAME_GAME_OVER, seq, version, GAME_RESULTS.index(payload["result"])))
+        else:
+            frames = [encode_frame(payload)]
+
+        if board is not None and version is not None:
+            # Conflict errors carry a board in JSON too; keep tracking what the client holds
+            self.board, self.version = list(board), version
+        return frames
+
+    def _single_new_cell(self, board: List[int], version: int) -> Optional[int]:
+        # A delta only works on top of exactly the previous board
+        if self.board is None or version != self.version + 1 or len(board) != len(self.board):
+            return None
+        changed = [cell for cell, (before, after) in enumerate(zip(self.board, board)) if before != after]
+        if len(changed) != 1 or self.board[changed[0]] != 0:
+            return None
+        return changed[0]
+
+    def _snapshot(self, payload: dict, board: List[int], version: int) -> bytes:
+        turn = payload.get("turn", payload.get("current_turn"))
+        status = payload.get("status", "ongoing")
+        player_index = payload.get("player_index")
+        return SNAPSHOT_HEADER.pack(
+            FRAME_SNAPSHOT,
+            SNAPSHOT_ACTIONS.index(payload["action"]),
+            payload.get("seq", 0),
+            version,
+            -1 if turn is None else turn,
+            STATUSES.index(status) if status in STATUSES else 0,
+            -1 if player_index is None else player_index,
+            len(board),
+        ) + pack_cells(board)
+
+
+class FrameDecoder:
+    # The client side of FrameEncoder, turning frames back into the JSON
+    # payload shapes. Used by tools/loadtest.py; the frontend has its own copy.
+    def __init__(self):
+        self.board: Optional[List[int]] = None
+        self.version: Optional[int] = None
+
+    def decode(self, frame: Frame) -> Optional[dict]:
+        # None: a delta that doesn't follow the board we hold; ask for a resync
+        if isinstance(frame, str):
+            payload = json.loads(frame)
+            board = payload.get("board", payload.get("current_board"))
+            if board is not None and payload.get("version") is not None:
+                self.board, self.version = list(board), payload["version"]
+            return payload
+
+        if frame[0] == FRAME_DELTA:
+            _, seq, version, cell, mark, current_turn = DELTA.unpack(frame)
+            if self.board is None or version != self.version + 1:
+                return None
+            self.board[cell] = mark
+            self.version = version
+            return self._with_seq({
+                "action": "update",
+                "board": list(self.board),
+                "last_move_by": mark - 1,
+                "current_turn": current_turn,
+                "version": version,
+            }, seq)
+
+        if frame[0] == FRAME_GAME_OVER:
+            _, seq, version, result = GAME_OVER.unpack(frame)
+            return self._with_seq({
+                "action": "game_over", "result": GAME_RESULTS[result], "board": list(self.board or []), "version": version
+            }, seq)
+
+        _, action, seq, version, turn, status, player_index, cells = SNAPSHOT_HEADER.unpack_from(frame)
+        self.board = unpack_cells(frame[SNAPSHOT_HEADER.size:], cells)
+        self.version = version
+        payload: Dict[str, object] = {
+            "action": SNAPSHOT_ACTIONS[action],
+            "board": list(self.board),
+            "turn": turn,
+            "current_turn": turn,
+            "status": STATUSES[status],
+            "version": version,
+        }
+        if player_index >= 0:
+            payload["player_index"] = player_index
+        return self._with_seq(payload, seq)
+
+    def _with_seq(self, payload: dict, seq: int) -> dict:
+        if seq:
+            payload["seq"] = seq
+        return payload
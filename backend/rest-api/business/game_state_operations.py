@@ -0,0 +1,432 @@
+# business/game_state_operations.py
+# Authoritative in-memory state for live games. Moves are validated and
+# applied here, without touching the database; a background task appends
+# them to the RoomMove log in batches (write-behind), and they are flushed
+# right away when a game ends or the server shuts down.
+#
+# Every change to a board bumps its version and becomes one log row keyed by
+# (room, version). Room.position is only rewritten as a snapshot every
+# GAME_SNAPSHOT_EVERY_MOVES changes and when a game is released; loading a
+# game replays the log rows after the snapshot. A worker holding a stale copy
+# (e.g. a former owner of the room) can't append over a newer history: its
+# rows collide on the key, none of its batch is written, and it reloads the
+# saved board instead.
+import asyncio
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import Integer, column, select, update, values
+from sqlalchemy.dialects.postgresql import ARRAY, INTEGER, insert
+from sqlalchemy.exc import IntegrityError
+
+from business.board_operations import Board
+from business.catalog_operations import game_catalog
+from business.database_operations import open_postgresql_session, postgresql_engine
+from models.games import CLEAR_BOARD, DRAW_AGREED, Room, RoomMove
+
+GAME_STATE_FLUSH_INTERVAL_SECONDS = float(os.getenv("GAME_STATE_FLUSH_INTERVAL_SECONDS", "0.5"))
+GAME_STATE_FLUSH_BATCH_SIZE = int(os.getenv("GAME_STATE_FLUSH_BATCH_SIZE", "500"))
+# Board changes between two snapshots in Room.position, i.e. the most a load replays
+GAME_SNAPSHOT_EVERY_MOVES = int(os.getenv("GAME_SNAPSHOT_EVERY_MOVES", "16"))
+# Broadcast frames kept per live game for players who reconnect
+GAME_REPLAY_EVENTS = int(os.getenv("GAME_REPLAY_EVENTS", "64"))
+# Board changes remembered per live game to recognize a move sent twice
+GAME_RECENT_MOVES = int(os.getenv("GAME_RECENT_MOVES", "16"))
+
+ROOM_NOT_FOUND_ERROR = "Invalid room ID. Please provide a valid room ID."
+GAME_CONFIG_MISSING_ERROR = "Game configuration not found for this room."
+BOARD_VERSION_CONFLICT_ERROR = "The board has changed since you last saw it. Reload it and try again."
+
+FINISHED_STATUSES = ("win", "tie", "draw_agreed", "player_left", "player_disconnected")
+
+
+@dataclass
+class GameState:
+    room_id: int
+    board: Board
+    number_of_players: int
+    turn: int = 0
+    status: str = "ongoing"
+    draw_offered_by: Optional[int] = None
+    # Seated sockets in player order, as relay connection ids (they may live on other workers)
+    players: List[str] = field(default_factory=list)
+    version: int = 0           # of the board in memory
+    logged_version: int = 0    # last change in the RoomMove log
+    snapshot_version: int = 0  # Room.version, i.e. the board in Room.position
+    # Changes not in the log yet: (version, player mark, cell)
+    unlogged: List[Tuple[int, int, int]] = field(default_factory=list)
+    # Resume token -> the seat it belongs to (business/resume_operations.py)
+    resume_tokens: Dict[str, str] = field(default_factory=dict)
+    # The last broadcast frames, numbered by event_seq, for replay on resume
+    event_seq: int = 0
+    recent_events: Deque[dict] = field(default_factory=lambda: deque(maxlen=GAME_REPLAY_EVENTS))
+    # The last board changes in memory: (version, player mark, cell)
+    recent_moves: Deque[Tuple[int, int, int]] = field(default_factory=lambda: deque(maxlen=GAME_RECENT_MOVES))
+
+
+@dataclass
+class MoveOutcome:
+    board: List[int]
+    current_turn: int
+    winner: Optional[int] = None  # board mark (1 or 2) of the winner
+    tie: bool = False
+    version: int = 0
+
+
+class GameStateEngine:
+    def __init__(self):
+        self._states: Dict[int, GameState] = {}
+        self._loading: Dict[int, asyncio.Task] = {}
+        self._dirty: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        # One flush at a time, so log rows and snapshots go out in version order
+        self._flush_lock = asyncio.Lock()
+        # Finished games waiting for their durable flush, and the task writing them
+        self._finished: Set[int] = set()
+        self._finished_task: Optional[asyncio.Task] = None
+        self._conflict_handler: Optional[Callable[[GameState], Awaitable[None]]] = None
+        self.version_conflicts = 0
+
+    def set_conflict_handler(self, handler: Callable[[GameState], Awaitable[None]]):
+        # Told about games whose board was replaced by the saved one (routers/tictactoe.py)
+        self._conflict_handler = handler
+
+    # --- Loading / releasing live games ---
+
+    def get(self, room_id: int) -> Optional[GameState]:
+        return self._states.get(room_id)
+
+    async def get_or_load(self, room_id: int) -> Tuple[Optional[GameState], Optional[str]]:
+        state = self._states.get(room_id)
+        if state is not None:
+            return state, None
+
+        # Several sockets may connect at once; only one of them hits the database
+        task = self._loading.get(room_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(room_id))
+            self._loading[room_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(room_id, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, room_id: int) -> Tuple[Optional[GameState], Optional[str]]:
+        async with open_postgresql_session() as session:
+            room = await session.get(Room, room_id)
+            if not room:
+                return None, ROOM_NOT_FOUND_ERROR
+            moves = await self._moves_after(session, [(room_id, room.version)])
+        game = game_catalog.by_id(room.type_of_game_id)
+        if not game:
+            return None, GAME_CONFIG_MISSING_ERROR
+
+        # Ensure the board is correctly initialized *if it's empty/malformed*
+        expected_board_size = getattr(game, 'board_size', 9) # Assuming board_size on Game model or default to 9
+        win_length = getattr(game, 'win_length', None) # k-in-a-row; defaults to the board width
+        position = list(room.position or [])
+        state = GameState(
+            room_id=room_id,
+            board=Board.empty(expected_board_size, win_length),
+            number_of_players=game.number_of_players,
+            version=room.version,
+            logged_version=room.version,
+            snapshot_version=room.version,
+        )
+        if len(position) == expected_board_size:
+            state.board = Board.from_list(position, win_length)
+            self._replay(state, moves.get(room_id, []))
+        else:
+            self._changed(state, 0, CLEAR_BOARD)
+
+        self._states[room_id] = state
+        return state, None
+
+    async def _moves_after(self, session, rooms: List[Tuple[int, int]]) -> Dict[int, List[Tuple[int, int, int]]]:
+        # Log rows from each room's snapshot version on, in order: the row of
+        # the snapshot itself is already on the board, but tells _replay how the
+        # game stood. Rows of different rooms are keyed apart, so one query
+        # serves any number of rooms.
+        if not rooms:
+            return {}
+        snapshots = values(column("room_id", Integer), column("version", Integer), name="snapshots").data(rooms)
+        rows = (await session.exec(
+            select(RoomMove.room_id, RoomMove.seq, RoomMove.player, RoomMove.cell)
+            .join(snapshots, (RoomMove.room_id == snapshots.c.room_id) & (RoomMove.seq >= snapshots.c.version))
+            .order_by(RoomMove.room_id, RoomMove.seq)
+        )).all()
+        moves: Dict[int, List[Tuple[int, int, int]]] = {}
+        for room_id, seq, player, cell in rows:
+            moves.setdefault(room_id, []).append((seq, player, cell))
+        return moves
+
+    def _replay(self, state: GameState, moves: List[Tuple[int, int, int]]):
+        draw_agreed = False
+        for seq, player, cell in moves:
+            draw_agreed = cell == DRAW_AGREED
+            if seq <= state.version:
+                continue  # already in the snapshot
+            if cell in (CLEAR_BOARD, DRAW_AGREED):
+                state.board.clear()
+            else:
+                state.board.place(cell, player)
+            state.version = seq
+        state.logged_version = state.version
+        # Whose turn and whether the game is over follow from the board, except
+        # for an agreed draw: its board is empty, only the log knows it ended
+        marks = state.board.to_list()
+        state.turn = 0 if marks.count(1) == marks.count(2) else 1
+        if draw_agreed:
+            state.status = "draw_agreed"
+        else:
+            state.status = "win" if state.board.winner() else "tie" if state.board.is_full() else "ongoing"
+        state.draw_offered_by = None
+
+    async def release(self, room_id: int):
+        # Last player left: persist whatever is pending, snapshot, and forget the game
+        await self.flush([room_id], snapshot=True)
+        self._states.pop(room_id, None)
+
+    async def history(self, room_id: int, after: int = 0) -> List[dict]:
+        # The room's logged moves (replays, spectators, analysis); pending ones first go out
+        if room_id in self._states:
+            await self.flush([room_id])
+        async with open_postgresql_session() as session:
+            rows = (await session.exec(
+                select(RoomMove.seq, RoomMove.player, RoomMove.cell)
+                .where(RoomMove.room_id == room_id)
+                .where(RoomMove.seq > after)
+                .order_by(RoomMove.seq)
+            )).all()
+        return [{"seq": seq, "player": player, "cell": cell} for seq, player, cell in rows]
+
+    # --- Game rules, all applied in memory ---
+
+    def _changed(self, state: GameState, player: int, cell: int):
+        state.version += 1
+        state.unlogged.append((state.version, player, cell))
+        state.recent_moves.append((state.version, player, cell))
+        self._dirty.add(state.room_id)
+
+    def is_repeat(self, state: GameState, player_index: int, pos, expected_version: Optional[int]) -> bool:
+        # The expected version is the move's idempotency key: the same player
+        # and cell on top of the same version is a move that already went
+        # through (a retry or a second copy), not a new one
+        return expected_version is not None and (expected_version + 1, player_index + 1, pos) in state.recent_moves
+
+    def make_move(
+        self, state: GameState, player_index: int, pos, expected_version: Optional[int] = None
+    ) -> Tuple[Optional[MoveOutcome], Optional[str]]:
+        # expected_version: the board version the client based its move on, if it sent one
+        if expected_version is not None and expected_version != state.version:
+            return None, BOARD_VERSION_CONFLICT_ERROR
+        if state.status != "ongoing":
+            return None, "Game already ended."
+        if state.turn != player_index:
+            return None, "Not your turn."
+        if not isinstance(pos, int) or pos < 0 or pos >= len(state.board):
+            return None, "Invalid position."
+        if not state.board.is_empty(pos):
+            return None, "Position already taken."
+
+        mark = player_index + 1
+        state.board.place(pos, mark)
+        state.draw_offered_by = None
+        self._changed(state, mark, pos)
+
+        outcome = MoveOutcome(board=state.board.to_list(), current_turn=state.turn, version=state.version)
+        if state.board.wins_with(pos):
+            outcome.winner = mark
+            state.status = "win"
+        elif state.board.is_full():
+            outcome.tie = True
+            state.status = "tie"
+        else:
+            state.turn = 1 - state.turn
+            outcome.current_turn = state.turn
+        return outcome, None
+
+    def agree_draw(self, state: GameState):
+        state.board.clear()
+        state.status = "draw_agreed"
+        state.draw_offered_by = None
+        self._changed(state, 0, DRAW_AGREED)
+
+    def restart(self, state: GameState):
+        state.board.clear()
+        state.status = "ongoing"
+        state.turn = 0
+        state.draw_offered_by = None
+        self._changed(state, 0, CLEAR_BOARD)
+
+    # --- Write-behind persistence ---
+
+    async def flush(self, room_ids: Optional[Iterable[int]] = None, snapshot: bool = False):
+        # snapshot=True: also write Room.position for these games, however few moves behind
+        async with self._flush_lock:
+            await self._flush(room_ids, snapshot)
+
+    def flush_soon(self, room_id: int):
+        # A game ended: write its final board now rather than on the next batch,
+        # but without making the caller (a room command) wait for the flush lock.
+        # Games that end meanwhile go out together in the next flush.
+        self._finished.add(room_id)
+        if self._finished_task is None or self._finished_task.done():
+            self._finished_task = asyncio.ensure_future(self._flush_finished())
+
+    async def _flush_finished(self):
+        while self._finished:
+            room_ids, self._finished = self._finished, set()
+            await self.flush(room_ids)
+
+    async def _flush(self, room_ids: Optional[Iterable[int]], snapshot: bool):
+        if room_ids is None:
+            pending = set(self._dirty)
+        else:
+            room_ids = set(room_ids)
+            pending = self._dirty.intersection(room_ids)
+        if snapshot:
+            pending.update(
+                room_id for room_id, state in self._states.items()
+                if (room_ids is None or room_id in room_ids) and state.version > state.snapshot_version
+            )
+        # Games that were released in the meantime have nothing left to write
+        self._dirty.difference_update(room_id for room_id in pending if room_id not in self._states)
+        pending = [room_id for room_id in pending if room_id in self._states]
+        if not pending:
+            return
+
+        # Take the pending changes now; moves made while we write go to the next flush
+        self._dirty.difference_update(pending)
+        taken: Dict[int, List[Tuple[int, int, int]]] = {}
+        for room_id in pending:
+            state = self._states[room_id]
+            taken[room_id], state.unlogged = state.unlogged, []
+        move_rows = [
+            {"room_id": room_id, "seq": seq, "player": player, "cell": cell}
+            for room_id, moves in taken.items()
+            for seq, player, cell in moves
+        ]
+
+        conflicts: Set[int] = set()
+        snapshots = []
+        try:
+            async with postgresql_engine.begin() as connection:
+                if move_rows:
+                    conflicts = await self._append_moves(connection, taken, move_rows)
+                for room_id in pending:
+                    state = self._states[room_id]
+                    due = snapshot or state.version - state.snapshot_version >= GAME_SNAPSHOT_EVERY_MOVES
+                    if due and room_id not in conflicts and state.version > state.snapshot_version:
+                        snapshots.append((room_id, state.board.to_list(), state.version))
+                for start in range(0, len(snapshots), GAME_STATE_FLUSH_BATCH_SIZE):
+                    await connection.execute(self._snapshot_statement(snapshots[start:start + GAME_STATE_FLUSH_BATCH_SIZE]))
+        except Exception as e:
+            for room_id, moves in taken.items():
+                state = self._states.get(room_id)
+                if state is not None:
+                    state.unlogged = moves + state.unlogged
+            self._dirty.update(pending)
+            print(f"Failed to persist the moves of {len(pending)} game(s), will retry: {e}")
+            return
+
+        for room_id, moves in taken.items():
+            state = self._states.get(room_id)
+            if state is not None and moves and room_id not in conflicts:
+                state.logged_version = moves[-1][0]
+        for room_id, _, version in snapshots:
+            state = self._states.get(room_id)
+            if state is not None:
+                state.snapshot_version = version
+        if conflicts:
+            await self._reload_saved_boards(sorted(conflicts))
+
+    async def _append_moves(self, connection, taken: Dict[int, List[Tuple[int, int, int]]], move_rows: List[dict]) -> Set[int]:
+        # A (room, seq) that is already taken means someone else extended that
+        # room's history. A room's batch goes in whole or not at all, so a stale
+        # copy never leaves rows interleaved with the other worker's.
+        try:
+            # Usually nothing collides: one multi-row INSERT for every room
+            async with connection.begin_nested():
+                await connection.execute(insert(RoomMove), move_rows)
+            return set()
+        except IntegrityError:
+            pass
+        conflicts: Set[int] = set()
+        for room_id, moves in taken.items():
+            if not moves:
+                continue
+            try:
+                async with connection.begin_nested():
+                    await connection.execute(insert(RoomMove), [
+                        {"room_id": room_id, "seq": seq, "player": player, "cell": cell}
+                        for seq, player, cell in moves
+                    ])
+            except IntegrityError:
+                conflicts.add(room_id)
+        return conflicts
+
+    def _snapshot_statement(self, rows: List[tuple]):
+        # One UPDATE for the whole batch. A snapshot only ever moves forward,
+        # so a late flush can't put an older board back.
+        boards = values(
+            column("id", Integer),
+            column("position", ARRAY(INTEGER)),
+            column("version", Integer),
+            name="boards",
+        ).data(rows)
+        room = Room.__table__
+        return (
+            update(room)
+            .where(room.c.id == boards.c.id)
+            .where(room.c.version < boards.c.version)
+            .values(position=boards.c.position, version=boards.c.version)
+        )
+
+    async def _reload_saved_boards(self, room_ids: List[int]):
+        # Someone else wrote these games' history since we loaded them: the
+        # saved board (snapshot plus log) wins over our copy
+        self.version_conflicts += len(room_ids)
+        print(f"Board version conflict in room(s) {room_ids}; reloading the saved boards.")
+        async with open_postgresql_session() as session:
+            saved = (await session.exec(
+                select(Room.id, Room.position, Room.version).where(Room.id.in_(room_ids))
+            )).all()
+            moves = await self._moves_after(session, [(room_id, version) for room_id, _, version in saved])
+        for room_id, position, version in saved:
+            state = self._states.get(room_id)
+            if state is None or len(position or []) != len(state.board):
+                continue
+            state.board = Board.from_list(list(position), state.board.k)
+            state.version = state.snapshot_version = version
+            state.unlogged = []
+            state.recent_moves.clear()  # those versions now belong to the saved history
+            self._dirty.discard(room_id)
+            self._replay(state, moves.get(room_id, []))
+            if self._conflict_handler is not None:
+                await self._conflict_handler(state)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(GAME_STATE_FLUSH_INTERVAL_SECONDS)
+            await self.flush()
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self._finished_task is not None:
+            await self._finished_task
+        # Durable flush of everything still pending before the process exits
+        await self.flush(snapshot=True)
+
+
+game_state_engine = GameStateEngine()
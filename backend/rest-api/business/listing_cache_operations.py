@@ -0,0 +1,104 @@
+# business/listing_cache_operations.py
+# Conditional GET support for the lobby listings. A listing's ETag is a hash
+# of what it serves, so every worker (and every run) hands out the same tag
+# for the same rooms, and a client can revalidate against any of them.
+#
+# Each game type has a room version that every room change bumps (through the
+# lobby feed, so changes made on other workers count too), and the game
+# catalog has a version of its own. The serialized body and its ETag are kept
+# under the version they were read at; while that is current, a matching
+# If-None-Match gets a 304 and an unchanged listing is served from memory,
+# both without touching Postgres. Otherwise the listing is read again, and
+# still answered with a 304 if it came out the same.
+import hashlib
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+# Clients may reuse a listing but have to revalidate it every time
+LISTING_CACHE_CONTROL = "no-cache"
+
+
+def listing_etag(body: bytes, headers: Dict[str, str]) -> str:
+    digest = hashlib.blake2b(body, digest_size=12)
+    for name, value in sorted(headers.items()):
+        digest.update(f"\n{name}: {value}".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    candidates = (candidate.strip() for candidate in if_none_match.split(","))
+    return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+class ListingCache:
+    def __init__(self):
+        self.catalog_version = 0
+        self._room_versions: Dict[int, int] = {}
+        # listing key -> (version it was read at, ETag, serialized body, extra headers)
+        self._bodies: Dict[str, Tuple[int, str, bytes, Dict[str, str]]] = {}
+        self.not_modified = 0
+        self.served_from_memory = 0
+        self.rebuilt = 0
+
+    # --- Versions ---
+
+    def bump_rooms(self, game_id: int):
+        self._room_versions[game_id] = self._room_versions.get(game_id, 0) + 1
+
+    def bump_catalog(self):
+        self.catalog_version += 1
+
+    def rooms_version(self, game_id: int) -> int:
+        return self._room_versions.get(game_id, 0)
+
+    # --- Responses ---
+
+    def cached_response(self, key: Optional[str], version: int, request: Request) -> Optional[Response]:
+        # Take the version *before* reading the data, so a change made meanwhile
+        # leaves the stored body under the older version
+        cached = self._bodies.get(key) if key is not None else None
+        if cached is None or cached[0] != version:
+            return None
+        _, etag, body, headers = cached
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=self._headers(etag))
+        self.served_from_memory += 1
+        return self._json_response(etag, body, headers)
+
+    def store_response(
+        self, key: Optional[str], version: int, body: bytes, request: Request, headers: Optional[Dict[str, str]] = None
+    ) -> Response:
+        # key=None: answer without keeping the body (e.g. deep pages nobody polls)
+        headers = headers or {}
+        etag = listing_etag(body, headers)
+        if key is not None:
+            self._bodies[key] = (version, etag, body, headers)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            # Read again, but the client's copy is still what we'd send
+            self.not_modified += 1
+            return Response(status_code=304, headers=self._headers(etag))
+        self.rebuilt += 1
+        return self._json_response(etag, body, headers)
+
+    def _json_response(self, etag: str, body: bytes, headers: Dict[str, str]) -> Response:
+        return Response(content=body, media_type="application/json", headers={**headers, **self._headers(etag)})
+
+    def _headers(self, etag: str) -> Dict[str, str]:
+        return {"ETag": etag, "Cache-Control": LISTING_CACHE_CONTROL}
+
+    def metrics(self) -> dict:
+        return {
+            "not_modified": self.not_modified,
+            "served_from_memory": self.served_from_memory,
+            "rebuilt": self.rebuilt,
+        }
+
+
+listing_cache = ListingCache()
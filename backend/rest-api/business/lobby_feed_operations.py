@@ -0,0 +1,101 @@
+# business/lobby_feed_operations.py
+# Push feed for the lobby. Instead of every open lobby polling
+# /available_rooms, subscribers get one snapshot of the open rooms of a game
+# and then a diff whenever a room is created, fills up, frees a seat, changes
+# player count or is deleted. Diffs come from the lobby endpoints right after
+# they commit, and are relayed to the lobby sockets of every worker.
+from typing import Dict, List, Optional, Set
+
+from business.broadcast_operations import OutboundConnection, fan_out
+from business.event_bus_operations import room_relay
+from business.listing_cache_operations import listing_cache
+from models.games import Room
+
+# Diff actions sent to subscribers
+ROOM_CREATED = "room_created"
+ROOM_FILLED = "room_filled"    # no longer joinable: drop it from the list
+ROOM_FREED = "room_freed"      # joinable again: add it back
+ROOM_UPDATED = "room_updated"  # player count changed, still joinable
+ROOM_DELETED = "room_deleted"
+
+
+def room_summary(room: Room, players: int, max_players: int) -> dict:
+    # What the lobby list shows; never includes the room password itself
+    return {
+        "id": room.id,
+        "type_of_game_id": room.type_of_game_id,
+        "available": room.available,
+        "private": bool(room.password),
+        "players": players,
+        "max_players": max_players,
+    }
+
+
+def room_change_action(was_available: bool, is_available: bool) -> str:
+    if was_available and not is_available:
+        return ROOM_FILLED
+    if is_available and not was_available:
+        return ROOM_FREED
+    return ROOM_UPDATED
+
+
+class LobbyFeed:
+    def __init__(self):
+        # game id -> lobby sockets watching that game's rooms, on this worker
+        self._subscribers: Dict[int, Set[OutboundConnection]] = {}
+        # Subscribers still waiting for their snapshot; their diffs are held back
+        self._pending: Dict[OutboundConnection, List[dict]] = {}
+
+    def subscribe(self, game_id: int, connection: OutboundConnection):
+        # Call before reading the snapshot so no diff can fall in between
+        self._subscribers.setdefault(game_id, set()).add(connection)
+        self.hold(connection)
+
+    def hold(self, connection: OutboundConnection):
+        # Hold back diffs while another page of rooms is read for this subscriber
+        self._pending.setdefault(connection, [])
+
+    def send_snapshot(self, connection: OutboundConnection, snapshot: dict):
+        connection.send_json(snapshot)
+        # Replay what happened while the snapshot was read; diffs are idempotent
+        for event in self._pending.pop(connection, []):
+            connection.send_json(event)
+
+    def unsubscribe(self, game_id: int, connection: OutboundConnection):
+        self._pending.pop(connection, None)
+        subscribers = self._subscribers.get(game_id)
+        if subscribers is None:
+            return
+        subscribers.discard(connection)
+        if not subscribers:
+            self._subscribers.pop(game_id, None)
+
+    def publish(self, game_id: int, action: str, room: Optional[dict] = None, room_id: Optional[int] = None):
+        event = {"action": action}
+        if room is not None:
+            event["room"] = room
+        if room_id is not None:
+            event["room_id"] = room_id
+        self._deliver(game_id, event)
+        room_relay.publish("lobby_event", {"game": game_id, "event": event})
+
+    async def on_relayed_event(self, message: dict):
+        self._deliver(message["game"], message["event"])
+
+    def _deliver(self, game_id: int, event: dict):
+        # Every room change also invalidates this worker's copy of the listing
+        listing_cache.bump_rooms(game_id)
+        ready = []
+        for connection in self._subscribers.get(game_id, ()):
+            if connection in self._pending:
+                self._pending[connection].append(event)
+            else:
+                ready.append(connection)
+        fan_out(ready, event)
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+lobby_feed = LobbyFeed()
+room_relay.subscribe("lobby_event", lobby_feed.on_relayed_event)
@@ -0,0 +1,218 @@
+# business/matchmaking_operations.py
+# Quick play. Players wait in one queue per game instead of browsing rooms
+# and racing each other on join_room; as soon as a game has enough players
+# waiting, the oldest of them get a fresh room with everyone already seated.
+#
+# A queue is an OrderedDict of tickets by user: joining, leaving and pairing
+# (popping the oldest tickets) are all O(1). Each queue lives on one worker,
+# claimed through the room relay under a negative id (room ids are positive),
+# so players on different workers still end up in the same queue; if that
+# worker goes away, the renewing tickets rebuild the queue elsewhere. The
+# outcome goes back to the waiting socket, wherever it is, as a relay message.
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from uuid import UUID
+
+from business.catalog_operations import game_catalog
+from business.database_operations import open_postgresql_session
+from business.event_bus_operations import room_relay
+from business.presence_operations import presence_tracker
+from business.room_membership_operations import invalidate_principal, seat_matched_players
+from models.games import Game
+
+# How often a waiting socket renews its ticket. That's also how long it takes
+# to get back in line when the worker holding the queue went away.
+MATCHMAKING_REFRESH_SECONDS = float(os.getenv("MATCHMAKING_REFRESH_SECONDS", "15"))
+# Upper bounds of the wait time histogram buckets, in seconds
+MATCHMAKING_WAIT_BUCKETS = (1, 2, 5, 10, 30, 60, 120, 300)
+
+ALREADY_SEATED_ERROR = "You are already in a room. Leave it to use quick play."
+
+
+def queue_id(game_id: int) -> int:
+    return -game_id
+
+
+@dataclass
+class Ticket:
+    game_id: int
+    user_id: UUID
+    # Unique across workers: the outcome is addressed to it
+    connection_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    # Wall clock, so the wait survives the queue moving to another worker
+    enqueued_at: float = field(default_factory=time.time)
+
+    def as_command(self, command_type: str) -> dict:
+        return {
+            "type": command_type,
+            "game_id": self.game_id,
+            "user_id": str(self.user_id),
+            "connection": self.connection_id,
+            "enqueued_at": self.enqueued_at,
+        }
+
+    @classmethod
+    def from_command(cls, command: dict) -> "Ticket":
+        return cls(
+            game_id=command["game_id"],
+            user_id=UUID(command["user_id"]),
+            connection_id=command["connection"],
+            enqueued_at=command["enqueued_at"],
+        )
+
+
+class WaitHistogram:
+    def __init__(self, bounds=MATCHMAKING_WAIT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        index = next((i for i, bound in enumerate(self.bounds) if seconds <= bound), len(self.bounds))
+        self.counts[index] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def snapshot(self) -> dict:
+        count = sum(self.counts)
+        labels = [f"<={bound}s" for bound in self.bounds] + [f">{self.bounds[-1]}s"]
+        return {
+            "count": count,
+            "avg_seconds": round(self.total / (count or 1), 3),
+            "max_seconds": round(self.max, 3),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class Matchmaker:
+    def __init__(self):
+        # Owner side: game id -> user id -> ticket, oldest first
+        self._queues: Dict[int, "OrderedDict[UUID, Ticket]"] = {}
+        # Socket side: this worker's waiting sockets -> their outcome
+        self._outcomes: Dict[str, asyncio.Future] = {}
+        # Per game name: how long matched players waited, and those who gave up
+        self.matched_waits: Dict[str, WaitHistogram] = {}
+        self.abandoned_waits: Dict[str, WaitHistogram] = {}
+        self.matches = 0
+        self.failed_matches = 0
+
+    # --- Socket side: may run on any worker ---
+
+    def open_ticket(self, game: Game, user_id: UUID) -> Ticket:
+        ticket = Ticket(game_id=game.id, user_id=user_id)
+        self._outcomes[ticket.connection_id] = asyncio.get_running_loop().create_future()
+        return ticket
+
+    def outcome(self, ticket: Ticket) -> asyncio.Future:
+        return self._outcomes[ticket.connection_id]
+
+    async def enqueue(self, ticket: Ticket) -> dict:
+        # Also renews a ticket; the queue's owner ignores repeats
+        return await room_relay.dispatch(queue_id(ticket.game_id), ticket.as_command("matchmaking_enqueue"))
+
+    async def close_ticket(self, ticket: Ticket):
+        outcome = self._outcomes.pop(ticket.connection_id)
+        if not outcome.done():
+            # Gave up waiting: leave the queue
+            await room_relay.dispatch(queue_id(ticket.game_id), ticket.as_command("matchmaking_cancel"))
+
+    async def on_outcome(self, message: dict):
+        self._resolve(message)
+
+    def _resolve(self, message: dict):
+        outcome = self._outcomes.get(message["connection"])
+        if outcome is not None and not outcome.done():
+            outcome.set_result(message["payload"])
+
+    def _notify(self, ticket: Ticket, payload: dict):
+        message = {"connection": ticket.connection_id, "payload": payload}
+        if ticket.connection_id in self._outcomes:
+            self._resolve(message)
+        else:
+            room_relay.publish("matchmaking_outcome", message)
+
+    # --- Owner side: one command at a time per queue ---
+
+    async def handle_command(self, queue: int, command: dict) -> Optional[dict]:
+        # The queue stays with this worker once claimed, empty or not: it costs
+        # next to nothing, and handing it around would only cost claims
+        ticket = Ticket.from_command(command)
+        tickets = self._queues.setdefault(ticket.game_id, OrderedDict())
+
+        if command["type"] == "matchmaking_cancel":
+            if ticket.user_id in tickets and tickets[ticket.user_id].connection_id == ticket.connection_id:
+                del tickets[ticket.user_id]
+                self._histogram(self.abandoned_waits, ticket.game_id).observe(time.time() - ticket.enqueued_at)
+            return None
+
+        previous = tickets.get(ticket.user_id)
+        if previous is not None and previous.connection_id != ticket.connection_id:
+            # The same user queued again from somewhere else: the newer socket waits
+            self._notify(previous, {"action": "cancelled", "message": "Queued again from another window."})
+        if previous is None or previous.connection_id != ticket.connection_id:
+            tickets[ticket.user_id] = ticket
+
+        game = game_catalog.by_id(ticket.game_id)
+        if game is not None and len(tickets) >= game.number_of_players:
+            await self._start_match(game, tickets)
+        return {"waiting": len(tickets)}
+
+    async def _start_match(self, game: Game, tickets: "OrderedDict[UUID, Ticket]"):
+        players = [tickets.popitem(last=False)[1] for _ in range(game.number_of_players)]
+        try:
+            async with open_postgresql_session() as session:
+                room, busy = await seat_matched_players(session, game, [player.user_id for player in players])
+        except Exception as e:
+            print(f"Matchmaking for {game.name} failed: {e}")
+            room, busy = None, []
+
+        if room is None:
+            self.failed_matches += 1
+            # Everyone who can still play goes back to the front of the line, in order
+            for player in reversed(players):
+                if player.user_id in busy:
+                    self._notify(player, {"action": "cancelled", "message": ALREADY_SEATED_ERROR})
+                elif player.user_id not in tickets:
+                    tickets[player.user_id] = player
+                    tickets.move_to_end(player.user_id, last=False)
+            return
+
+        self.matches += 1
+        now = time.time()
+        for player in players:
+            self._histogram(self.matched_waits, game.id).observe(now - player.enqueued_at)
+            presence_tracker.touch(player.user_id)
+            invalidate_principal(player.user_id)
+            self._notify(player, {"action": "matched", "room_id": room.id, "game": game.name})
+
+    def _histogram(self, histograms: Dict[str, WaitHistogram], game_id: int) -> WaitHistogram:
+        name = self._game_name(game_id)
+        if name not in histograms:
+            histograms[name] = WaitHistogram()
+        return histograms[name]
+
+    def _game_name(self, game_id: int) -> str:
+        game = game_catalog.by_id(game_id)
+        return game.name if game else str(game_id)
+
+    def metrics(self) -> dict:
+        # Queues and histograms of the queues this worker holds
+        return {
+            "queued": {self._game_name(game_id): len(tickets) for game_id, tickets in self._queues.items()},
+            "waiting_sockets": len(self._outcomes),
+            "matches": self.matches,
+            "failed_matches": self.failed_matches,
+            "matched_wait": {name: histogram.snapshot() for name, histogram in self.matched_waits.items()},
+            "abandoned_wait": {name: histogram.snapshot() for name, histogram in self.abandoned_waits.items()},
+        }
+
+
+matchmaker = Matchmaker()
+room_relay.set_command_handler(matchmaker.handle_command, ["matchmaking_enqueue", "matchmaking_cancel"])
+room_relay.subscribe("matchmaking_outcome", matchmaker.on_outcome)
@@ -0,0 +1,129 @@
+# business/password_operations.py
+# bcrypt is deliberately slow (100-300 ms of CPU per call), so /register and
+# /login hand it to a small dedicated process pool instead of burning a
+# request thread. When the pool is saturated we answer 503 straight away
+# rather than letting a login spike starve every other endpoint.
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Deque, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from models import user as user_model
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Jobs allowed to wait for a free worker on top of the ones being processed
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+# Window used to compute the hashes/sec figure
+PASSWORD_HASH_RATE_WINDOW_SECONDS = 60
+
+
+# --- Functions executed inside the worker processes ---
+# They return the wall-clock time the worker picked the job up so the parent
+# can tell queue wait apart from hashing time.
+def _hash_in_worker(password: str) -> Tuple[str, float]:
+    started_at = time.time()
+    return user_model.hash_password(password), started_at
+
+def _verify_in_worker(plain_password: str, hashed_password: str) -> Tuple[bool, float]:
+    started_at = time.time()
+    return user_model.verify_password(plain_password, hashed_password), started_at
+
+def _warm_up_worker() -> int:
+    return os.getpid()
+
+
+class PasswordHashPool:
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._in_flight = 0
+
+        # Metrics
+        self._completed = 0
+        self._rejected = 0
+        self._completed_at: Deque[float] = deque()
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+        self._work_time_total = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # 'spawn' so the workers don't inherit the event loop and open sockets
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def start(self):
+        # Start every worker up front so the first logins don't pay for it
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(*[
+            loop.run_in_executor(executor, _warm_up_worker) for _ in range(self.workers)
+        ])
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, fn, *args):
+        if self._in_flight >= self.workers + self.max_queue:
+            self._rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again shortly.",
+                headers={"Retry-After": "1"},
+            )
+
+        self._in_flight += 1
+        submitted_at = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            result, started_at = await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._in_flight -= 1
+
+        finished_at = time.time()
+        queue_wait = max(0.0, started_at - submitted_at)
+        self._completed += 1
+        self._completed_at.append(finished_at)
+        self._queue_wait_total += queue_wait
+        self._queue_wait_max = max(self._queue_wait_max, queue_wait)
+        self._work_time_total += max(0.0, finished_at - started_at)
+        return result
+
+    async def hash_password(self, password: str) -> str:
+        return await self._run(_hash_in_worker, password)
+
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(_verify_in_worker, plain_password, hashed_password)
+
+    def metrics(self) -> dict:
+        now = time.time()
+        while self._completed_at and self._completed_at[0] < now - PASSWORD_HASH_RATE_WINDOW_SECONDS:
+            self._completed_at.popleft()
+        completed = self._completed or 1
+        return {
+            "workers": self.workers,
+            "bcrypt_rounds": user_model.BCRYPT_ROUNDS,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "queued": max(0, self._in_flight - self.workers),
+            "completed_total": self._completed,
+            "rejected_total": self._rejected,
+            "hashes_per_second": round(len(self._completed_at) / PASSWORD_HASH_RATE_WINDOW_SECONDS, 3),
+            "queue_wait_avg_ms": round(self._queue_wait_total / completed * 1000, 3),
+            "queue_wait_max_ms": round(self._queue_wait_max * 1000, 3),
+            "hash_time_avg_ms": round(self._work_time_total / completed * 1000, 3),
+        }
+
+
+password_pool = PasswordHashPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
@@ -0,0 +1,123 @@
+# business/presence_operations.py
+# Who is still there. Every /heartbeat stamps the user's last-seen time in a
+# dict (O(1), no database); a background sweeper takes users who missed
+# PRESENCE_MISSED_HEARTBEATS beats out of their rooms in one bulk transaction,
+# freeing or deleting the rooms they leave behind. Workers share the users
+# they saw with each other once per sweep, so a heartbeat counts no matter
+# which worker it lands on.
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Set
+from uuid import UUID
+
+from sqlmodel import select
+
+from business.database_operations import open_postgresql_session
+from business.event_bus_operations import room_relay
+from business.room_membership_operations import evict_users, invalidate_principal, publish_seat_changes
+from models.user import User
+
+# How often clients are expected to call /heartbeat
+PRESENCE_HEARTBEAT_SECONDS = float(os.getenv("PRESENCE_HEARTBEAT_SECONDS", "30"))
+# Beats a user may miss before being taken out of their room
+PRESENCE_MISSED_HEARTBEATS = int(os.getenv("PRESENCE_MISSED_HEARTBEATS", "3"))
+PRESENCE_SWEEP_INTERVAL_SECONDS = float(os.getenv("PRESENCE_SWEEP_INTERVAL_SECONDS", "15"))
+# Users per relayed presence message; keeps each NOTIFY well under its size cap
+PRESENCE_RELAY_BATCH_SIZE = 150
+
+
+class PresenceTracker:
+    def __init__(self):
+        # user id -> last heartbeat (wall clock, so workers can compare them)
+        self._last_seen: Dict[UUID, float] = {}
+        # Seen on this worker since the last sweep, not yet told to the others
+        self._unshared: Set[UUID] = set()
+        self._sweeper: Optional[asyncio.Task] = None
+        self.evicted_total = 0
+        self.last_sweep_ms = 0.0
+
+    @property
+    def ttl_seconds(self) -> float:
+        return PRESENCE_HEARTBEAT_SECONDS * PRESENCE_MISSED_HEARTBEATS
+
+    def touch(self, user_id: UUID):
+        self._last_seen[user_id] = time.time()
+        self._unshared.add(user_id)
+
+    async def on_relayed_presence(self, message: dict):
+        seen_at = message["at"]
+        for user_id in message["users"]:
+            user_id = UUID(user_id)
+            if self._last_seen.get(user_id, 0) < seen_at:
+                self._last_seen[user_id] = seen_at
+
+    async def start(self):
+        # Whoever is seated when we come up gets a full TTL to send a heartbeat,
+        # so a restart doesn't leave the rooms of vanished users around forever
+        async with open_postgresql_session() as session:
+            seated = (await session.exec(select(User.id).where(User.room_id != None))).all()
+        now = time.time()
+        for user_id in seated:
+            self._last_seen.setdefault(user_id, now)
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(PRESENCE_SWEEP_INTERVAL_SECONDS)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Presence sweep failed, will retry: {e}")
+
+    def _share_seen(self):
+        if not self._unshared:
+            return
+        users = [str(user_id) for user_id in self._unshared]
+        self._unshared.clear()
+        seen_at = time.time() - PRESENCE_SWEEP_INTERVAL_SECONDS  # the oldest these can be
+        for start in range(0, len(users), PRESENCE_RELAY_BATCH_SIZE):
+            room_relay.publish("presence", {"users": users[start:start + PRESENCE_RELAY_BATCH_SIZE], "at": seen_at})
+
+    async def sweep(self) -> List[UUID]:
+        started = time.perf_counter()
+        self._share_seen()
+        cutoff = time.time() - self.ttl_seconds
+        stale = [user_id for user_id, seen_at in self._last_seen.items() if seen_at < cutoff]
+        evicted: List[UUID] = []
+        if stale:
+            # Users who were in the lobby only just drop out of the table
+            async with open_postgresql_session() as session:
+                evicted, changes = await evict_users(session, stale)
+            for user_id in stale:
+                self._last_seen.pop(user_id, None)
+            for user_id in evicted:
+                invalidate_principal(user_id)
+            publish_seat_changes(changes)
+            self.evicted_total += len(evicted)
+            if evicted:
+                print(f"Presence sweep: took {len(evicted)} inactive user(s) out of {len(changes)} room(s).")
+        self.last_sweep_ms = (time.perf_counter() - started) * 1000
+        return evicted
+
+    def metrics(self) -> dict:
+        return {
+            "tracked_users": len(self._last_seen),
+            "ttl_seconds": self.ttl_seconds,
+            "evicted_total": self.evicted_total,
+            "last_sweep_ms": round(self.last_sweep_ms, 3),
+        }
+
+
+presence_tracker = PresenceTracker()
+room_relay.subscribe("presence", presence_tracker.on_relayed_presence)
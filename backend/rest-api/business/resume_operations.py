@@ -0,0 +1,75 @@
+# business/resume_operations.py
+# Resumable game sessions. Every seat gets a resume token when its socket
+# joins. When the socket drops, the seat is held for RESUME_GRACE_SECONDS
+# under an "away:<token>" marker instead of ending the game. A socket that
+# comes back with the token takes the seat over and gets the broadcast
+# frames it missed replayed from the room's in-memory event ring (numbered
+# with "seq"), so nothing is reloaded from the database and the match goes on.
+import os
+import secrets
+from typing import List, Optional
+
+from business.game_state_operations import GameState
+
+# 0 turns resuming off: a dropped socket ends the game right away
+RESUME_GRACE_SECONDS = float(os.getenv("RESUME_GRACE_SECONDS", "30"))
+
+AWAY_SEAT_PREFIX = "away:"
+
+RESUME_EXPIRED_ERROR = "This game session can't be resumed any more."
+
+
+def is_away(seat: str) -> bool:
+    return seat.startswith(AWAY_SEAT_PREFIX)
+
+
+def issue_resume_token(state: GameState, connection_id: str) -> str:
+    token = secrets.token_urlsafe(16)
+    state.resume_tokens[token] = connection_id
+    return token
+
+
+def hold_seat(state: GameState, connection_id: str) -> Optional[str]:
+    # The socket is gone: keep its seat under the away marker. Returns the
+    # token it can come back with, None if the seat never had one.
+    token = next((token for token, seat in state.resume_tokens.items() if seat == connection_id), None)
+    if token is None:
+        return None
+    marker = AWAY_SEAT_PREFIX + token
+    state.players[state.players.index(connection_id)] = marker
+    state.resume_tokens[token] = marker
+    return token
+
+
+def take_back_seat(state: GameState, token: str, connection_id: str) -> Optional[int]:
+    # Works for held seats and for seats whose old socket hasn't noticed it's
+    # dead yet (that one is simply no longer in the game). The token is
+    # replaced, so the old one and its grace timer are void.
+    seat = state.resume_tokens.pop(token, None)
+    if seat is None or seat not in state.players:
+        return None
+    player_index = state.players.index(seat)
+    state.players[player_index] = connection_id
+    return player_index
+
+
+def forget_seat(state: GameState, seat: str):
+    for token in [token for token, held in state.resume_tokens.items() if held == seat]:
+        del state.resume_tokens[token]
+
+
+def record_event(state: GameState, payload: dict) -> dict:
+    # Number a broadcast frame and keep it for replay
+    state.event_seq += 1
+    event = {**payload, "seq": state.event_seq}
+    state.recent_events.append(event)
+    return event
+
+
+def events_after(state: GameState, seq: int) -> Optional[List[dict]]:
+    # The frames after seq, or None if some of them already fell out of the ring
+    if seq >= state.event_seq:
+        return []
+    if not state.recent_events or state.recent_events[0]["seq"] > seq + 1:
+        return None
+    return [event for event in state.recent_events if event["seq"] > seq]
@@ -0,0 +1,366 @@
+# business/room_membership_operations.py
+# Seat bookkeeping for rooms. Room.player_count is kept next to User.room_id
+# and every join, leave and switch runs as a single transaction of guarded
+# conditional UPDATEs: a seat is only taken while one is free, so two
+# concurrent joins can never both get the last seat, and nothing has to be
+# re-read afterwards. Availability is derived in the same statement.
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException, status
+from sqlalchemy import case, delete, func, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from business.auth_operations import principal_cache
+from business.catalog_operations import game_catalog
+from business.event_bus_operations import room_relay
+from business.lobby_feed_operations import lobby_feed, room_summary, room_change_action, ROOM_DELETED
+from models.games import Game, Room
+from models.user import User
+
+ROOM_NOT_FOUND = "Room not found."
+ROOM_FULL = "Room is full. Cannot join."
+ALREADY_IN_ROOM = "You are already in this room."
+IN_ANOTHER_ROOM = "You are currently in another room. Do you want to leave your current room and join this one?"
+NOT_IN_A_ROOM = "You are not currently in any room to leave."
+
+
+def invalidate_principal(user_id: UUID):
+    # The user's room changed: drop cached principals here and on every other worker
+    principal_cache.invalidate_user(user_id)
+    room_relay.publish("invalidate_principal", {"user_id": str(user_id)})
+
+
+async def on_principal_invalidated(message: dict):
+    principal_cache.invalidate_user(UUID(message["user_id"]))
+
+
+room_relay.subscribe("invalidate_principal", on_principal_invalidated)
+
+
+@dataclass
+class SeatChange:
+    room_id: int
+    game_id: int
+    joined: bool  # seats were taken (True) or freed (False)
+    player_count: int  # after the change
+    room: Optional[Room] = None  # None when the room was deleted
+    seats: int = 1  # how many seats were taken or freed
+
+    @property
+    def deleted(self) -> bool:
+        return self.room is None
+
+
+def max_players_of_room():
+    # Correlated subquery, so the capacity check happens inside the UPDATE
+    return (
+        select(Game.number_of_players)
+        .where(Game.id == Room.type_of_game_id)
+        .scalar_subquery()
+    )
+
+
+def check_room_password(room: Room, password: Optional[str]):
+    if room.password:
+        if not password or password != room.password:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Incorrect password for this room."
+            )
+    elif password:  # If room has no password, but user provided one
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This room does not require a password."
+        )
+
+
+async def explain_refused_seat(session: AsyncSession, room_id: int, password: Optional[str]) -> Room:
+    # Only on the failure path: find out why the guarded UPDATE matched nothing.
+    # Same checks, in the same order, as before the seat count existed.
+    room = await session.get(Room, room_id)
+    if not room:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=ROOM_NOT_FOUND)
+    check_room_password(room, password)
+    game = game_catalog.by_id(room.type_of_game_id)
+    if game is None:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Room's game information not available."
+        )
+    if room.player_count >= game.number_of_players or not room.available:
+        # Not available with seats left: the other seat is the server's bot
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=ROOM_FULL)
+    return room
+
+
+async def take_seat(session: AsyncSession, room_id: int, password: Optional[str]) -> Room:
+    max_players = max_players_of_room()
+    room = (await session.exec(
+        update(Room)
+        .where(Room.id == room_id)
+        # "" means no password, as in check_room_password (rooms from before
+        # create_room stored it as NULL can still hold "")
+        .where(func.nullif(Room.password, "").is_not_distinct_from(password or None))
+        .where(Room.player_count < max_players)
+        .where(Room.available == True)
+        .values(player_count=Room.player_count + 1, available=Room.player_count + 1 < max_players)
+        .returning(Room)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )).scalars().first()
+    if room is None:
+        await explain_refused_seat(session, room_id, password)
+        # Passed every check after all: only a broken seat count gets here
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=ROOM_FULL)
+    return room
+
+
+async def free_seat(session: AsyncSession, room_id: int) -> SeatChange:
+    # Anyone left: one less player and a free seat again. Last one out: the room goes.
+    max_players = max_players_of_room()
+    room = (await session.exec(
+        update(Room)
+        .where(Room.id == room_id)
+        .where(Room.player_count > 1)
+        .values(player_count=Room.player_count - 1, available=Room.player_count - 1 < max_players)
+        .returning(Room)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )).scalars().first()
+    if room is not None:
+        return seat_freed(room)
+
+    game_id = (await session.exec(
+        delete(Room).where(Room.id == room_id).returning(Room.type_of_game_id)
+        .execution_options(synchronize_session=False)
+    )).scalar()
+    return SeatChange(room_id=room_id, game_id=game_id, joined=False, player_count=0)
+
+
+def seat_taken(room: Room) -> SeatChange:
+    return SeatChange(room_id=room.id, game_id=room.type_of_game_id, joined=True, player_count=room.player_count, room=room)
+
+
+def seat_freed(room: Room) -> SeatChange:
+    return SeatChange(room_id=room.id, game_id=room.type_of_game_id, joined=False, player_count=room.player_count, room=room)
+
+
+async def lock_user(session: AsyncSession, user_id: UUID) -> User:
+    # Row lock on the user: concurrent requests of the same user queue up here
+    user = (await session.exec(
+        select(User).where(User.id == user_id).with_for_update().execution_options(populate_existing=True)
+    )).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
+    return user
+
+
+async def join_room_seat(session: AsyncSession, user_id: UUID, room_id: int, password: Optional[str]) -> Tuple[Room, List[SeatChange]]:
+    # The user row first, then the room: the same lock order as switch_room_seat and leave_room_seat
+    try:
+        try:
+            seated = (await session.exec(
+                update(User)
+                .where(User.id == user_id)
+                .where(User.room_id == None)
+                .values(room_id=room_id)
+                .returning(User.id)
+                .execution_options(synchronize_session=False)
+            )).first()
+        except IntegrityError:
+            # The foreign key: no such room
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=ROOM_NOT_FOUND)
+        if seated is None:
+            await explain_refused_seat(session, room_id, password)
+            user = await session.get(User, user_id)
+            if not user:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
+            if user.room_id == room_id:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=ALREADY_IN_ROOM)
+            # Signal to the frontend that the user is in another room and needs confirmation
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=IN_ANOTHER_ROOM)
+        room = await take_seat(session, room_id, password)
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        raise
+    return room, [seat_taken(room)]
+
+
+async def switch_room_seat(session: AsyncSession, user_id: UUID, room_id: int, password: Optional[str]) -> Tuple[Room, List[SeatChange]]:
+    # Join room_id, leaving the current room first if there is one
+    try:
+        user = await lock_user(session, user_id)
+        old_room_id = user.room_id
+        if old_room_id == room_id:
+            room = await session.get(Room, room_id)
+            if not room:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=ROOM_NOT_FOUND)
+            check_room_password(room, password)
+            await session.rollback()
+            return room, []  # Already there, nothing to change
+
+        if old_room_id is not None:
+            # Lock both rooms in id order, so two users swapping rooms can't deadlock
+            await session.exec(
+                select(Room.id).where(Room.id.in_([old_room_id, room_id])).order_by(Room.id).with_for_update()
+            )
+
+        room = await take_seat(session, room_id, password)
+        user.room_id = room_id
+        session.add(user)
+        await session.flush()
+        changes = [seat_taken(room)]
+        if old_room_id is not None:
+            changes.insert(0, await free_seat(session, old_room_id))
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        raise
+    return room, changes
+
+
+async def leave_room_seat(session: AsyncSession, user_id: UUID) -> Tuple[User, List[SeatChange]]:
+    try:
+        user = await lock_user(session, user_id)
+        old_room_id = user.room_id
+        if old_room_id is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=NOT_IN_A_ROOM)
+        user.room_id = None
+        session.add(user)
+        await session.flush()
+        change = await free_seat(session, old_room_id)
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        raise
+    return user, [change]
+
+
+async def seat_matched_players(
+    session: AsyncSession, game: Game, user_ids: List[UUID], closed: bool = False
+) -> Tuple[Optional[Room], List[UUID]]:
+    # Matchmaking: a new room with all of user_ids seated, in one transaction.
+    # The room starts out with as many players as it'll get, so it's never
+    # listed. Users who got into some other room in the meantime can't be
+    # seated; then nothing is created and those users come back instead.
+    # closed: never listed or joinable even with seats left (games against the bot).
+    try:
+        room = Room(
+            type_of_game_id=game.id,
+            created_by_id=user_ids[0],
+            player_count=len(user_ids),
+            available=not closed and len(user_ids) < game.number_of_players
+        )
+        session.add(room)
+        await session.flush()
+        seated = set((await session.exec(
+            update(User)
+            .where(User.id.in_(user_ids))
+            .where(User.room_id == None)
+            .values(room_id=room.id)
+            .returning(User.id)
+            .execution_options(synchronize_session=False)
+        )).scalars().all())
+        if len(seated) < len(user_ids):
+            await session.rollback()
+            return None, [user_id for user_id in user_ids if user_id not in seated]
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        raise
+    return room, []
+
+
+async def evict_users(session: AsyncSession, user_ids: List[UUID]) -> Tuple[List[UUID], List[SeatChange]]:
+    # Take many users out of their rooms at once (presence sweep). Rows are
+    # locked in id order, users before rooms, like every other seat change.
+    try:
+        seated = (await session.exec(
+            select(User.id, User.room_id)
+            .where(User.id.in_(user_ids))
+            .where(User.room_id != None)
+            .order_by(User.id)
+            .with_for_update()
+        )).all()
+        if not seated:
+            await session.rollback()
+            return [], []
+        evicted = [user_id for user_id, _ in seated]
+        leaving = Counter(room_id for _, room_id in seated)
+        room_ids = sorted(leaving)
+
+        await session.exec(
+            update(User).where(User.id.in_(evicted)).values(room_id=None)
+            .execution_options(synchronize_session=False)
+        )
+        await session.exec(select(Room.id).where(Room.id.in_(room_ids)).order_by(Room.id).with_for_update())
+        # One statement frees the seats of every affected room...
+        remaining = Room.player_count - case(leaving, value=Room.id)
+        rooms = (await session.exec(
+            update(Room)
+            .where(Room.id.in_(room_ids))
+            .values(player_count=remaining, available=remaining < max_players_of_room())
+            .returning(Room)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )).scalars().all()
+        # ...and one deletes those nobody is left in
+        deleted = (await session.exec(
+            delete(Room).where(Room.id.in_(room_ids)).where(Room.player_count <= 0)
+            .returning(Room.id, Room.type_of_game_id)
+            .execution_options(synchronize_session=False)
+        )).all()
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        raise
+
+    deleted_ids = {room_id for room_id, _ in deleted}
+    changes = [
+        SeatChange(room_id=room_id, game_id=game_id, joined=False, player_count=0)
+        for room_id, game_id in deleted
+    ]
+    for room in rooms:
+        if room.id not in deleted_ids:
+            # Several players may have gone at once; publish_seat_changes only
+            # needs to know whether the room was full before
+            changes.append(SeatChange(
+                room_id=room.id, game_id=room.type_of_game_id, joined=False,
+                player_count=room.player_count, room=room, seats=leaving[room.id]
+            ))
+    return evicted, changes
+
+
+async def room_occupancy(session: AsyncSession, room_ids: List[int]) -> Dict[int, Tuple[int, int]]:
+    # room id -> (game id, players seated), straight from the maintained count:
+    # one primary key lookup for any number of rooms, no User rows loaded
+    if not room_ids:
+        return {}
+    rows = (await session.exec(
+        select(Room.id, Room.type_of_game_id, Room.player_count).where(Room.id.in_(room_ids))
+    )).all()
+    return {room_id: (game_id, players) for room_id, game_id, players in rows}
+
+
+def publish_seat_changes(changes: List[SeatChange]):
+    # Tell open lobbies; filled rooms drop off their list, freed ones come back
+    for change in changes:
+        if change.deleted:
+            lobby_feed.publish(change.game_id, ROOM_DELETED, room_id=change.room_id)
+            continue
+        game = game_catalog.by_id(change.game_id)
+        max_players = game.number_of_players if game else 0
+        room = change.room
+        was_available = room.available
+        if game:
+            # The count moved by change.seats; work out which side of "full" it was on before
+            previous_count = change.player_count - change.seats if change.joined else change.player_count + change.seats
+            was_available = previous_count < max_players
+        lobby_feed.publish(
+            change.game_id,
+            room_change_action(was_available, room.available),
+            room=room_summary(room, change.player_count, max_players)
+        )
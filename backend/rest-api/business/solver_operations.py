@@ -0,0 +1,134 @@
+# business/solver_operations.py
+# Perfect-play tic-tac-toe, solved once. Positions are the two 9-bit
+# bitboards of business/board_operations.py; the 8 rotations/reflections of
+# the board are folded together, so the whole game tree is solved as 765
+# canonical positions at startup (a few milliseconds). Afterwards a best move
+# or an outcome is a table lookup: canonicalize with 8 precomputed 512-entry
+# permutation tables, read the entry, map the moves back.
+import random
+from typing import Dict, List, Optional, Tuple
+
+from business.board_operations import Board, win_masks
+
+# Chance of playing a best move; otherwise one of the others is picked at random
+BOT_DIFFICULTIES = {"easy": 0.3, "medium": 0.7, "hard": 1.0}
+
+CELLS = 9
+WIN_MASKS = win_masks(3, 3)
+FULL = (1 << CELLS) - 1
+
+
+def _symmetries() -> List[Tuple[int, ...]]:
+    # Each symmetry as a cell permutation: cell -> where that cell ends up
+    def cell(row, col):
+        return row * 3 + col
+    transforms = [
+        lambda r, c: (r, c),          # identity
+        lambda r, c: (c, 2 - r),      # rotate 90
+        lambda r, c: (2 - r, 2 - c),  # rotate 180
+        lambda r, c: (2 - c, r),      # rotate 270
+        lambda r, c: (r, 2 - c),      # mirror left/right
+        lambda r, c: (2 - r, c),      # mirror top/bottom
+        lambda r, c: (c, r),          # main diagonal
+        lambda r, c: (2 - c, 2 - r),  # anti-diagonal
+    ]
+    return [tuple(cell(*transform(i // 3, i % 3)) for i in range(CELLS)) for transform in transforms]
+
+
+SYMMETRIES = _symmetries()
+# SYMMETRY_MASKS[t][mask]: the bitboard mask after symmetry t
+SYMMETRY_MASKS = [
+    tuple(sum(1 << perm[i] for i in range(CELLS) if mask >> i & 1) for mask in range(1 << CELLS))
+    for perm in SYMMETRIES
+]
+# INVERSE_CELLS[t][cell]: the cell that symmetry t moved to `cell`
+INVERSE_CELLS = [tuple(perm.index(i) for i in range(CELLS)) for perm in SYMMETRIES]
+
+
+def canonical(x_bits: int, o_bits: int) -> Tuple[int, int]:
+    # (canonical key, symmetry that produces it); the key packs both bitboards
+    return min(
+        ((SYMMETRY_MASKS[t][x_bits] << CELLS) | SYMMETRY_MASKS[t][o_bits], t)
+        for t in range(len(SYMMETRIES))
+    )
+
+
+def has_won(bits: int) -> bool:
+    return any(bits & mask == mask for mask in WIN_MASKS)
+
+
+class TicTacToeSolver:
+    def __init__(self):
+        # canonical key -> (outcome for the side to move, score per cell);
+        # outcome and scores are +1 win, 0 draw, -1 loss; None for taken cells
+        self._table: Dict[int, Tuple[int, Tuple[Optional[int], ...]]] = {}
+
+    @property
+    def positions(self) -> int:
+        return len(self._table)
+
+    def solve(self):
+        if not self._table:
+            self._solve(0, 0)
+
+    def _solve(self, x_bits: int, o_bits: int) -> int:
+        key, t = canonical(x_bits, o_bits)
+        entry = self._table.get(key)
+        if entry is not None:
+            return entry[0]
+        # Work on the canonical orientation, so the stored scores are in it too
+        x_bits, o_bits = SYMMETRY_MASKS[t][x_bits], SYMMETRY_MASKS[t][o_bits]
+        x_to_move = bin(x_bits).count("1") == bin(o_bits).count("1")
+        if has_won(o_bits if x_to_move else x_bits):
+            outcome, scores = -1, (None,) * CELLS  # the previous move won
+        elif x_bits | o_bits == FULL:
+            outcome, scores = 0, (None,) * CELLS
+        else:
+            cell_scores: List[Optional[int]] = []
+            for cell in range(CELLS):
+                if (x_bits | o_bits) >> cell & 1:
+                    cell_scores.append(None)
+                elif x_to_move:
+                    cell_scores.append(-self._solve(x_bits | 1 << cell, o_bits))
+                else:
+                    cell_scores.append(-self._solve(x_bits, o_bits | 1 << cell))
+            scores = tuple(cell_scores)
+            outcome = max(score for score in scores if score is not None)
+        self._table[key] = (outcome, scores)
+        return outcome
+
+    # --- Lookups ---
+
+    def _entry(self, board: Board) -> Tuple[int, Dict[int, int]]:
+        if board.size != 3 or board.k != 3:
+            raise ValueError("The solver only knows 3x3 tic-tac-toe")
+        self.solve()
+        key, t = canonical(board.x_bits, board.o_bits)
+        outcome, scores = self._table[key]
+        inverse = INVERSE_CELLS[t]
+        return outcome, {inverse[cell]: score for cell, score in enumerate(scores) if score is not None}
+
+    def outcome(self, board: Board) -> int:
+        # With perfect play from here: +1 the side to move wins, 0 draw, -1 it loses
+        return self._entry(board)[0]
+
+    def best_moves(self, board: Board) -> List[int]:
+        _, scores = self._entry(board)
+        if not scores:
+            return []
+        best = max(scores.values())
+        return sorted(cell for cell, score in scores.items() if score == best)
+
+    def choose_move(self, board: Board, difficulty: str = "hard", rng: random.Random = random) -> Optional[int]:
+        _, scores = self._entry(board)
+        if not scores:
+            return None
+        best = max(scores.values())
+        optimal = [cell for cell, score in scores.items() if score == best]
+        others = [cell for cell, score in scores.items() if score != best]
+        if others and rng.random() >= BOT_DIFFICULTIES[difficulty]:
+            return rng.choice(others)
+        return rng.choice(optimal)
+
+
+tictactoe_solver = TicTacToeSolver()
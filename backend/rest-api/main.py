@@ -2,9 +2,17 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
-from routers import auth, lobby, tictactoe
-from business.database_operations import create_postgresql_tables
+from routers import auth, lobby, tictactoe, metrics
+from business.database_operations import create_postgresql_tables, seed_default_games
+from business.password_operations import password_pool
+from business.db_metrics_operations import QueryMetricsMiddleware
+from business.game_state_operations import game_state_engine
+from business.event_bus_operations import room_relay
+from business.catalog_operations import game_catalog
+from business.presence_operations import presence_tracker
+from business.solver_operations import tictactoe_solver
 import os
+import time
 
 # Import get_swagger_ui_html for custom docs_url
 from fastapi.openapi.docs import get_swagger_ui_html
@@ -26,14 +34,65 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the frontend read the listing's validator and next-page cursor
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
+# Per-route query counts/durations and the N+1 budget check
+app.add_middleware(QueryMetricsMiddleware)
+
 
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
+    # Cold start time per phase, printed at the end and served in /metrics
+    timings = {}
+    started = phase_started = time.perf_counter()
+
+    def finished(phase: str):
+        nonlocal phase_started
+        now = time.perf_counter()
+        timings[phase] = round((now - phase_started) * 1000, 1)
+        phase_started = now
+
     print("FastAPI startup event triggered: Calling create_postgresql_tables()...")
-    create_postgresql_tables()
-    print("Database tables creation check completed during startup.")
+    schema_checked = await create_postgresql_tables()
+    finished("schema")
+    added_games = await seed_default_games()
+    finished("seed_games")
+    # Every game lookup after this is served from memory
+    await game_catalog.load()
+    finished("game_catalog")
+    await password_pool.start()
+    print(f"Password hashing pool started with {password_pool.workers} workers.")
+    finished("password_pool")
+    game_state_engine.start()
+    # Solve tic-tac-toe once; the computer opponent only looks moves up
+    tictactoe_solver.solve()
+    print(f"Tic-tac-toe solved: {tictactoe_solver.positions} positions up to symmetry.")
+    finished("solver")
+    # Connects to the other workers (when ROOM_EVENT_BUS=postgres)
+    await room_relay.start()
+    finished("room_relay")
+    # Takes users who stopped sending heartbeats out of their rooms
+    await presence_tracker.start()
+    finished("presence")
+    if added_games:
+        # Workers that were already running must pick up the new games
+        game_catalog.announce_change()
+
+    total_ms = round((time.perf_counter() - started) * 1000, 1)
+    app.state.startup = {"total_ms": total_ms, "schema_checked": schema_checked, "phases_ms": timings}
+    print(f"Startup took {total_ms} ms: " + ", ".join(f"{phase} {ms} ms" for phase, ms in timings.items()))
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await presence_tracker.stop()
+    # Persist every live board that hasn't been flushed yet
+    await game_state_engine.stop()
+    # Only then give up room ownership, so the next owner loads the final boards
+    await room_relay.stop()
+    password_pool.shutdown()
 
 
 # Custom docs_url to enable persistence for the "Authorize" button
@@ -61,3 +120,4 @@ app.mount("/static", StaticFiles(directory=frontend_dir), name="static")
 app.include_router(auth.router)
 app.include_router(lobby.router)
 app.include_router(tictactoe.router)
+app.include_router(metrics.router)
@@ -2,12 +2,13 @@
 from datetime import datetime
 from typing import Optional, List
 from sqlmodel import SQLModel, Field, Relationship, Column
+from sqlalchemy import Index, SmallInteger, text
 from sqlalchemy.dialects.postgresql import ARRAY, INTEGER
 from uuid import UUID
 
 class Game(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    name: str = Field(index=True)
+    name: str = Field(index=True, unique=True)
     number_of_players: int
     available: bool = Field(default=True)
 
@@ -20,11 +21,21 @@ class Game(SQLModel, table=True):
     rooms: List["Room"] = Relationship(back_populates="game")
 
 class Room(SQLModel, table=True):
+    __table_args__ = (
+        # Lobby listing: open rooms of one game in id order (keyset pagination).
+        # Partial, so full rooms never take up space in it.
+        Index("ix_room_open_by_game", "type_of_game_id", "id", postgresql_where=text("available")),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     created_by_id: UUID = Field(foreign_key="user.id")
     password: Optional[str] = Field(default=None, nullable=True)
     type_of_game_id: int = Field(foreign_key="game.id")
     available: bool = Field(default=True)
+    # Users seated (User.room_id == id); kept by business/room_membership_operations.py
+    player_count: int = Field(default=0)
+    # Bumped with every board change; writes to position compare-and-swap on it
+    version: int = Field(default=0)
 
     # The board position for THIS specific game instance (room)
     position: List[int] = Field( # <--- NEW LOCATION FOR POSITION
@@ -38,4 +49,18 @@ class Room(SQLModel, table=True):
         sa_relationship_kwargs={
             "foreign_keys": "User.room_id"
         }
-    )
\ No newline at end of file
+    )
+
+# Logged instead of a cell when the board is cleared: for a restart, or for a
+# draw the players agreed on, which also ends the game
+CLEAR_BOARD = -1
+DRAW_AGREED = -2
+
+class RoomMove(SQLModel, table=True):
+    # Append-only board history, one small row per change. Room.position is a
+    # snapshot of the board as of Room.version; replaying the moves after that
+    # version on top of it gives the current board.
+    room_id: int = Field(primary_key=True)  # no foreign key: the history outlives the room
+    seq: int = Field(primary_key=True)      # the board version this move produced
+    player: int = Field(sa_column=Column(SmallInteger, nullable=False))  # board mark 1 or 2; 0 when cleared
+    cell: int = Field(sa_column=Column(SmallInteger, nullable=False))    # or CLEAR_BOARD / DRAW_AGREED
@@ -3,18 +3,31 @@ from uuid import UUID, uuid4
 from sqlmodel import Field, SQLModel, Relationship
 from passlib.context import CryptContext
 from typing import Optional
+import os
 
 # DO NOT import Room here to avoid circular import.
 # The Relationship will use a string reference for "Room".
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt work factor (log2 of the number of rounds). Existing hashes keep
+# verifying whatever factor they were created with.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# Module-level helpers so the hashing can run in a worker process
+# (see business/password_operations.py) without pickling a User.
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
 
 class User(SQLModel, table=True):
     id: UUID = Field(default_factory=uuid4, primary_key=True)
     username: str
     password: str
 
-    room_id: Optional[int] = Field(default=None, foreign_key="room.id")
+    room_id: Optional[int] = Field(default=None, foreign_key="room.id", index=True)  # indexed for "who is in room X"
     # Corrected Relationship for 'room'
     # Specify which foreign key column on the 'User' model links back to 'Room'.
     room: Optional["Room"] = Relationship(
@@ -26,7 +39,7 @@ class User(SQLModel, table=True):
 
     @staticmethod
     def hash_password(password: str):
-        return pwd_context.hash(password)
+        return hash_password(password)
 
     def verify_password(self, plain_password: str):
-        return pwd_context.verify(plain_password, self.password)
\ No newline at end of file
+        return verify_password(plain_password, self.password)
\ No newline at end of file
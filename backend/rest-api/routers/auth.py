@@ -2,8 +2,10 @@ from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from business.auth_operations import create_access_token
 from models.user import User
-from sqlmodel import Field, Session, select
+from sqlmodel import Field, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from business.database_operations import get_postgresql_session
+from business.password_operations import password_pool
 from pydantic import BaseModel
 from datetime import timedelta
 
@@ -17,17 +19,17 @@ class CreateUserRequest(BaseModel):
 
 # Endpoint for creating a user
 @router.post("/register")
-def create_user(request: CreateUserRequest, session: Session = Depends(get_postgresql_session)):
-    existing_user = session.exec(select(User).where(User.username == request.username)).first()
+async def create_user(request: CreateUserRequest, session: AsyncSession = Depends(get_postgresql_session)):
+    existing_user = (await session.exec(select(User).where(User.username == request.username))).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
 
     new_user = User(
         username=request.username,
-        password=User.hash_password(request.password),
+        password=await password_pool.hash_password(request.password),
     )
     session.add(new_user)
-    session.commit()
+    await session.commit()
 
     return {"message": "User created successfully", "user_id": str(new_user.id)}
 
@@ -38,14 +40,14 @@ class LoginRequest(BaseModel):
     
 # Endpoint for user login
 @router.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_postgresql_session)):
-    user = session.exec(select(User).where(User.username == form_data.username)).first()
-    if not user or not user.verify_password(form_data.password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_postgresql_session)):
+    user = (await session.exec(select(User).where(User.username == form_data.username))).first()
+    if not user or not await password_pool.verify_password(form_data.password, user.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
     access_token_expires = timedelta(minutes=30)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": str(user.id)}, expires_delta=access_token_expires
     )
 
     return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
@@ -1,22 +1,59 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, WebSocket, WebSocketDisconnect
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.orm import selectinload
 from models.games import Game, Room
 from models.user import User
-from business.database_operations import get_postgresql_session
-from business.auth_operations import get_current_user
+from business.database_operations import get_postgresql_session, open_postgresql_session
+from business.auth_operations import oauth2_scheme, decode_access_token, principal_cache, Principal
+from business.broadcast_operations import OutboundConnection
+from business.listing_cache_operations import listing_cache
+from business.catalog_operations import game_catalog
+from business.lobby_feed_operations import lobby_feed, room_summary, ROOM_CREATED
+from business.presence_operations import presence_tracker, PRESENCE_HEARTBEAT_SECONDS
+from business.event_bus_operations import RoomUnavailableError
+from business.admission_operations import admission_control, parse_command, THROTTLED_ERROR
+from business.matchmaking_operations import matchmaker, MATCHMAKING_REFRESH_SECONDS, ALREADY_SEATED_ERROR
+from business.room_membership_operations import (
+    join_room_seat,
+    leave_room_seat,
+    switch_room_seat,
+    publish_seat_changes,
+    invalidate_principal,
+    room_occupancy,
+    seat_matched_players,
+)
 from uuid import UUID
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, TypeAdapter
+from typing import Optional, List, Tuple
+import asyncio
+import os
 
 router = APIRouter()
 
+# Room listing page size, and the most a client may ask for in one page
+ROOM_PAGE_SIZE = int(os.getenv("ROOM_PAGE_SIZE", "50"))
+ROOM_PAGE_SIZE_MAX = int(os.getenv("ROOM_PAGE_SIZE_MAX", "100"))
+
 class RoomCreate(BaseModel):
     password: Optional[str] = None
+    opponent: Optional[str] = None  # "bot": the server plays the other seat
 
 class RoomJoin(BaseModel):
     password: Optional[str] = None
 
+# Lobby listing entry. The board is left out on purpose: it changes with every
+# move, and the listing must only change when a room's occupancy does.
+class AvailableRoom(BaseModel):
+    id: int
+    created_by_id: UUID
+    password: Optional[str] = None
+    type_of_game_id: int
+    available: bool
+
+available_rooms_adapter = TypeAdapter(List[AvailableRoom])
+games_adapter = TypeAdapter(List[Game])
+
 # --- ADD THIS CLASS DEFINITION ---
 class RoomUserCountResponse(BaseModel):
     room_id: int
@@ -25,85 +62,161 @@ class RoomUserCountResponse(BaseModel):
     message: str = ""
 # --- END ADDITION ---
 
+def user_count_response(room_id: int, game_id: int, players: int) -> RoomUserCountResponse:
+    game = game_catalog.by_id(game_id)
+    return RoomUserCountResponse(
+        room_id=room_id,
+        user_count=players,
+        max_players=game.number_of_players if game else 0,
+        message=f"Retrieved user count for room {room_id}."
+    )
+
 async def get_current_active_user(
-    username: str = Depends(get_current_user),
-    session: Session = Depends(get_postgresql_session)
-) -> User:
-    user = session.exec(select(User).where(User.username == username)).first()
+    token: str = Depends(oauth2_scheme),
+    session: AsyncSession = Depends(get_postgresql_session)
+) -> Principal:
+    # Hot path: a token we already verified is served straight from memory
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
+    payload = decode_access_token(token)
+    user = None
+    if payload.get("uid"):
+        user = await session.get(User, UUID(payload["uid"]))
+    else:
+        # Tokens issued before the 'uid' claim existed only carry the username
+        user = (await session.exec(select(User).where(User.username == payload["sub"]))).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
-    return user
+
+    principal = Principal(user_id=user.id, username=user.username, room_id=user.room_id)
+    principal_cache.put(token, principal, payload.get("exp"))
+    return principal
+
+def open_rooms_query(game_id: int, after: Optional[int] = None):
+    # Only rooms where available == True, walked in id order through
+    # ix_room_open_by_game; `after` is the keyset cursor of the previous page
+    statement = (
+        select(Room)
+        .where(Room.type_of_game_id == game_id)
+        .where(Room.available == True)
+    )
+    if after is not None:
+        statement = statement.where(Room.id > after)
+    return statement.order_by(Room.id)
+
+async def open_rooms_page(session: AsyncSession, statement, limit: int) -> Tuple[List[Room], Optional[int]]:
+    # One extra row tells us whether there is a next page, and its cursor
+    rooms = (await session.exec(statement.limit(limit + 1))).all()
+    if len(rooms) > limit:
+        rooms = rooms[:limit]
+        return rooms, rooms[-1].id
+    return rooms, None
+
+async def load_room_with_users(room_id: int, session: AsyncSession) -> Optional[Room]:
+    # Relationships can't be lazy-loaded on an AsyncSession, so always load them
+    # eagerly. populate_existing makes a second call pick up membership changes.
+    # The room's game comes from the in-memory catalog (game_catalog.by_id).
+    return (await session.exec(
+        select(Room)
+        .where(Room.id == room_id)
+        .options(selectinload(Room.users))
+        .execution_options(populate_existing=True)
+    )).first()
 
 @router.get("/available_games", response_model=List[Game])
-def get_available_games(
-    current_user: User = Depends(get_current_active_user),
-    session: Session = Depends(get_postgresql_session)
+async def get_available_games(
+    request: Request,
+    current_user: Principal = Depends(get_current_active_user)
 ):
-    statement = select(Game).where(Game.available == True)
-    games = session.exec(statement).all()
-    return games
+    version = listing_cache.catalog_version
+    cached = listing_cache.cached_response("games", version, request)
+    if cached is not None:
+        return cached
+
+    games = game_catalog.available_games()
+    return listing_cache.store_response("games", version, games_adapter.dump_json(games), request)
 
 @router.post("/heartbeat")
-def heartbeat(
-    current_user: User = Depends(get_current_active_user)
+async def heartbeat(
+    current_user: Principal = Depends(get_current_active_user)
 ):
-    return {"status": "ok"}
+    # Users who stop calling this are taken out of their room by the presence sweeper
+    presence_tracker.touch(current_user.user_id)
+    return {"status": "ok", "interval_seconds": PRESENCE_HEARTBEAT_SECONDS}
 
 
 @router.get("/my_room", response_model=Optional[Room])
-def get_my_room(
-    current_user: User = Depends(get_current_active_user),
-    session: Session = Depends(get_postgresql_session)
+async def get_my_room(
+    current_user: Principal = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_postgresql_session)
 ):
     if current_user.room_id is None:
         return None
-    room = session.exec(
-        select(Room).where(Room.id == current_user.room_id).options(selectinload(Room.game), selectinload(Room.users))
-    ).first()
+    room = await load_room_with_users(current_user.room_id, session)
     return room
 
 @router.get("/user_count/{room_id}", response_model=RoomUserCountResponse)
-def get_room_user_count(
+async def get_room_user_count(
     room_id: int, # This path parameter will be the room's ID
-    current_user: User = Depends(get_current_active_user), # Still require authentication
-    session: Session = Depends(get_postgresql_session)
+    current_user: Principal = Depends(get_current_active_user), # Still require authentication
+    session: AsyncSession = Depends(get_postgresql_session)
 ):
-    # Load the room and its users/game to get the counts
-    # We still need selectinload for users and game to get their counts/details
-    room = session.exec(
-        select(Room).where(Room.id == room_id).options(selectinload(Room.game), selectinload(Room.users))
-    ).first()
-
-    if not room:
+    # Same path as the batched endpoint: one indexed read of the seat count
+    occupancy = await room_occupancy(session, [room_id])
+    if room_id not in occupancy:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Room with ID {room_id} not found."
         )
+    return user_count_response(room_id, *occupancy[room_id])
 
-    actual_users_in_room = len(room.users) if room.users else 0
-    max_game_players = room.game.number_of_players if room.game else 0
-
-    return RoomUserCountResponse(
-        room_id=room.id,
-        user_count=actual_users_in_room,
-        max_players=max_game_players,
-        message=f"Retrieved user count for room {room.id}."
-    )
+@router.get("/user_counts", response_model=List[RoomUserCountResponse])
+async def get_room_user_counts(
+    room_id: List[int] = Query(..., description=f"Room ids (repeat the parameter), at most {ROOM_PAGE_SIZE_MAX}"),
+    current_user: Principal = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_postgresql_session)
+):
+    """
+    Occupancy of many rooms in one request and one query. Rooms that don't
+    exist (any more) are left out of the answer.
+    """
+    room_ids = list(dict.fromkeys(room_id))
+    if len(room_ids) > ROOM_PAGE_SIZE_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {ROOM_PAGE_SIZE_MAX} rooms per request."
+        )
+    occupancy = await room_occupancy(session, room_ids)
+    return [user_count_response(rid, *occupancy[rid]) for rid in room_ids if rid in occupancy]
 
 @router.post("/create_room/{game_name}", response_model=Room, status_code=status.HTTP_201_CREATED)
-def create_room(
+async def create_room(
     game_name: str,
     room_data: RoomCreate,
-    current_user: User = Depends(get_current_active_user),
-    session: Session = Depends(get_postgresql_session)
+    current_user: Principal = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_postgresql_session)
 ):
-    game = session.exec(select(Game).where(Game.name == game_name)).first()
+    game = game_catalog.by_name(game_name)
     if not game:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Game '{game_name}' not found."
         )
 
+    if room_data.opponent == "bot":
+        # Nobody else may join: the creator is seated right away and the room
+        # is never available, so it stays out of listings and the lobby feed
+        room, _ = await seat_matched_players(session, game, [current_user.user_id], closed=True)
+        if room is None:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="You are currently in another room. Please leave it first."
+            )
+        invalidate_principal(current_user.user_id)
+        return room
+
     # --- THE FIX IS HERE ---
     # Determine the initial board size based on the game type.
     # For Tic-Tac-Toe, it's typically 9.
@@ -113,262 +226,239 @@ def create_room(
     initial_board_size = 9 # Assuming Tic-Tac-Toe's 3x3 board
 
     new_room = Room(
-        password=room_data.password,
+        password=room_data.password or None,  # "" means no password
         type_of_game_id=game.id,
-        created_by_id=current_user.id,
+        created_by_id=current_user.user_id,
         position=[0] * initial_board_size # <-- This is the crucial line added/modified
     )
 
     session.add(new_room)
-    session.commit()
-    session.refresh(new_room)
+    await session.commit()
+    await session.refresh(new_room)
+    lobby_feed.publish(game.id, ROOM_CREATED, room=room_summary(new_room, 0, game.number_of_players))
 
     return new_room
 
-@router.get("/available_rooms/{game_name}", response_model=List[Room])
-def get_available_rooms(
+@router.get("/available_rooms/{game_name}", response_model=List[AvailableRoom])
+async def get_available_rooms(
     game_name: str,
-    current_user: User = Depends(get_current_active_user),
-    session: Session = Depends(get_postgresql_session)
+    request: Request,
+    after: Optional[int] = Query(None, description="Cursor: the X-Next-Cursor of the previous page"),
+    limit: int = Query(ROOM_PAGE_SIZE, description=f"Page size, capped at {ROOM_PAGE_SIZE_MAX}"),
+    public_only: bool = Query(False, description="Only rooms without a password"),
+    min_fill: Optional[int] = Query(None, description="At least this many players seated"),
+    max_fill: Optional[int] = Query(None, description="At most this many players seated"),
+    current_user: Principal = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_postgresql_session)
 ):
-    game = session.exec(select(Game).where(Game.name == game_name)).first()
+    limit = max(1, min(limit, ROOM_PAGE_SIZE_MAX))
+
+    game = game_catalog.by_name(game_name)
     if not game:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Game '{game_name}' not found."
         )
-
-    # Only rooms where available == True
-    rooms = session.exec(
-        select(Room)
-        .where(Room.type_of_game_id == game.id)
-        .where(Room.available == True)
-    ).all()
-
-    return rooms
-
-
-def update_room_availability_and_cleanup(room: Room, session: Session):
+    game_id = game.id
+
+    # Unchanged since the client's copy (304) or since we last built it. Only
+    # unfiltered first pages of the default size are kept in memory: those are
+    # the ones lobbies reload, and clients can't grow the cache with odd sizes.
+    version = listing_cache.rooms_version(game_id)
+    default_page = after is None and limit == min(ROOM_PAGE_SIZE, ROOM_PAGE_SIZE_MAX) and min_fill is None and max_fill is None
+    cache_key = f"rooms:{game_id}:{public_only}" if default_page else None
+    cached = listing_cache.cached_response(cache_key, version, request)
+    if cached is not None:
+        return cached
+
+    # The filters below only drop rows along the index walk
+    statement = open_rooms_query(game_id, after)
+    if public_only:
+        statement = statement.where(Room.password == None)
+    if min_fill is not None:
+        statement = statement.where(Room.player_count >= min_fill)
+    if max_fill is not None:
+        statement = statement.where(Room.player_count <= max_fill)
+
+    rooms, next_cursor = await open_rooms_page(session, statement, limit)
+    headers = {}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+
+    body = available_rooms_adapter.dump_json(available_rooms_adapter.validate_python(rooms, from_attributes=True))
+    return listing_cache.store_response(cache_key, version, body, request, headers)
+
+@router.websocket("/ws/lobby/{game_name}")
+async def lobby_ws(
+    websocket: WebSocket,
+    game_name: str,
+    token: str = ""
+):
+    """
+    Live room list for one game: a snapshot of the first ROOM_PAGE_SIZE_MAX
+    open rooms, then room_created / room_filled / room_freed / room_updated /
+    room_deleted diffs. The snapshot's next_cursor (None on the last page) is
+    sent back as {"action": "page", "after": <cursor>} for the next page.
+    Browsers can't set headers on a WebSocket, so the access token comes in
+    the query string.
+    """
+    await websocket.accept()
+    connection = OutboundConnection(websocket)
+    try:
+        decode_access_token(token)
+    except HTTPException:
+        await connection.close(code=1008, reason="Not authenticated")
+        return
+
+    game = game_catalog.by_name(game_name)
+    if not game:
+        connection.send_json({"error": f"Game '{game_name}' not found."})
+        await connection.close(code=1008, reason="Game not found")
+        return
+
+    lobby_feed.subscribe(game.id, connection)
+    # Each page is a query: held to the same per-connection rate as game socket frames
+    limiter = admission_control.connection_limiter()
+    try:
+        await send_lobby_page(connection, game, "snapshot")
+        while True:
+            # The only thing a client asks for is the next page
+            data = parse_command(await websocket.receive_text())
+            if not data or data["action"] != "page" or not isinstance(data.get("after"), int):
+                continue
+            if not limiter.admit("page"):
+                connection.send_json({"error": THROTTLED_ERROR})
+                continue
+            await send_lobby_page(connection, game, "page", data["after"])
+    except WebSocketDisconnect:
+        pass
+    finally:
+        connection.stop()
+        lobby_feed.unsubscribe(game.id, connection)
+
+
+async def send_lobby_page(connection: OutboundConnection, game: Game, action: str, after: Optional[int] = None):
+    # Diffs that come in while the page is read are sent right after it.
+    # Short-lived session: the socket must not hold a pooled connection while it idles.
+    lobby_feed.hold(connection)
+    async with open_postgresql_session() as session:
+        rooms, next_cursor = await open_rooms_page(session, open_rooms_query(game.id, after), ROOM_PAGE_SIZE_MAX)
+    lobby_feed.send_snapshot(connection, {
+        "action": action,
+        "game": game.name,
+        "rooms": [room_summary(room, room.player_count, game.number_of_players) for room in rooms],
+        "next_cursor": next_cursor
+    })
+
+
+@router.websocket("/ws/matchmaking/{game_name}")
+async def matchmaking_ws(
+    websocket: WebSocket,
+    game_name: str,
+    token: str = ""
+):
     """
-    Updates room availability based on current users and game max players.
-    Deletes the room if no users remain.
+    Quick play: wait in the game's queue instead of browsing rooms. Once
+    enough players are waiting, everyone gets {"action": "matched", "room_id"}
+    for a new room they are already seated in, and connects to its game
+    socket. Send {"action": "cancel"}, or just close the socket, to stop waiting.
     """
-    if room.game:
-        max_players = room.game.number_of_players
-        current_players = len(room.users)
-
-        if current_players == 0:
-            # Delete the room if no users are inside
-            session.delete(room)
-            session.commit()
-            return None  # Room no longer exists
+    await websocket.accept()
+    connection = OutboundConnection(websocket)
+    try:
+        async with open_postgresql_session() as session:
+            current_user = await get_current_active_user(token, session)
+    except HTTPException:
+        await connection.close(code=1008, reason="Not authenticated")
+        return
+
+    game = game_catalog.by_name(game_name)
+    if not game:
+        connection.send_json({"error": f"Game '{game_name}' not found."})
+        await connection.close(code=1008, reason="Game not found")
+        return
+    if current_user.room_id is not None:
+        connection.send_json({"error": ALREADY_SEATED_ERROR})
+        await connection.close(code=1008, reason="Already in a room")
+        return
+
+    presence_tracker.touch(current_user.user_id)
+    ticket = matchmaker.open_ticket(game, current_user.user_id)
+    outcome = matchmaker.outcome(ticket)
+    receive = asyncio.ensure_future(websocket.receive_text())
+    try:
+        queued = await matchmaker.enqueue(ticket)
+        connection.send_json({"action": "queued", "game": game.name, "waiting": queued["waiting"]})
+        while not outcome.done():
+            await asyncio.wait({receive, outcome}, timeout=MATCHMAKING_REFRESH_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+            if receive.done():
+                receive.result()  # raises WebSocketDisconnect once the client is gone
+                # Anything the client sends means it stopped waiting
+                break
+            if not outcome.done():
+                # Still waiting: renew the ticket (and keep the user's presence fresh)
+                presence_tracker.touch(current_user.user_id)
+                await matchmaker.enqueue(ticket)
+        if outcome.done():
+            result = outcome.result()
+            connection.send_json(result)
+            await connection.close(code=1000, reason="Matched" if result["action"] == "matched" else "Cancelled")
         else:
-            # Update availability depending on number of players
-            room.available = current_players < max_players
-            session.add(room)
-            session.commit()
-            session.refresh(room)
-            return room
-    else:
-        # If no game info, just leave as is
-        return room
+            await connection.close(code=1000, reason="Left the queue")
+    except WebSocketDisconnect:
+        connection.stop()
+    except RoomUnavailableError:
+        connection.send_json({"error": "Quick play is temporarily unavailable."})
+        await connection.close(code=1011, reason="Queue unavailable")
+    finally:
+        receive.cancel()
+        try:
+            await matchmaker.close_ticket(ticket)
+        except RoomUnavailableError:
+            pass  # The queue went away with its worker, and the ticket with it
+
 
 @router.post("/join_room/{room_id}", response_model=Room)
-def join_room(
+async def join_room(
     room_id: int,
     room_join_data: RoomJoin,
-    current_user: User = Depends(get_current_active_user),
-    session: Session = Depends(get_postgresql_session)
+    current_user: Principal = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_postgresql_session)
 ):
-    statement = (
-        select(Room)
-        .where(Room.id == room_id)
-        .options(selectinload(Room.game), selectinload(Room.users))
-    )
-    room = session.exec(statement).first()
-
-    if not room:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Room not found."
-        )
-
-    if room.password:
-        if not room_join_data.password or room_join_data.password != room.password:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Incorrect password for this room."
-            )
-    else: # If room has no password, but user provided one
-        if room_join_data.password:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="This room does not require a password."
-            )
-    
-    if room.game:
-        max_players = room.game.number_of_players
-        current_players = len(room.users)
-
-        if current_players >= max_players:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Room is full. Cannot join."
-            )
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Room's game information not available."
-        )
-
-    if current_user.room_id == room.id:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="You are already in this room."
-        )
-
-    # Signal to the frontend that the user is in another room and needs confirmation
-    if current_user.room_id is not None and current_user.room_id != room.id:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="You are currently in another room. Do you want to leave your current room and join this one?"
-        )
-
-    # All checks passed, user joins the room
-    current_user.room_id = room.id
-    session.add(current_user)
-    session.commit()
-    session.refresh(current_user)
-
-    # Refresh room to get updated users list
-    session.refresh(room)
-
-    # Update room availability or delete if empty
-    updated_room = update_room_availability_and_cleanup(room, session)
-    if updated_room is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Room was deleted due to no users."
-        )
-
-    return updated_room
+    # One transaction: the seat is only taken if one is free (see business/room_membership_operations.py)
+    room, changes = await join_room_seat(session, current_user.user_id, room_id, room_join_data.password)
+    presence_tracker.touch(current_user.user_id)
+    invalidate_principal(current_user.user_id)
+    publish_seat_changes(changes)
+    return room
 
 # --- NEW: Endpoint to leave the current room ---
 @router.post("/leave_room", response_model=User)
-def leave_room(
-    current_user: User = Depends(get_current_active_user),
-    session: Session = Depends(get_postgresql_session)
+async def leave_room(
+    current_user: Principal = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_postgresql_session)
 ):
-    if current_user.room_id is None:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="You are not currently in any room to leave."
-        )
-
-    old_room_id = current_user.room_id
-
-    current_user.room_id = None
-    session.add(current_user)
-    session.commit()
-    session.refresh(current_user)
-
-    old_room = session.exec(
-        select(Room).where(Room.id == old_room_id).options(selectinload(Room.game), selectinload(Room.users))
-    ).first()
-
-    if old_room:
-        # Update availability or delete old room if empty
-        updated_room = update_room_availability_and_cleanup(old_room, session)
-        if updated_room is None:
-            # Room deleted, no action needed here
-            pass
-
-    return current_user
+    try:
+        user, changes = await leave_room_seat(session, current_user.user_id)
+    finally:
+        # Also when not in a room: the cached principal evidently thought otherwise
+        invalidate_principal(current_user.user_id)
+    # Frees a seat, or deletes the room if this was the last player
+    publish_seat_changes(changes)
+    return user
 
 # --- NEW: Endpoint to force join a room (after frontend confirmation) ---
 @router.post("/force_join_room/{room_id}", response_model=Room)
-def force_join_room(
+async def force_join_room(
     room_id: int,
     room_join_data: RoomJoin,
-    current_user: User = Depends(get_current_active_user),
-    session: Session = Depends(get_postgresql_session)
+    current_user: Principal = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_postgresql_session)
 ):
-
-    statement = (
-        select(Room)
-        .where(Room.id == room_id)
-        .options(selectinload(Room.game), selectinload(Room.users))
-    )
-    room = session.exec(statement).first()
-
-    if not room:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Room not found."
-        )
-
-    # Password check (same as join_room)
-    if room.password:
-        if not room_join_data.password or room_join_data.password != room.password:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Incorrect password for this room."
-            )
-    else:
-        if room_join_data.password:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="This room does not require a password."
-            )
-
-    # Room capacity check (same as join_room)
-    if room.game:
-        max_players = room.game.number_of_players
-        current_players = len(room.users)
-        
-        # Only check if room is full IF the user is not already in this room
-        if current_user.room_id != room.id and current_players >= max_players:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Room is full. Cannot join."
-            )
-        elif current_user.room_id == room.id:
-            # Already in this room, no action needed for leaving/joining
-            return room # Return the room as user is already there
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Room's game information not available."
-        )
-
-    # --- Leave previous room (if any) and join new one ---
-    if current_user.room_id is not None and current_user.room_id != room.id:
-        # User was in a different room, leave old room first
-        old_room_id_to_refresh = current_user.room_id
-        current_user.room_id = None
-        session.add(current_user)
-        session.commit() # Commit leaving the old room
-        session.refresh(current_user)
-
-        # Refresh old room's data (after user has left)
-        old_room_obj = session.get(Room, old_room_id_to_refresh)
-        if old_room_obj:
-            session.refresh(old_room_obj)
-            update_room_availability_and_cleanup(old_room_obj, session)
-
-    # Now assign user to new room
-    current_user.room_id = room.id
-    session.add(current_user)
-    session.commit()
-    session.refresh(current_user)
-    session.refresh(room)
-
-    # Update availability or delete if empty
-    updated_room = update_room_availability_and_cleanup(room, session)
-    if updated_room is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Room was deleted due to no users."
-        )
-
-    return updated_room
\ No newline at end of file
+    # Leaves the previous room (if any) and joins this one in the same transaction
+    room, changes = await switch_room_seat(session, current_user.user_id, room_id, room_join_data.password)
+    if changes:
+        presence_tracker.touch(current_user.user_id)
+        invalidate_principal(current_user.user_id)
+        publish_seat_changes(changes)
+    return room
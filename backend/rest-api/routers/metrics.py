@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Request
+from business.password_operations import password_pool
+from business.database_operations import postgresql_engine
+from business.db_metrics_operations import database_metrics
+from business.broadcast_operations import broadcast_metrics, open_connections
+from business.admission_operations import admission_control
+from business.matchmaking_operations import matchmaker
+from business.event_bus_operations import room_relay
+from business.lobby_feed_operations import lobby_feed
+from business.listing_cache_operations import listing_cache
+from business.presence_operations import presence_tracker
+from business.game_state_operations import game_state_engine
+
+router = APIRouter()
+
+# Operational counters for the worker pools and caches of this process
+@router.get("/metrics")
+async def get_metrics(request: Request):
+    return {
+        "password_hashing": password_pool.metrics(),
+        "database": database_metrics.snapshot(postgresql_engine.pool),
+        "game_sockets": {
+            **broadcast_metrics.snapshot(open_connections),
+            "open_game_sockets": admission_control.open_game_sockets,
+        },
+        "game_socket_admission": admission_control.metrics(),
+        "room_relay": room_relay.snapshot(),
+        "lobby_subscribers": lobby_feed.subscriber_count(),
+        "listing_cache": listing_cache.metrics(),
+        "presence": presence_tracker.metrics(),
+        "matchmaking": matchmaker.metrics(),
+        "board_version_conflicts": game_state_engine.version_conflicts,
+        "startup": getattr(request.app.state, "startup", None),
+    }
@@ -1,359 +1,601 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
-from typing import Dict, List, Optional
-from sqlmodel import select, Session, Field, Column, SQLModel # Ensure SQLModel is imported
-from sqlalchemy.dialects.postgresql import ARRAY, INTEGER # For ARRAY type
-from business.database_operations import get_postgresql_session
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
+from typing import Optional, Set
+import asyncio
 from pydantic import BaseModel
-from uuid import UUID # Assuming User.id is UUID
-
-# IMPORTANT: You MUST ensure your Game and Room models are imported from models/games.py
-# Do NOT define them here if they are already in models/games.py.
-# If they are only defined here, then ensure models/games.py does NOT define them.
-# The `models.games` import is preferred.
-from models.games import Game, Room # <--- Make sure these are the correct models with `position` in Room
+from business.broadcast_operations import OutboundConnection
+from business.admission_operations import (
+    admission_control,
+    parse_command,
+    THROTTLED_ERROR,
+    MALFORMED_MESSAGE_ERROR,
+    MESSAGE_TOO_BIG_ERROR,
+    SERVER_FULL_ERROR,
+)
+from business.frame_protocol_operations import BINARY_SUBPROTOCOL, FrameEncoder
+from business.solver_operations import tictactoe_solver, BOT_DIFFICULTIES
+from business.event_bus_operations import room_relay, RoomUnavailableError
+from business.resume_operations import (
+    RESUME_GRACE_SECONDS,
+    RESUME_EXPIRED_ERROR,
+    is_away,
+    issue_resume_token,
+    hold_seat,
+    take_back_seat,
+    forget_seat,
+    record_event,
+    events_after,
+)
+from business.game_state_operations import (
+    game_state_engine,
+    GameState,
+    MoveOutcome,
+    FINISHED_STATUSES,
+    ROOM_NOT_FOUND_ERROR,
+    GAME_CONFIG_MISSING_ERROR,
+    BOARD_VERSION_CONFLICT_ERROR,
+)
 
 router = APIRouter()
 
-# Global state dictionaries for real-time WebSocket connections (not for persistent board state)
-active_connections: Dict[int, List[WebSocket]] = {}
-turn_tracker: Dict[int, int] = {}
-game_status: Dict[int, Optional[str]] = {}
-draw_offered_by: Dict[int, Optional[int]] = {}
-
-def check_winner(board: List[int]) -> Optional[int]:
-    win_positions = [
-        [0, 1, 2], [3, 4, 5], [6, 7, 8],
-        [0, 3, 6], [1, 4, 7], [2, 5, 8],
-        [0, 4, 8], [2, 4, 6]
-    ]
-    for positions in win_positions:
-        p0, p1, p2 = positions
-        if board[p0] != 0 and board[p0] == board[p1] == board[p2]:
-            return board[p0]
+# A room's players can be connected to different workers. The worker that owns
+# the room (business/event_bus_operations.py) runs every command for it through
+# handle_room_command below and addresses its frames to relay connection ids;
+# sockets on other workers only forward what their client sends.
+
+# Close reasons for games that can't be loaded
+LOAD_ERROR_CLOSE_REASONS = {
+    ROOM_NOT_FOUND_ERROR: "Invalid Room ID",
+    GAME_CONFIG_MISSING_ERROR: "Game config missing for room",
+}
+ROOM_UNAVAILABLE_ERROR = "Room is temporarily unavailable."
+
+# Seat of the server-side opponent in GameState.players: "bot:<difficulty>".
+# It has no socket; its moves are looked up in the solver's table.
+BOT_SEAT_PREFIX = "bot:"
+
+def is_bot(seat: str) -> bool:
+    return seat.startswith(BOT_SEAT_PREFIX)
+
+def is_connected(seat: str) -> bool:
+    # A seat with a socket behind it, i.e. neither the bot nor a player who's away
+    return not is_bot(seat) and not is_away(seat)
+
+# Grace timers of held seats (kept referenced until they fire)
+grace_timers: Set[asyncio.Task] = set()
+
+def broadcast(game_id: int, payload: dict):
+    # Numbered and kept, so a player who reconnects can be sent what they missed
+    state = game_state_engine.get(game_id)
+    if state is not None:
+        payload = record_event(state, payload)
+    room_relay.broadcast(game_id, payload)
+
+def send_to_player(game_id: int, state: GameState, player_index: int, payload: dict):
+    if len(state.players) > player_index and is_connected(state.players[player_index]):
+        room_relay.send(game_id, state.players[player_index], payload)
+
+def send_session(game_id: int, state: GameState, connection_id: str, player_index: int):
+    # The token a dropped socket can reconnect with (?resume=<token>&after=<last seq>)
+    room_relay.send(game_id, connection_id, {
+        "action": "session",
+        "player_index": player_index,
+        "resume_token": issue_resume_token(state, connection_id),
+        "resume_grace_seconds": RESUME_GRACE_SECONDS
+    })
+
+def initial_state_frame(state: GameState, player_index: int) -> dict:
+    return {
+        "action": "initial_state",
+        "board": state.board.to_list(),
+        "turn": state.turn,
+        "status": state.status,
+        "player_index": player_index,
+        "version": state.version
+    }
+
+async def play_bot_turn(game_id: int, state: GameState):
+    # If it's the bot's turn, answer right away: one table lookup, no search
+    if state.status != "ongoing" or len(state.players) <= state.turn or not is_bot(state.players[state.turn]):
+        return
+    difficulty = state.players[state.turn][len(BOT_SEAT_PREFIX):]
+    player_index = state.turn
+    position = tictactoe_solver.choose_move(state.board, difficulty)
+    outcome, error = game_state_engine.make_move(state, player_index, position)
+    if not error:
+        await broadcast_move(game_id, player_index, outcome)
+
+def drop_bots_if_alone(state: GameState):
+    # The bot never keeps a room alive on its own
+    if all(is_bot(seat) for seat in state.players):
+        state.players.clear()
+
+async def agree_draw(game_id: int, state: GameState):
+    game_state_engine.agree_draw(state)
+    broadcast(game_id, {
+        "action": "game_over",
+        "result": "draw_agreed",
+        "board": state.board.to_list(),
+        "version": state.version
+    })
+    game_state_engine.flush_soon(game_id)
+
+async def broadcast_move(game_id: int, player_index: int, outcome: MoveOutcome):
+    # Broadcast the updated board to all clients straight from memory
+    broadcast(game_id, {
+        "action": "update",
+        "board": outcome.board,
+        "last_move_by": player_index,
+        "current_turn": outcome.current_turn,
+        "version": outcome.version
+    })
+
+    if outcome.winner:
+        broadcast(game_id, {
+            "action": "game_over",
+            "result": f"Player {outcome.winner-1} wins!",
+            "board": outcome.board,
+            "version": outcome.version
+        })
+    elif outcome.tie:
+        broadcast(game_id, {
+            "action": "game_over",
+            "result": "It's a draw!",
+            "board": outcome.board,
+            "version": outcome.version
+        })
+
+    if outcome.winner or outcome.tie:
+        # Game over: make the final board durable, outside this room's command lock
+        game_state_engine.flush_soon(game_id)
+
+async def release_if_empty(game_id: int):
+    # Nobody is seated any more: persist, forget the game and give up ownership
+    state = game_state_engine.get(game_id)
+    if state is None or not state.players:
+        await game_state_engine.release(game_id)
+        await room_relay.release(game_id)
+        admission_control.forget_room(game_id)
+
+# --- Owner side: runs on the worker that owns the room, one command at a time ---
+
+async def handle_room_command(game_id: int, command: dict) -> Optional[dict]:
+    try:
+        if command["type"] == "join":
+            return await join_room(game_id, command["connection"], command.get("bot"), command.get("resume"), command.get("after"))
+        if command["type"] == "seat_expired":
+            return expire_seat(game_id, command["token"])
+        if command["type"] == "http_move":
+            return await apply_http_move(game_id, command["player_index"], command["position"], command.get("version"))
+
+        state = game_state_engine.get(game_id)
+        if state is None or command["connection"] not in state.players:
+            return None  # the socket was already removed from the game
+
+        if command["type"] == "action":
+            # The room's shared budget, whichever workers its sockets are on
+            if not admission_control.admit_to_room(game_id, command["data"].get("action")):
+                room_relay.send(game_id, command["connection"], {"error": THROTTLED_ERROR})
+                return None
+            return await handle_action(game_id, state, command["connection"], command["player_index"], command["data"])
+        if command["type"] == "disconnect":
+            return handle_disconnect(game_id, state, command["connection"], command["player_index"])
+        return None
+    finally:
+        await release_if_empty(game_id)
+
+async def join_room(
+    game_id: int,
+    connection_id: str,
+    bot: Optional[str] = None,
+    resume: Optional[str] = None,
+    after: Optional[int] = None
+) -> dict:
+    # Load the live game. Only the first socket of a room reads the database;
+    # everyone after that shares the in-memory state.
+    state, error = await game_state_engine.get_or_load(game_id)
+    if error:
+        return {"error": error, "close_reason": LOAD_ERROR_CLOSE_REASONS[error]}
+
+    if resume is not None:
+        return resume_seat(game_id, state, connection_id, resume, after)
+
+    if len(state.players) >= state.number_of_players:
+        return {"error": "Room full.", "close_reason": "Room full"}
+
+    if bot is not None:
+        # Single player: the bot takes the other seat, so it needs an empty 3x3 two-player room
+        if state.players or state.number_of_players != 2 or len(state.board) != 9:
+            return {"error": "The computer opponent needs an empty tic-tac-toe room.", "close_reason": "Bot unavailable"}
+        state.players.append(connection_id)
+        state.players.append(BOT_SEAT_PREFIX + bot)
+    else:
+        state.players.append(connection_id)
+    player_index = state.players.index(connection_id)
+
+    room_relay.send(game_id, connection_id, {"message": f"Connected as player {player_index}"})
+    send_session(game_id, state, connection_id, player_index)
+
+    # Send initial game state to the new player
+    room_relay.send(game_id, connection_id, initial_state_frame(state, player_index))
+
+    if len(state.players) == state.number_of_players:
+        broadcast(game_id, {
+            "action": "game_ready",
+            "message": "Both players connected. Game can start!",
+            "current_board": state.board.to_list(),
+            "current_turn": state.turn,
+            "version": state.version
+        })
+        await play_bot_turn(game_id, state)
+
+    return {"player_index": player_index}
+
+def resume_seat(game_id: int, state: GameState, connection_id: str, token: str, after: Optional[int]) -> dict:
+    player_index = take_back_seat(state, token, connection_id)
+    if player_index is None:
+        return {"error": RESUME_EXPIRED_ERROR, "close_reason": "Resume expired"}
+
+    room_relay.send(game_id, connection_id, {"message": f"Reconnected as player {player_index}"})
+    send_session(game_id, state, connection_id, player_index)
+    missed = events_after(state, after) if after is not None else None
+    if missed is None:
+        # Too far behind to replay: start over from the current board
+        room_relay.send(game_id, connection_id, initial_state_frame(state, player_index))
+    else:
+        for event in missed:
+            room_relay.send(game_id, connection_id, event)
+    broadcast(game_id, {
+        "action": "player_back",
+        "player": player_index,
+        "message": f"Player {player_index} is back."
+    })
+    return {"player_index": player_index}
+
+async def apply_http_move(game_id: int, player_index: int, position: int, version: Optional[int]) -> dict:
+    state, error = await game_state_engine.get_or_load(game_id)
+    if error:
+        return {"status_code": 404, "error": "Room not found."}
+
+    # A retried POST, or a move the socket already made: nothing left to do
+    if game_state_engine.is_repeat(state, player_index, position, version):
+        return {"new_board": state.board.to_list(), "version": state.version}
+
+    outcome, error = game_state_engine.make_move(state, player_index, position, version)
+    if error == BOARD_VERSION_CONFLICT_ERROR:
+        return {"status_code": 409, "error": error}
+    if error:
+        return {"status_code": 400, "error": error}
+
+    await broadcast_move(game_id, player_index, outcome)
+    await play_bot_turn(game_id, state)
+    return {"new_board": outcome.board, "version": outcome.version}
+
+async def handle_action(game_id: int, state: GameState, connection_id: str, player_index: int, data: dict) -> Optional[dict]:
+    def reply(payload: dict):
+        room_relay.send(game_id, connection_id, payload)
+
+    action = data.get("action")
+
+    if action == "get_turn":
+        reply({"turn": state.turn})
+
+    elif action == "get_board":
+        # The engine's board is authoritative; no database round trip needed
+        reply({"board": state.board.to_list()})
+
+    elif action == "resync":
+        # A binary client got a delta it couldn't apply: send a full snapshot
+        reply({
+            "action": "board_sync",
+            "board": state.board.to_list(),
+            "turn": state.turn,
+            "status": state.status,
+            "version": state.version
+        })
+
+    elif action == "make_move":
+        # Validate and apply in memory, broadcast immediately; the board is
+        # persisted by the engine's write-behind flush.
+        if game_state_engine.is_repeat(state, player_index, data.get("position"), data.get("version")):
+            return None  # already applied and broadcast
+        outcome, error = game_state_engine.make_move(state, player_index, data.get("position"), data.get("version"))
+        if error == BOARD_VERSION_CONFLICT_ERROR:
+            # Hand the client the current board to retry against
+            reply({"error": error, "board": state.board.to_list(), "turn": state.turn, "version": state.version})
+            return None
+        if error:
+            reply({"error": error})
+            return None
+
+        await broadcast_move(game_id, player_index, outcome)
+        await play_bot_turn(game_id, state)
+
+    elif action == "offer_draw":
+        if state.status != "ongoing":
+            reply({"error": "Cannot offer draw, game ended."})
+            return None
+
+        if state.draw_offered_by is not None:
+            reply({"error": "A draw offer is already pending."})
+            return None
+
+        opponent = 1 - player_index
+        if len(state.players) > opponent and is_bot(state.players[opponent]):
+            # The bot takes a draw unless it can force a win from here
+            bot_outcome = tictactoe_solver.outcome(state.board)
+            if state.turn != opponent:
+                bot_outcome = -bot_outcome
+            if bot_outcome <= 0:
+                await agree_draw(game_id, state)
+            else:
+                reply({"action": "draw_declined", "from_player": opponent})
+            return None
+
+        state.draw_offered_by = player_index
+        send_to_player(game_id, state, opponent, {
+            "action": "draw_offer",
+            "from_player": player_index
+        })
+        reply({"message": "Draw offer sent."})
+
+    elif action == "respond_draw":
+        if state.draw_offered_by is None:
+            reply({"error": "No draw offer to respond to."})
+            return None
+
+        if player_index == state.draw_offered_by:
+            reply({"error": "You cannot respond to your own draw offer."})
+            return None
+
+        accept = data.get("accept", False)
+        if accept:
+            await agree_draw(game_id, state)
+        else:
+            send_to_player(game_id, state, state.draw_offered_by, {
+                "action": "draw_declined",
+                "from_player": player_index
+            })
+            reply({"message": "Draw declined."})
+
+        state.draw_offered_by = None
+
+    elif action == "leave_room":
+        other_player_index = 1 - player_index
+        if len(state.players) > other_player_index and state.players[other_player_index] != connection_id:
+            send_to_player(game_id, state, other_player_index, {
+                "action": "player_left",
+                "player": player_index,
+                "message": f"Player {player_index} has left the room. Game ended."
+            })
+            state.status = "player_left"
+
+        state.players.remove(connection_id)
+        forget_seat(state, connection_id)
+        drop_bots_if_alone(state)
+        # The socket's own worker closes it
+        return {"left": True}
+
+    elif action == "play_again":
+        if state.status not in FINISHED_STATUSES:
+            reply({"error": "Game not finished yet."})
+            return None
+
+        game_state_engine.restart(state)
+
+        # Broadcast the fresh board to all clients.
+        broadcast(game_id, {
+            "action": "game_restart",
+            "board": state.board.to_list(),
+            "message": "Game restarted, Player 0 starts.",
+            "version": state.version
+        })
+        await play_bot_turn(game_id, state)
+
+    else:
+        reply({"error": "Unknown action."})
+
     return None
 
-def board_full(board: List[int]) -> bool:
-    return all(pos != 0 for pos in board)
+def handle_disconnect(game_id: int, state: GameState, connection_id: str, player_index: int) -> None:
+    # Hold the seat for a while: a network blip shouldn't cost the match
+    token = hold_seat(state, connection_id) if RESUME_GRACE_SECONDS > 0 else None
+    if token is None:
+        end_for_disconnect(game_id, state, connection_id)
+        return
+    broadcast(game_id, {
+        "action": "player_away",
+        "player": player_index,
+        "grace_seconds": RESUME_GRACE_SECONDS,
+        "message": f"Player {player_index} lost connection. Waiting {RESUME_GRACE_SECONDS:g}s for them to come back."
+    })
+    timer = asyncio.create_task(expire_after_grace(game_id, token))
+    grace_timers.add(timer)
+    timer.add_done_callback(grace_timers.discard)
+
+async def expire_after_grace(game_id: int, token: str):
+    await asyncio.sleep(RESUME_GRACE_SECONDS)
+    try:
+        await room_relay.dispatch(game_id, {"type": "seat_expired", "token": token})
+    except RoomUnavailableError:
+        pass  # Nobody owns the room any more, so there's no seat to free
+
+def expire_seat(game_id: int, token: str) -> None:
+    state = game_state_engine.get(game_id)
+    if state is None:
+        return
+    seat = state.resume_tokens.get(token)
+    if seat is None or not is_away(seat) or seat not in state.players:
+        return  # came back in time
+    end_for_disconnect(game_id, state, seat)
+
+def end_for_disconnect(game_id: int, state: GameState, seat: str):
+    player_index = state.players.index(seat)
+    state.players.remove(seat)
+    forget_seat(state, seat)
+    drop_bots_if_alone(state)
+
+    if len(state.players) > 0:
+        send_to_player(game_id, state, 0, {
+            "action": "player_left",
+            "player": player_index,
+            "message": f"Player {player_index} has disconnected unexpectedly. Game ended."
+        })
+        state.status = "player_disconnected"
+
+async def on_board_reloaded(state: GameState):
+    # Our copy lost a version conflict and was replaced by the saved board
+    broadcast(state.room_id, {
+        "action": "board_sync",
+        "board": state.board.to_list(),
+        "turn": state.turn,
+        "status": state.status,
+        "version": state.version,
+        "message": "The board was changed elsewhere; showing the saved board."
+    })
+
+room_relay.set_command_handler(handle_room_command)
+game_state_engine.set_conflict_handler(on_board_reloaded)
+
+# --- Endpoints: may run on any worker ---
 
 class MakeMoveRequest(BaseModel):
     position: int
     player_index: int
+    version: Optional[int] = None  # board version the move is based on; 409 if the board moved on
 
 @router.post("/room/{room_id}/make_move")
-def post_move(
+async def post_move(
     room_id: int,
-    move_data: MakeMoveRequest,
-    session: Session = Depends(get_postgresql_session)
+    move_data: MakeMoveRequest
 ):
-    # 1. Retrieve the absolute latest board state from the database.
-    room = session.exec(select(Room).where(Room.id == room_id)).first()
-    if not room:
-        raise HTTPException(status_code=404, detail="Room not found.")
-
-    # Input validation based on the CURRENT board from DB
-    if not (0 <= move_data.position < len(room.position)):
-        raise HTTPException(status_code=400, detail="Invalid move position.")
-
-    if room.position[move_data.position] != 0:
-        raise HTTPException(status_code=400, detail="Position already taken.")
-
     if move_data.player_index not in [0, 1]:
         raise HTTPException(status_code=400, detail="Invalid player index. Must be 0 or 1.")
 
-    # 2. Apply the new move to this freshly retrieved board.
-    # IMPORTANT: Create a NEW list to ensure SQLModel detects the change.
-    updated_board = list(room.position) # Make a copy of the *current* board
-    updated_board[move_data.position] = move_data.player_index + 1
-    room.position = updated_board # Assign the *new list* back
-
-    # 3. Save the entirely new board state back to the database.
+    # Moves go through the room's owner, like the WebSocket ones, so this
+    # endpoint can't overwrite a board the socket just changed.
     try:
-        session.add(room)
-        session.commit()
-        session.refresh(room) # Refresh to ensure `room` object holds latest DB state
-        return {"message": "Move successfully recorded.", "new_board": list(room.position)}
-    except Exception as e:
-        session.rollback()
-        raise HTTPException(status_code=500, detail=f"Failed to record move: {e}")
+        result = await room_relay.dispatch(room_id, {
+            "type": "http_move",
+            "position": move_data.position,
+            "player_index": move_data.player_index,
+            "version": move_data.version
+        })
+    except RoomUnavailableError:
+        raise HTTPException(status_code=503, detail=ROOM_UNAVAILABLE_ERROR)
+
+    if "error" in result:
+        raise HTTPException(status_code=result["status_code"], detail=result["error"])
+    return {"message": "Move successfully recorded.", "new_board": result["new_board"], "version": result["version"]}
+
+@router.get("/room/{room_id}/moves")
+async def get_moves(
+    room_id: int,
+    after: int = 0
+):
+    # The game's board history from the move log, in order. Clients catching
+    # up (reconnects, spectators) pass the last version they have as `after`.
+    return {"room_id": room_id, "moves": await game_state_engine.history(room_id, after)}
 
 @router.websocket("/ws/game/{game_id}")
 async def game_ws(
     websocket: WebSocket,
     game_id: int,
-    session: Session = Depends(get_postgresql_session)
+    opponent: Optional[str] = None,  # "bot": single player against the server
+    difficulty: str = "hard",
+    resume: Optional[str] = None,  # resume token from the "session" frame of a dropped socket
+    after: Optional[int] = None  # last "seq" that socket saw; later frames are replayed
 ):
-    await websocket.accept()
-
-    # Initial load of room and game configuration
-    room = session.exec(select(Room).where(Room.id == game_id)).first()
-    if not room:
-        await websocket.send_json({"error": "Invalid room ID. Please provide a valid room ID."})
-        await websocket.close(code=1008, reason="Invalid Room ID")
-        return
-
-    game = session.exec(select(Game).where(Game.id == room.type_of_game_id)).first()
-    if not game:
-        await websocket.send_json({"error": "Game configuration not found for this room."})
-        await websocket.close(code=1008, reason="Game config missing for room")
+    # Clients that offer the binary subprotocol get compact frames and board
+    # deltas; everyone else gets JSON as before
+    binary = BINARY_SUBPROTOCOL in websocket.scope.get("subprotocols", [])
+    await websocket.accept(subprotocol=BINARY_SUBPROTOCOL if binary else None)
+    if not admission_control.open_game_socket():
+        # 1013 Try Again Later: this worker has all the sockets it takes
+        await websocket.send_json({"error": SERVER_FULL_ERROR})
+        await websocket.close(code=1013, reason="Server full")
         return
-
-    # Ensure the board in the database is correctly initialized *if it's empty/malformed*
-    expected_board_size = getattr(game, 'board_size', 9) # Assuming board_size on Game model or default to 9
-    if not room.position or len(room.position) != expected_board_size:
-        room.position = [0] * expected_board_size
-        session.add(room)
-        session.commit()
-        session.refresh(room)
-
-    # Initialize in-memory game state for THIS WebSocket session if not already done
-    if game_id not in active_connections:
-        active_connections[game_id] = []
-        turn_tracker[game_id] = 0
-        game_status[game_id] = "ongoing"
-        draw_offered_by[game_id] = None
-
-    if len(active_connections[game_id]) >= game.number_of_players:
-        await websocket.send_json({"error": "Room full."})
-        await websocket.close(code=1008, reason="Room full")
+    # All outgoing frames go through the connection's queue, in order. Register
+    # it before joining so the owner's welcome frames can reach it.
+    connection = OutboundConnection(websocket, encoder=FrameEncoder() if binary else None)
+    if opponent == "bot" and difficulty not in BOT_DIFFICULTIES:
+        connection.send_json({"error": f"Unknown difficulty. Choose one of: {', '.join(BOT_DIFFICULTIES)}."})
+        await connection.close(code=1008, reason="Unknown difficulty")
+        admission_control.close_game_socket()
         return
+    connection_id = room_relay.register(game_id, connection)
+    # Set once joined: from then on the owner has a seat to hold or free
+    player_index = None
+    left = False
 
-    active_connections[game_id].append(websocket)
-    player_index = active_connections[game_id].index(websocket)
+    try:
+        try:
+            joined = await room_relay.dispatch(game_id, {
+                "type": "join",
+                "connection": connection_id,
+                "bot": difficulty if opponent == "bot" else None,
+                "resume": resume,
+                "after": after
+            })
+        except RoomUnavailableError:
+            joined = {"error": ROOM_UNAVAILABLE_ERROR, "close_reason": "Room unavailable"}
 
-    await websocket.send_json({"message": f"Connected as player {player_index}"})
+        if "error" in joined:
+            connection.send_json({"error": joined["error"]})
+            await connection.close(code=1008, reason=joined["close_reason"])
+            return
 
-    # Send initial game state (which includes the board *from the DB*) to the new player
-    await websocket.send_json({
-        "action": "initial_state",
-        "board": list(room.position), # <--- Initial board loaded from DB
-        "turn": turn_tracker[game_id],
-        "status": game_status[game_id],
-        "player_index": player_index
-    })
+        player_index = joined["player_index"]
+        limiter = admission_control.connection_limiter()
 
-    if len(active_connections[game_id]) == game.number_of_players:
-        for conn in active_connections[game_id]:
-            await conn.send_json({
-                "action": "game_ready",
-                "message": "Both players connected. Game can start!",
-                "current_board": list(room.position), # <--- Board from DB
-                "current_turn": turn_tracker[game_id]
+        while True:
+            message = await websocket.receive_text()
+            if not admission_control.message_fits(message):
+                # 1009 Message Too Big; then the usual cleanup for a dropped socket
+                connection.send_json({"error": MESSAGE_TOO_BIG_ERROR})
+                await connection.close(code=1009, reason="Message too big")
+                raise WebSocketDisconnect(code=1009)
+            data = parse_command(message)
+            if not admission_control.admit(limiter, data.get("action") if data else None):
+                # Dropped; say so once, not once per flooded frame
+                if limiter.throttled_streak == 1:
+                    connection.send_json({"error": THROTTLED_ERROR})
+                continue
+            if data is None:
+                admission_control.reject_malformed()
+                connection.send_json({"error": MALFORMED_MESSAGE_ERROR})
+                continue
+            result = await room_relay.dispatch(game_id, {
+                "type": "action",
+                "connection": connection_id,
+                "player_index": player_index,
+                "data": data
             })
 
-    try:
-        while True:
-            data = await websocket.receive_json()
-            action = data.get("action")
-
-            current_game_status = game_status.get(game_id, "ongoing")
-
-            if action == "get_turn":
-                await websocket.send_json({"turn": turn_tracker[game_id]})
-
-            elif action == "get_board":
-                # When asked for board, ALWAYS get it freshly from the DB
-                room = session.exec(select(Room).where(Room.id == game_id)).first()
-                if room:
-                    await websocket.send_json({"board": list(room.position)})
-                else:
-                    await websocket.send_json({"error": "Room not found for board request."})
-
-
-            elif action == "make_move":
-                if current_game_status != "ongoing":
-                    await websocket.send_json({"error": "Game already ended."})
-                    continue
-
-                pos = data.get("position")
-                # 1. Retrieve the absolute latest board state from the database.
-                # Important: Re-fetch the room to get the absolute latest state
-                # especially if multiple clients are making moves
-                session.refresh(room) # Refresh the current `room` object to get latest DB state
-
-                # Input validation based on the CURRENT board from DB
-                if not isinstance(pos, int) or pos < 0 or pos >= len(room.position):
-                    await websocket.send_json({"error": "Invalid position."})
-                    continue
-
-                if room.position[pos] != 0:
-                    await websocket.send_json({"error": "Position already taken."})
-                    continue
-
-                if turn_tracker[game_id] != player_index:
-                    await websocket.send_json({"error": "Not your turn."})
-                    continue
-
-                # 2. Apply the new move to this freshly retrieved board.
-                # IMPORTANT: Create a NEW list to ensure SQLModel detects the change.
-                updated_board = list(room.position) # Make a copy of the *current* board
-                updated_board[pos] = player_index + 1
-                room.position = updated_board # Assign the *new list* back
-
-                # 3. Save the entirely new board state back to the database.
-                try:
-                    session.add(room)
-                    session.commit()
-                    session.refresh(room) # Refresh to ensure `room` object holds latest DB state
-                except Exception as e:
-                    session.rollback()
-                    await websocket.send_json({"error": f"Failed to record move: {e}"})
-                    continue # Do not proceed with broadcasting if save failed
-
-                draw_offered_by[game_id] = None
-
-                winner = check_winner(room.position)
-
-                next_turn_for_broadcast = turn_tracker[game_id]
-                if not winner and not board_full(room.position):
-                    next_turn_for_broadcast = 1 - turn_tracker[game_id]
-
-                turn_tracker[game_id] = next_turn_for_broadcast
-
-                # 4. Broadcast this complete, updated board to all clients.
-                for conn in active_connections[game_id]:
-                    await conn.send_json({
-                        "action": "update",
-                        "board": list(room.position), # <--- Send the fully updated board from DB
-                        "last_move_by": player_index,
-                        "current_turn": turn_tracker[game_id]
-                    })
-
-                if winner:
-                    game_status[game_id] = "win"
-                    for conn in active_connections[game_id]:
-                        await conn.send_json({
-                            "action": "game_over",
-                            "result": f"Player {winner-1} wins!",
-                            "board": list(room.position)
-                        })
-                elif board_full(room.position):
-                    game_status[game_id] = "tie"
-                    for conn in active_connections[game_id]:
-                        await conn.send_json({
-                            "action": "game_over",
-                            "result": "It's a draw!",
-                            "board": list(room.position)
-                        })
-
-            elif action == "offer_draw":
-                if current_game_status != "ongoing":
-                    await websocket.send_json({"error": "Cannot offer draw, game ended."})
-                    continue
-
-                if draw_offered_by[game_id] is not None:
-                    await websocket.send_json({"error": "A draw offer is already pending."})
-                    continue
-
-                draw_offered_by[game_id] = player_index
-                other_player_index = 1 - player_index
-                if len(active_connections[game_id]) > other_player_index:
-                    await active_connections[game_id][other_player_index].send_json({
-                        "action": "draw_offer",
-                        "from_player": player_index
-                    })
-                await websocket.send_json({"message": "Draw offer sent."})
-
-            elif action == "respond_draw":
-                if draw_offered_by[game_id] is None:
-                    await websocket.send_json({"error": "No draw offer to respond to."})
-                    continue
-
-                if player_index == draw_offered_by[game_id]:
-                    await websocket.send_json({"error": "You cannot respond to your own draw offer."})
-                    continue
-
-                accept = data.get("accept", False)
-                if accept:
-                    # 1. Retrieve the absolute latest board state from the database. (Already have `room`)
-                    # 2. Apply the new "move" (reset board) to this freshly retrieved board.
-                    room.position = [0] * len(room.position) # New list assigned
-                    # 3. Save the entirely new board state back to the database.
-                    session.add(room)
-                    session.commit()
-                    session.refresh(room)
-
-                    game_status[game_id] = "draw_agreed"
-                    for conn in active_connections[game_id]:
-                        await conn.send_json({
-                            "action": "game_over",
-                            "result": "draw_agreed",
-                            "board": list(room.position)
-                        })
-                else:
-                    offerer = draw_offered_by[game_id]
-                    if len(active_connections[game_id]) > offerer:
-                        await active_connections[game_id][offerer].send_json({
-                            "action": "draw_declined",
-                            "from_player": player_index
-                        })
-                    await websocket.send_json({"message": "Draw declined."})
-
-                draw_offered_by[game_id] = None
-
-            elif action == "leave_room":
-                other_player_index = 1 - player_index
-                if len(active_connections[game_id]) > other_player_index and active_connections[game_id][other_player_index] != websocket:
-                    await active_connections[game_id][other_player_index].send_json({
-                        "action": "player_left",
-                        "player": player_index,
-                        "message": f"Player {player_index} has left the room. Game ended."
-                    })
-                    game_status[game_id] = "player_left"
-
-                if websocket in active_connections.get(game_id, []):
-                    active_connections[game_id].remove(websocket)
-                await websocket.close(code=1000, reason="Player left room")
-
-                if not active_connections[game_id]:
-                    active_connections.pop(game_id, None)
-                    turn_tracker.pop(game_id, None)
-                    game_status.pop(game_id, None)
-                    draw_offered_by.pop(game_id, None)
+            if result and result.get("left"):
+                left = True
+                await connection.close(code=1000, reason="Player left room")
                 return
 
-            elif action == "play_again":
-                if current_game_status not in ("win", "tie", "draw_agreed", "player_left", "player_disconnected"):
-                    await websocket.send_json({"error": "Game not finished yet."})
-                    continue
-
-                # 1. Retrieve the absolute latest board state from the database. (Already have `room`)
-                # 2. Apply the new "move" (reset board) to this freshly retrieved board.
-                room.position = [0] * len(room.position) # New list assigned
-                # 3. Save the entirely new board state back to the database.
-                session.add(room)
-                session.commit()
-                session.refresh(room)
-
-                game_status[game_id] = "ongoing"
-                turn_tracker[game_id] = 0
-                draw_offered_by[game_id] = None
-
-                # 4. Broadcast this complete, updated board to all clients.
-                for conn in active_connections[game_id]:
-                    await conn.send_json({
-                        "action": "game_restart",
-                        "board": list(room.position),
-                        "message": "Game restarted, Player 0 starts."
-                    })
-
-            else:
-                await websocket.send_json({"error": "Unknown action."})
-
     except WebSocketDisconnect:
-        if websocket in active_connections.get(game_id, []):
-            active_connections[game_id].remove(websocket)
-
-            if len(active_connections[game_id]) > 0:
-                remaining_player_conn = active_connections[game_id][0]
-                await remaining_player_conn.send_json({
-                    "action": "player_left",
-                    "player": player_index,
-                    "message": f"Player {player_index} has disconnected unexpectedly. Game ended."
+        connection.stop()
+
+    except RoomUnavailableError:
+        connection.send_json({"error": ROOM_UNAVAILABLE_ERROR})
+        await connection.close(code=1011, reason="Room unavailable")
+
+    finally:
+        # However the socket ends, it leaves nothing behind: no relay
+        # registration, no writer task and no seat the owner thinks is taken
+        room_relay.unregister(game_id, connection_id)
+        admission_control.close_game_socket()
+        if not connection.closed:
+            connection.abort(code=1011, reason="Internal error")
+        if player_index is not None and not left:
+            try:
+                await room_relay.dispatch(game_id, {
+                    "type": "disconnect",
+                    "connection": connection_id,
+                    "player_index": player_index
                 })
-                game_status[game_id] = "player_disconnected"
-
-            if not active_connections[game_id]:
-                active_connections.pop(game_id, None)
-                turn_tracker.pop(game_id, None)
-                game_status.pop(game_id, None)
-                draw_offered_by.pop(game_id, None)
\ No newline at end of file
+            except RoomUnavailableError:
+                pass  # Whoever claims the room next starts from the last flushed board
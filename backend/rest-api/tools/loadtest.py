@@ -0,0 +1,472 @@
+# tools/loadtest.py
+# Load generator for the lobby and the game rooms. Simulated users go the
+# way the frontend does: register, log in, look at the lobby, create or join
+# a room (or, with --quick-play, wait in the matchmaking queue), then play
+# whole games over the game WebSocket against each other.
+# Every HTTP request and every WebSocket round trip is timed; the report has
+# throughput and p50/p95/p99 latency per endpoint and per socket action, and
+# can be saved as a baseline and compared against later runs.
+#
+#   python tools/loadtest.py --spawn --users 40 --games 3
+#   python tools/loadtest.py --spawn --users 40 --games 3 --quick-play
+#   python tools/loadtest.py --url http://127.0.0.1:8000 --compare tools/loadtest_baseline.json
+#
+# --spawn starts uvicorn on a free port with the current environment
+# (POSTGRESQL_DATABASE_URL etc.), so the run is self-contained. Needs httpx
+# and websockets, which uvicorn[standard] / fastapi[all] already bring.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+import websockets
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from business.frame_protocol_operations import BINARY_SUBPROTOCOL, FrameDecoder
+
+LOADTEST_GAME_NAME = os.getenv("LOADTEST_GAME_NAME", "Tic Tac Toe")
+# Seconds a single request or socket frame may take before it counts as an error
+LOADTEST_TIMEOUT_SECONDS = float(os.getenv("LOADTEST_TIMEOUT_SECONDS", "10"))
+# A p95 may grow this much over the baseline (fraction) before it's a regression...
+LOADTEST_TOLERANCE = float(os.getenv("LOADTEST_TOLERANCE", "0.25"))
+# ...and by at least this many milliseconds, so sub-millisecond noise never is
+LOADTEST_NOISE_FLOOR_MS = float(os.getenv("LOADTEST_NOISE_FLOOR_MS", "5"))
+
+# Moves by turn (player 0 first); games alternate between a win and a draw
+GAME_SCRIPTS = [
+    [0, 3, 1, 4, 2],
+    [0, 1, 2, 4, 3, 5, 7, 6, 8],
+]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    # Nearest rank
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def add(self, name: str, started: float, ok: bool = True):
+        if ok:
+            self.latencies[name].append((time.perf_counter() - started) * 1000)
+        else:
+            self.errors[name] += 1
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def summary(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        operations = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(name, []))
+            operations[name] = {
+                "count": len(values),
+                "errors": self.errors.get(name, 0),
+                "per_second": round(len(values) / elapsed, 2) if elapsed else 0.0,
+                "p50_ms": round(percentile(values, 0.50), 3),
+                "p95_ms": round(percentile(values, 0.95), 3),
+                "p99_ms": round(percentile(values, 0.99), 3),
+                "max_ms": round(values[-1], 3) if values else 0.0,
+            }
+        total = sum(operation["count"] for operation in operations.values())
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "operations_total": total,
+            "operations_per_second": round(total / elapsed, 2) if elapsed else 0.0,
+            "errors_total": sum(self.errors.values()),
+            "operations": operations,
+        }
+
+
+class LoadtestError(Exception):
+    pass
+
+
+# --- One simulated user ---
+
+class SimulatedUser:
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, ws_url: str, binary: bool = False):
+        self.client = client
+        self.recorder = recorder
+        self.ws_url = ws_url
+        # Binary subprotocol: frames go through a decoder that tracks the board
+        self.decoder = FrameDecoder() if binary else None
+        self.username = "load_" + uuid.uuid4().hex[:12]
+        self.headers: Dict[str, str] = {}
+        self.socket = None
+
+    async def request(self, method: str, route: str, url: str, **kwargs) -> httpx.Response:
+        # route is the endpoint's path template, so all rooms report as one endpoint
+        name = f"{method} {route}"
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=self.headers, **kwargs)
+        except httpx.HTTPError as e:
+            self.recorder.add(name, started, ok=False)
+            raise LoadtestError(f"{name}: {e!r}")
+        self.recorder.add(name, started, ok=response.is_success)
+        if not response.is_success:
+            raise LoadtestError(f"{name}: {response.status_code} {response.text[:200]}")
+        return response
+
+    async def sign_up(self):
+        await self.request("POST", "/register", "/register", json={"username": self.username, "password": "loadtest"})
+        token = (await self.request(
+            "POST", "/login", "/login", data={"username": self.username, "password": "loadtest"}
+        )).json()["access_token"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    async def browse_lobby(self):
+        await self.request("GET", "/available_games", "/available_games")
+        await self.request("GET", "/available_rooms/{game_name}", f"/available_rooms/{LOADTEST_GAME_NAME}")
+        await self.request("POST", "/heartbeat", "/heartbeat")
+
+    async def create_room(self) -> int:
+        room = (await self.request(
+            "POST", "/create_room/{game_name}", f"/create_room/{LOADTEST_GAME_NAME}", json={}
+        )).json()
+        return room["id"]
+
+    async def quick_play(self) -> int:
+        # Wait in the matchmaking queue until the server seats us in a room
+        started = time.perf_counter()
+        token = self.headers["Authorization"].split()[1]
+        try:
+            async with websockets.connect(
+                f"{self.ws_url}/ws/matchmaking/{quote(LOADTEST_GAME_NAME)}?token={token}",
+                open_timeout=LOADTEST_TIMEOUT_SECONDS,
+            ) as queue:
+                frame = {}
+                while frame.get("action") != "matched":
+                    frame = json.loads(await asyncio.wait_for(queue.recv(), LOADTEST_TIMEOUT_SECONDS))
+                    if frame.get("action") not in ("queued", "matched"):
+                        raise LoadtestError(f"WS matchmaking: {frame}")
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException, LoadtestError) as e:
+            self.recorder.add("WS matchmaking", started, ok=False)
+            raise LoadtestError(f"WS matchmaking: {e!r}")
+        self.recorder.add("WS matchmaking", started)
+        return frame["room_id"]
+
+    async def join_room(self, room_id: int):
+        await self.request("POST", "/join_room/{room_id}", f"/join_room/{room_id}", json={})
+        await self.request("GET", "/user_count/{room_id}", f"/user_count/{room_id}")
+
+    async def leave_room(self):
+        await self.request("POST", "/leave_room", "/leave_room")
+
+    # --- Game socket ---
+
+    async def receive(self, name: str, started: float, match) -> dict:
+        # Read frames until one satisfies match; the wait is the action's latency
+        while True:
+            try:
+                raw = await asyncio.wait_for(self.socket.recv(), LOADTEST_TIMEOUT_SECONDS)
+            except (asyncio.TimeoutError, websockets.ConnectionClosed) as e:
+                self.recorder.add(name, started, ok=False)
+                raise LoadtestError(f"{name}: {e!r}")
+            if self.decoder is None:
+                frame = json.loads(raw)
+            else:
+                frame = self.decoder.decode(raw)
+                if frame is None:
+                    self.recorder.errors["WS resync"] += 1
+                    await self.socket.send(json.dumps({"action": "resync"}))
+                    continue
+            if "error" in frame:
+                self.recorder.add(name, started, ok=False)
+                raise LoadtestError(f"{name}: {frame['error']}")
+            if match(frame):
+                self.recorder.add(name, started)
+                return frame
+
+    async def connect(self, room_id: int) -> int:
+        started = time.perf_counter()
+        try:
+            self.socket = await websockets.connect(
+                f"{self.ws_url}/ws/game/{room_id}",
+                open_timeout=LOADTEST_TIMEOUT_SECONDS,
+                subprotocols=[BINARY_SUBPROTOCOL] if self.decoder is not None else None,
+            )
+        except (OSError, asyncio.TimeoutError, websockets.InvalidHandshake) as e:
+            self.recorder.add("WS connect", started, ok=False)
+            raise LoadtestError(f"WS connect: {e!r}")
+        frame = await self.receive("WS connect", started, lambda f: f.get("action") == "initial_state")
+        return frame["player_index"]
+
+    async def send(self, payload: dict) -> float:
+        started = time.perf_counter()
+        await self.socket.send(json.dumps(payload))
+        return started
+
+    async def disconnect(self):
+        if self.socket is not None:
+            await self.socket.close()
+            self.socket = None
+
+
+async def play_game(players: List[SimulatedUser], script: List[int]):
+    # Each move is timed from send until the mover sees its own update;
+    # the opponent's wait for the same frame is the broadcast latency
+    for turn, position in enumerate(script):
+        mover, other = players[turn % 2], players[1 - turn % 2]
+        started = await mover.send({"action": "make_move", "position": position})
+        is_move = lambda frame: frame.get("action") == "update" and frame.get("last_move_by") == turn % 2
+        await mover.receive("WS make_move", started, is_move)
+        await other.receive("WS broadcast", started, is_move)
+    for player in players:
+        await player.receive("WS game_over", time.perf_counter(), lambda frame: frame.get("action") == "game_over")
+
+
+async def play_room(players: List[SimulatedUser], room_id: int, game: int):
+    # Both players are seated in room_id: play a game and a rematch, then leave
+    by_index = {await user.connect(room_id): user for user in players}
+    seated = [by_index[0], by_index[1]]
+    for user in seated:
+        await user.receive("WS game_ready", time.perf_counter(), lambda frame: frame.get("action") == "game_ready")
+    await play_game(seated, GAME_SCRIPTS[game % len(GAME_SCRIPTS)])
+
+    # One rematch in the same room, then everybody leaves
+    started = await seated[0].send({"action": "play_again"})
+    await seated[0].receive("WS play_again", started, lambda frame: frame.get("action") == "game_restart")
+    await seated[1].receive("WS broadcast", started, lambda frame: frame.get("action") == "game_restart")
+    for user in seated:
+        await user.send({"action": "leave_room"})
+        await user.disconnect()
+    for user in players:
+        await user.leave_room()
+
+
+async def play_session(client: httpx.AsyncClient, recorder: Recorder, ws_url: str, games: int, binary: bool):
+    # Two users: the host creates the room, the guest finds it and joins
+    host = SimulatedUser(client, recorder, ws_url, binary)
+    guest = SimulatedUser(client, recorder, ws_url, binary)
+    players = [host, guest]
+    try:
+        for user in players:
+            await user.sign_up()
+            await user.browse_lobby()
+        for game in range(games):
+            room_id = await host.create_room()
+            await host.join_room(room_id)
+            await guest.join_room(room_id)
+            await play_room(players, room_id, game)
+    except LoadtestError as e:
+        recorder.errors["session"] += 1
+        print(f"Session of {host.username} aborted: {e}")
+    finally:
+        for user in players:
+            await user.disconnect()
+
+
+async def play_quick(
+    client: httpx.AsyncClient,
+    recorder: Recorder,
+    ws_url: str,
+    games: int,
+    binary: bool,
+    meetups: Dict[int, Tuple[SimulatedUser, asyncio.Future]],
+):
+    # One user on quick play: no lobby, no room list, the server picks the
+    # opponent. Whoever of a matched pair gets here first waits; the second
+    # one plays the room for both of them.
+    user = SimulatedUser(client, recorder, ws_url, binary)
+    try:
+        await user.sign_up()
+        await user.request("POST", "/heartbeat", "/heartbeat")
+        for game in range(games):
+            room_id = await user.quick_play()
+            if room_id not in meetups:
+                done = asyncio.get_running_loop().create_future()
+                meetups[room_id] = (user, done)
+                await done
+                continue
+            opponent, done = meetups.pop(room_id)
+            try:
+                await play_room([opponent, user], room_id, game)
+            except LoadtestError as e:
+                done.set_exception(e)
+                raise
+            done.set_result(None)
+    except LoadtestError as e:
+        recorder.errors["session"] += 1
+        print(f"Session of {user.username} aborted: {e}")
+    finally:
+        await user.disconnect()
+
+
+async def run_load(
+    base_url: str, users: int, games: int, ramp_seconds: float, binary: bool = False, quick_play: bool = False
+) -> dict:
+    ws_url = "ws" + base_url[len("http"):]
+    recorder = Recorder()
+    sessions = max(1, users // 2)
+    meetups: Dict[int, Tuple[SimulatedUser, asyncio.Future]] = {}
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(base_url=base_url, timeout=LOADTEST_TIMEOUT_SECONDS, limits=limits) as client:
+        async def delayed(index: int):
+            # Spread the starts over the ramp so the server isn't hit by one wall of logins
+            await asyncio.sleep(ramp_seconds * index / sessions)
+            if quick_play:
+                await asyncio.gather(*(play_quick(client, recorder, ws_url, games, binary, meetups) for _ in range(2)))
+            else:
+                await play_session(client, recorder, ws_url, games, binary)
+        await asyncio.gather(*(delayed(index) for index in range(sessions)))
+    recorder.stop()
+    return recorder.summary()
+
+
+# --- Server ---
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def spawn_server(workers: int) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        # Own process group, so stop_server also takes down the worker pools it started
+        start_new_session=True,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"Server exited during startup with code {server.returncode}.")
+        try:
+            if httpx.get(f"{base_url}/metrics", timeout=1).is_success:
+                return server, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    stop_server(server)
+    raise SystemExit("Server did not come up within 60 seconds.")
+
+
+def stop_server(server: subprocess.Popen):
+    os.killpg(server.pid, signal.SIGTERM)
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        pass
+    # Whatever outlived the server (e.g. process pool workers) goes too
+    try:
+        os.killpg(server.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+# --- Report and baseline ---
+
+def print_report(summary: dict):
+    print(f"\n{summary['operations_total']} operations in {summary['elapsed_seconds']}s "
+          f"({summary['operations_per_second']}/s), {summary['errors_total']} errors")
+    print(f"{'operation':<34}{'count':>7}{'errors':>7}{'/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, operation in summary["operations"].items():
+        print(f"{name:<34}{operation['count']:>7}{operation['errors']:>7}{operation['per_second']:>9}"
+              f"{operation['p50_ms']:>10}{operation['p95_ms']:>10}{operation['p99_ms']:>10}{operation['max_ms']:>10}")
+
+
+def compare_with_baseline(summary: dict, baseline: dict) -> List[str]:
+    regressions = []
+    for name, before in baseline["operations"].items():
+        after = summary["operations"].get(name)
+        if after is None or not after["count"]:
+            regressions.append(f"{name}: missing from this run")
+            continue
+        grown = after["p95_ms"] - before["p95_ms"]
+        if grown > LOADTEST_NOISE_FLOOR_MS and after["p95_ms"] > before["p95_ms"] * (1 + LOADTEST_TOLERANCE):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {after['p95_ms']}ms")
+        if after["errors"] > before["errors"]:
+            regressions.append(f"{name}: errors {before['errors']} -> {after['errors']}")
+    if summary["operations_per_second"] < baseline["operations_per_second"] * (1 - LOADTEST_TOLERANCE):
+        regressions.append(
+            f"throughput: {baseline['operations_per_second']}/s -> {summary['operations_per_second']}/s"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive simulated users through the lobby and game rooms.")
+    parser.add_argument("--url", default=os.getenv("LOADTEST_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--spawn", action="store_true", help="start a uvicorn server for the run")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers with --spawn")
+    parser.add_argument("--users", type=int, default=20, help="simulated users, paired up into games")
+    parser.add_argument("--games", type=int, default=3, help="games each pair plays")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which sessions start")
+    parser.add_argument("--protocol", choices=["json", "binary"], default="json", help="game socket protocol")
+    parser.add_argument("--quick-play", action="store_true", help="find opponents through the matchmaking queue")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH", help="exit 1 if this run regressed against the baseline")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url.rstrip("/")
+    if args.spawn:
+        server, base_url = spawn_server(args.workers)
+    try:
+        summary = asyncio.run(run_load(
+            base_url, args.users, args.games, args.ramp, args.protocol == "binary", args.quick_play
+        ))
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    print_report(summary)
+    summary["settings"] = {
+        "users": args.users,
+        "games": args.games,
+        "ramp_seconds": args.ramp,
+        "protocol": args.protocol,
+        "quick_play": args.quick_play,
+        "workers": args.workers if args.spawn else None,
+        "python": platform.python_version(),
+    }
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(summary, baseline_file, indent=2)
+            baseline_file.write("\n")
+        print(f"Baseline saved to {args.save_baseline}.")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("settings", {}).get("users") != args.users or baseline.get("settings", {}).get("games") != args.games:
+            print("Warning: the baseline was recorded with different --users/--games; numbers may not compare.")
+        regressions = compare_with_baseline(summary, baseline)
+        if regressions:
+            print("Regressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
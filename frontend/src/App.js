@@ -1,4 +1,4 @@
-import React from "react";
+import React, { useEffect } from "react";
 import {
   BrowserRouter as Router,
   Route,
@@ -10,7 +10,30 @@ import Login from "./components/Login";
 import Lobby from "./components/Lobby";
 import TicTacToe from "./components/Games/tictactoe";
 
+const BACKEND_URL = process.env.REACT_APP_API_URL;
+// Keep in step with PRESENCE_HEARTBEAT_SECONDS on the backend: users who miss
+// a few heartbeats (closed tab, lost connection) are taken out of their room.
+const HEARTBEAT_INTERVAL_MS = 30000;
+
+function useHeartbeat() {
+  useEffect(() => {
+    const beat = () => {
+      const token = localStorage.getItem("authToken");
+      if (!token) return;
+      fetch(`${BACKEND_URL}/heartbeat`, {
+        method: "POST",
+        headers: { Authorization: `Bearer ${token}` },
+      }).catch(() => {}); // Next beat will try again
+    };
+    beat();
+    const interval = setInterval(beat, HEARTBEAT_INTERVAL_MS);
+    return () => clearInterval(interval);
+  }, []);
+}
+
 function App() {
+  useHeartbeat();
+
   const isLoggedIn = () => {
     return !!localStorage.getItem("authToken");
   };
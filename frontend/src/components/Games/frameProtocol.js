@@ -0,0 +1,90 @@
+// Decoder for the binary game socket subprotocol (see
+// backend/rest-api/business/frame_protocol_operations.py). It keeps the
+// board the server last sent, applies move deltas to it, and hands back the
+// same payloads the JSON protocol would have sent.
+
+export const BINARY_SUBPROTOCOL = "tictactoe.binary.v1";
+
+const FRAME_SNAPSHOT = 1;
+const FRAME_DELTA = 2;
+const FRAME_GAME_OVER = 3;
+
+const SNAPSHOT_ACTIONS = ["initial_state", "game_ready", "game_restart", "board_sync", "update"];
+const STATUSES = ["ongoing", "win", "tie", "draw_agreed", "player_left", "player_disconnected"];
+const GAME_RESULTS = ["Player 0 wins!", "Player 1 wins!", "It's a draw!", "draw_agreed"];
+const SNAPSHOT_HEADER_SIZE = 15;
+
+export function createFrameDecoder() {
+  let board = null;
+  let version = null;
+
+  // Returns the payload, or null when a delta doesn't follow the board we hold (resync needed)
+  return function decode(data) {
+    if (typeof data === "string") {
+      const payload = JSON.parse(data);
+      const fullBoard = payload.board || payload.current_board;
+      if (fullBoard && payload.version !== undefined) {
+        board = [...fullBoard];
+        version = payload.version;
+      }
+      return payload;
+    }
+
+    const view = new DataView(data);
+    const type = view.getUint8(0);
+
+    // The room's event number; 0 on frames meant for this player only
+    const withSeq = (payload, seq) => (seq ? { ...payload, seq } : payload);
+
+    if (type === FRAME_DELTA) {
+      const frameVersion = view.getUint32(5);
+      if (board === null || frameVersion !== version + 1) return null;
+      const cell = view.getUint16(9);
+      const mark = view.getUint8(11);
+      board[cell] = mark;
+      version = frameVersion;
+      return withSeq({
+        action: "update",
+        board: [...board],
+        last_move_by: mark - 1,
+        current_turn: view.getUint8(12),
+        version,
+      }, view.getUint32(1));
+    }
+
+    if (type === FRAME_GAME_OVER) {
+      return withSeq({
+        action: "game_over",
+        result: GAME_RESULTS[view.getUint8(9)],
+        board: board ? [...board] : undefined,
+        version: view.getUint32(5),
+      }, view.getUint32(1));
+    }
+
+    if (type !== FRAME_SNAPSHOT) return null;
+    const action = SNAPSHOT_ACTIONS[view.getUint8(1)];
+    const seq = view.getUint32(2);
+    const turn = view.getInt8(10);
+    const playerIndex = view.getInt8(12);
+    const cells = view.getUint16(13);
+    version = view.getUint32(6);
+    board = [];
+    for (let index = 0; index < cells; index++) {
+      const packed = view.getUint8(SNAPSHOT_HEADER_SIZE + Math.floor(index / 4));
+      board.push((packed >> (2 * (index % 4))) & 3);
+    }
+    const payload = {
+      action,
+      board: [...board],
+      current_board: [...board],
+      turn,
+      current_turn: turn,
+      status: STATUSES[view.getUint8(11)],
+      version,
+    };
+    if (playerIndex >= 0) payload.player_index = playerIndex;
+    if (action === "game_ready") payload.message = "Both players connected. Game can start!";
+    if (action === "board_sync") payload.message = "Board synchronized with the server.";
+    return withSeq(payload, seq);
+  };
+}
@@ -1,5 +1,6 @@
 import React, { useEffect, useState, useRef, useCallback } from "react";
 import { useParams, useNavigate } from "react-router-dom";
+import { BINARY_SUBPROTOCOL, createFrameDecoder } from "./frameProtocol";
 
 const BACKEND_URL = process.env.REACT_APP_API_URL;
 
@@ -7,6 +8,13 @@ export default function TicTacToe() {
   const { roomId } = useParams();
   const navigate = useNavigate();
   const ws = useRef(null);
+  // Board version from the server; moves carry it so a stale board gets a conflict
+  const boardVersion = useRef(null);
+  // From the server's "session" frame: lets a dropped socket take its seat back
+  const resumeToken = useRef(null);
+  const resumeGraceMs = useRef(0);
+  // Last room event seen; a resumed socket is sent everything after it
+  const lastSeq = useRef(null);
 
   const [board, setBoard] = useState(Array(9).fill(0));
   const [message, setMessage] = useState("Connecting to game...");
@@ -43,7 +51,11 @@ export default function TicTacToe() {
             // You might need an Authorization header here if your POST endpoint is secured
             // "Authorization": `Bearer ${token}` // Uncomment if your POST endpoint requires auth
           },
-          body: JSON.stringify({ position, player_index: playerIndex }),
+          body: JSON.stringify({
+            position,
+            player_index: playerIndex,
+            version: boardVersion.current,
+          }),
         });
 
         if (!response.ok) {
@@ -78,141 +90,206 @@ export default function TicTacToe() {
       return;
     }
 
-    const wsUrl = `${BACKEND_URL.replace(/^http/, "ws")}/ws/game/${roomId}`;
-
-    ws.current = new WebSocket(wsUrl);
-
-    ws.current.onopen = () => {
-      console.log("WebSocket connection opened.");
-      setMessage("Connected to game room. Waiting for opponent...");
-    };
-
-    ws.current.onmessage = (event) => {
-      const data = JSON.parse(event.data);
-      console.log("Received data from WebSocket:", data); // Increased verbosity for debugging
-
-      if (data.error) {
-        setMessage(`Error: ${data.error}`);
-        if (
-          data.error === "Room full." ||
-          data.error === "Invalid room ID." ||
-          data.error === "Game configuration not found for this room."
-        ) {
-          setGameResult("error");
-          if (ws.current && ws.current.readyState === WebSocket.OPEN) {
-            ws.current.close(1008, data.error);
-          }
+    let leaving = false;
+    let reconnectTimer = null;
+    let reconnectAttempts = 0;
+    let giveUpAt = null;
+
+    const connect = () => {
+      // ?opponent=bot&difficulty=... from the lobby: the server plays the other seat.
+      // After a dropped connection, ?resume=<token>&after=<seq> takes the seat back.
+      const params = new URLSearchParams(window.location.search);
+      if (resumeToken.current) {
+        params.set("resume", resumeToken.current);
+        if (lastSeq.current !== null) params.set("after", lastSeq.current);
+      }
+      const query = params.toString();
+      const wsUrl = `${BACKEND_URL.replace(/^http/, "ws")}/ws/game/${roomId}${query ? `?${query}` : ""}`;
+
+      // Compact binary frames with move deltas; the decoder turns them back
+      // into the JSON payloads handled below (text frames pass straight through)
+      ws.current = new WebSocket(wsUrl, [BINARY_SUBPROTOCOL]);
+      ws.current.binaryType = "arraybuffer";
+      const decodeFrame = createFrameDecoder();
+
+      ws.current.onopen = () => {
+        console.log("WebSocket connection opened.");
+        if (!resumeToken.current) {
+          setMessage("Connected to game room. Waiting for opponent...");
         }
-      } else if (data.action === "initial_state") {
-        setPlayerIndex(data.player_index);
-        setBoard([...data.board]); // CRITICAL: Create new array for state update
-        setTurn(data.turn);
-        setGameResult(null);
-        setWinner(null);
-        setMessage(
-          `You are Player ${
-            data.player_index === 0 ? "X (Player 0)" : "O (Player 1)"
-          }. Player ${getSymbol(data.turn, true)}'s turn.`
-        );
-      } else if (data.action === "game_ready") {
-        setMessage(data.message);
-        if (data.current_board) setBoard([...data.current_board]); // CRITICAL: Create new array for state update
-        if (data.current_turn !== undefined) setTurn(data.current_turn);
-        setGameResult(null);
-        setWinner(null);
-        setMessage(
-          `Both players connected. Game can start! Player ${getSymbol(
-            data.current_turn,
-            true
-          )}'s turn.`
-        );
-      } else if (data.action === "update") {
-        if (data.board) {
-          console.log("Updating board with:", data.board); // Debugging: See the incoming board
+      };
+
+      ws.current.onmessage = (event) => {
+        const data = decodeFrame(event.data);
+        if (data === null) {
+          // Missed a move: ask for the whole board again
+          sendWsMessage("resync");
+          return;
+        }
+        console.log("Received data from WebSocket:", data); // Increased verbosity for debugging
+        if (data.version !== undefined) boardVersion.current = data.version;
+        if (data.seq !== undefined) lastSeq.current = data.seq;
+
+        if (data.error) {
+          setMessage(`Error: ${data.error}`);
+          if (data.board) {
+            // Version conflict: show the current board so the move can be retried
+            setBoard([...data.board]);
+            if (data.turn !== undefined) setTurn(data.turn);
+          }
+          if (
+            data.error === "Room full." ||
+            data.error === "Invalid room ID." ||
+            data.error === "Game configuration not found for this room."
+          ) {
+            setGameResult("error");
+            if (ws.current && ws.current.readyState === WebSocket.OPEN) {
+              ws.current.close(1008, data.error);
+            }
+          }
+        } else if (data.action === "session") {
+          resumeToken.current = data.resume_token;
+          resumeGraceMs.current = data.resume_grace_seconds * 1000;
+          reconnectAttempts = 0;
+          giveUpAt = null;
+          setPlayerIndex(data.player_index);
+        } else if (data.action === "player_away" || data.action === "player_back") {
+          setMessage(data.message);
+        } else if (data.action === "initial_state") {
+          setPlayerIndex(data.player_index);
           setBoard([...data.board]); // CRITICAL: Create new array for state update
+          setTurn(data.turn);
+          setGameResult(null);
+          setWinner(null);
+          setMessage(
+            `You are Player ${
+              data.player_index === 0 ? "X (Player 0)" : "O (Player 1)"
+            }. Player ${getSymbol(data.turn, true)}'s turn.`
+          );
+        } else if (data.action === "game_ready") {
+          setMessage(data.message);
+          if (data.current_board) setBoard([...data.current_board]); // CRITICAL: Create new array for state update
+          if (data.current_turn !== undefined) setTurn(data.current_turn);
+          setGameResult(null);
+          setWinner(null);
+          setMessage(
+            `Both players connected. Game can start! Player ${getSymbol(
+              data.current_turn,
+              true
+            )}'s turn.`
+          );
+        } else if (data.action === "update") {
+          if (data.board) {
+            console.log("Updating board with:", data.board); // Debugging: See the incoming board
+            setBoard([...data.board]); // CRITICAL: Create new array for state update
+          }
+          if (data.current_turn !== undefined) {
+            setTurn(data.current_turn);
+            setMessage(`Player ${getSymbol(data.current_turn, true)}'s turn.`);
+          }
+          setGameResult(null);
+          setWinner(null);
+          setShowDrawOfferDialog(false);
+          setDrawOfferer(null);
+        } else if (data.action === "game_over") {
+          if (data.board) setBoard([...data.board]); // CRITICAL: Create new array for state update
+          setGameResult(data.result);
+          if (data.result && data.result.includes("wins!")) {
+            // More robust check for win message
+            const winnerPlayerNum = parseInt(data.result.match(/\d+/)[0]); // Extract player number from message
+            setWinner(winnerPlayerNum); // Set winner as player number (0 or 1)
+            setMessage(
+              `Game Over! Player ${getSymbol(winnerPlayerNum, true)} wins!`
+            );
+          } else if (
+            data.result === "tie" ||
+            data.result === "draw_agreed" ||
+            data.result.includes("draw!")
+          ) {
+            setMessage("Game Over! It's a tie!");
+          }
+          setShowDrawOfferDialog(false);
+          setDrawOfferer(null);
+        } else if (data.action === "player_left") {
+          setMessage(
+            `Player ${getSymbol(
+              data.player,
+              true
+            )} has left the room. Game ended.`
+          );
+          setGameResult("player_left");
+        } else if (data.action === "draw_offer") {
+          setDrawOfferer(data.from_player);
+          setShowDrawOfferDialog(true);
+          setMessage(
+            `Player ${getSymbol(data.from_player, true)} has offered a draw.`
+          );
+        } else if (data.action === "draw_declined") {
+          setMessage(
+            `Player ${getSymbol(data.from_player, true)} declined the draw offer.`
+          );
+          setShowDrawOfferDialog(false);
+          setDrawOfferer(null);
+        } else if (data.action === "board_sync") {
+          setBoard([...data.board]);
+          setTurn(data.turn);
+          setMessage(data.message);
+        } else if (data.action === "game_restart") {
+          setBoard([...data.board]); // CRITICAL: Create new array for state update
+          setTurn(0);
+          setGameResult(null);
+          setWinner(null);
+          setShowDrawOfferDialog(false);
+          setDrawOfferer(null);
+          setMessage("Game restarted! Player X's turn.");
         }
-        if (data.current_turn !== undefined) {
-          setTurn(data.current_turn);
-          setMessage(`Player ${getSymbol(data.current_turn, true)}'s turn.`);
+      };
+
+      ws.current.onclose = (event) => {
+        console.log("WebSocket connection closed:", event);
+        if (leaving) return;
+        // 1008 is final (room full, bad token...) except when the server dropped
+        // us for falling behind: that's a lost connection like any other
+        const slowClient = event.code === 1008 && event.reason === "Client too slow";
+        const unexpected = (event.code !== 1000 && event.code !== 1008) || slowClient;
+        if (unexpected && resumeToken.current && resumeGraceMs.current > 0) {
+          // The server holds our seat for a while: keep trying until it gives it up
+          if (giveUpAt === null) giveUpAt = Date.now() + resumeGraceMs.current;
+          if (Date.now() < giveUpAt) {
+            const delay = Math.min(5000, 500 * 2 ** reconnectAttempts);
+            reconnectAttempts += 1;
+            setMessage("Connection lost. Reconnecting...");
+            reconnectTimer = setTimeout(connect, delay);
+            return;
+          }
         }
-        setGameResult(null);
-        setWinner(null);
-        setShowDrawOfferDialog(false);
-        setDrawOfferer(null);
-      } else if (data.action === "game_over") {
-        if (data.board) setBoard([...data.board]); // CRITICAL: Create new array for state update
-        setGameResult(data.result);
-        if (data.result && data.result.includes("wins!")) {
-          // More robust check for win message
-          const winnerPlayerNum = parseInt(data.result.match(/\d+/)[0]); // Extract player number from message
-          setWinner(winnerPlayerNum); // Set winner as player number (0 or 1)
+        if (event.code === 1000) {
+          setMessage("Disconnected cleanly from game.");
+        } else if (event.code === 1008) {
+          setMessage(`Error: ${event.reason}. Please return to lobby.`);
+        } else {
           setMessage(
-            `Game Over! Player ${getSymbol(winnerPlayerNum, true)} wins!`
+            `Disconnected from game. Code: ${event.code}. Reason: ${
+              event.reason || "Unknown"
+            }. Please return to lobby.`
           );
-        } else if (
-          data.result === "tie" ||
-          data.result === "draw_agreed" ||
-          data.result.includes("draw!")
-        ) {
-          setMessage("Game Over! It's a tie!");
         }
-        setShowDrawOfferDialog(false);
-        setDrawOfferer(null);
-      } else if (data.action === "player_left") {
-        setMessage(
-          `Player ${getSymbol(
-            data.player,
-            true
-          )} has left the room. Game ended.`
-        );
-        setGameResult("player_left");
-      } else if (data.action === "draw_offer") {
-        setDrawOfferer(data.from_player);
-        setShowDrawOfferDialog(true);
-        setMessage(
-          `Player ${getSymbol(data.from_player, true)} has offered a draw.`
-        );
-      } else if (data.action === "draw_declined") {
-        setMessage(
-          `Player ${getSymbol(data.from_player, true)} declined the draw offer.`
-        );
-        setShowDrawOfferDialog(false);
-        setDrawOfferer(null);
-      } else if (data.action === "game_restart") {
-        setBoard([...data.board]); // CRITICAL: Create new array for state update
-        setTurn(0);
-        setGameResult(null);
-        setWinner(null);
-        setShowDrawOfferDialog(false);
-        setDrawOfferer(null);
-        setMessage("Game restarted! Player X's turn.");
-      }
-    };
+        setGameResult("disconnected");
+      };
 
-    ws.current.onclose = (event) => {
-      console.log("WebSocket connection closed:", event);
-      if (event.code === 1000) {
-        setMessage("Disconnected cleanly from game.");
-      } else if (event.code === 1008) {
-        setMessage(`Error: ${event.reason}. Please return to lobby.`);
-      } else {
+      ws.current.onerror = (error) => {
+        console.error("WebSocket error:", error);
         setMessage(
-          `Disconnected from game. Code: ${event.code}. Reason: ${
-            event.reason || "Unknown"
-          }. Please return to lobby.`
+          "WebSocket error. Attempting to reconnect or return to lobby."
         );
-      }
-      setGameResult("disconnected");
+      };
     };
 
-    ws.current.onerror = (error) => {
-      console.error("WebSocket error:", error);
-      setMessage(
-        "WebSocket error. Attempting to reconnect or return to lobby."
-      );
-    };
+    connect();
 
     return () => {
+      leaving = true;
+      clearTimeout(reconnectTimer);
       if (ws.current) {
         if (ws.current.readyState === WebSocket.OPEN) {
           sendWsMessage("leave_room");
@@ -253,14 +330,13 @@ export default function TicTacToe() {
       return;
     }
 
-    sendWsMessage("make_move", { position: index });
-
-    // 2. Also send an HTTP POST request to explicitly update the DB (as requested)
-    //    Note: The backend's WebSocket logic *already* saves to DB.
-    //    This HTTP POST is redundant for core game logic but serves
-    //    your request to ensure the POST router is called.
-    //    If you use this, consider if you still need the DB save in the WS handler.
-    sendHttpPostMove(index, playerIndex);
+    // One copy of the move: over the socket, or over HTTP while the socket is
+    // down (e.g. reconnecting). The version makes a retried move harmless.
+    if (ws.current && ws.current.readyState === WebSocket.OPEN) {
+      sendWsMessage("make_move", { position: index, version: boardVersion.current });
+    } else {
+      sendHttpPostMove(index, playerIndex);
+    }
   };
 
   const handleLeaveRoom = () => {
@@ -1,5 +1,5 @@
 // Lobby.jsx
-import React, { useState, useEffect, useCallback } from "react";
+import React, { useState, useEffect, useCallback, useRef } from "react";
 import { useNavigate } from "react-router-dom";
 
 const BACKEND_URL = process.env.REACT_APP_API_URL;
@@ -113,6 +113,34 @@ const dialogContentStyle = {
 };
 // --- End Styles Definitions ---
 
+// Applies one lobby feed message to the current room list
+function applyLobbyEvent(rooms, event) {
+  switch (event.action) {
+    case "snapshot":
+      return event.rooms;
+    case "page": {
+      // The next rooms in id order; diffs may already have brought some of them
+      const ids = new Set(event.rooms.map((room) => room.id));
+      return [...rooms.filter((room) => !ids.has(room.id)), ...event.rooms].sort(
+        (a, b) => a.id - b.id
+      );
+    }
+    case "room_created":
+    case "room_freed":
+      return [...rooms.filter((room) => room.id !== event.room.id), event.room].sort(
+        (a, b) => a.id - b.id
+      );
+    case "room_updated":
+      return rooms.map((room) => (room.id === event.room.id ? event.room : room));
+    case "room_filled":
+      return rooms.filter((room) => room.id !== event.room.id);
+    case "room_deleted":
+      return rooms.filter((room) => room.id !== event.room_id);
+    default:
+      return rooms;
+  }
+}
+
 export default function Lobby() {
   const [games, setGames] = useState([]);
   const [rooms, setRooms] = useState([]);
@@ -124,6 +152,12 @@ export default function Lobby() {
   const [confirmForceJoin, setConfirmForceJoin] = useState(false);
   const [pendingForceJoinRoomId, setPendingForceJoinRoomId] = useState(null);
   const [pendingForceJoinPassword, setPendingForceJoinPassword] = useState("");
+  const [botDifficulty, setBotDifficulty] = useState("hard");
+  const [searching, setSearching] = useState(false);
+  const matchmakingSocket = useRef(null);
+  // Cursor of the next page of rooms (null: the list is complete)
+  const [nextCursor, setNextCursor] = useState(null);
+  const lobbySocket = useRef(null);
 
   const navigate = useNavigate();
   const token = localStorage.getItem("authToken");
@@ -168,49 +202,114 @@ export default function Lobby() {
     }
   }, [token, navigate]);
 
-  const fetchAvailableRooms = useCallback(
-    async (gameName) => {
-      if (!token) return;
-      try {
-        const response = await fetch(
-          `${BACKEND_URL}/available_rooms/${gameName}`,
-          {
-            headers: {
-              Authorization: `Bearer ${token}`,
-            },
-          }
-        );
-        if (!response.ok) {
-          throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        const data = await response.json();
-        setRooms(data);
-      } catch (error) {
-        console.error(`Error fetching rooms for ${gameName}:`, error);
-        setMessage(`Failed to load rooms for ${gameName}.`);
-      }
-    },
-    [token]
-  );
-
   useEffect(() => {
     fetchAvailableGames();
-    // Poll for room updates for the selected game every 5 seconds
-    let roomPollingInterval;
-    if (selectedGame) {
-      roomPollingInterval = setInterval(() => {
-        fetchAvailableRooms(selectedGame.name);
-      }, 5000);
+  }, [fetchAvailableGames]);
+
+  // Live room list for the selected game: the server sends a snapshot, then
+  // a diff whenever a room is created, fills up, frees a seat or is deleted.
+  useEffect(() => {
+    if (!selectedGame || !token) return;
+
+    let socket;
+    let reconnectTimer;
+    let closedByUs = false;
+
+    const connect = () => {
+      const wsUrl = `${BACKEND_URL.replace(/^http/, "ws")}/ws/lobby/${encodeURIComponent(
+        selectedGame.name
+      )}?token=${encodeURIComponent(token)}`;
+      socket = new WebSocket(wsUrl);
+      lobbySocket.current = socket;
+
+      socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.error) {
+          setMessage(`Failed to load rooms for ${selectedGame.name}.`);
+          return;
+        }
+        if (data.action === "snapshot" || data.action === "page") {
+          setNextCursor(data.next_cursor);
+        }
+        setRooms((currentRooms) => applyLobbyEvent(currentRooms, data));
+      };
+
+      socket.onclose = (event) => {
+        if (closedByUs) return;
+        if (event.code === 1008) {
+          if (event.reason === "Not authenticated") navigate("/login");
+          return;
+        }
+        // Lost the connection: reconnect, the new snapshot replaces the list
+        reconnectTimer = setTimeout(connect, 5000);
+      };
+    };
+
+    connect();
+
+    return () => {
+      closedByUs = true;
+      clearTimeout(reconnectTimer);
+      lobbySocket.current = null;
+      if (socket) socket.close();
+    };
+  }, [selectedGame, token, navigate]);
+
+  const handleMoreRooms = () => {
+    const socket = lobbySocket.current;
+    if (socket && socket.readyState === WebSocket.OPEN && nextCursor !== null) {
+      socket.send(JSON.stringify({ action: "page", after: nextCursor }));
     }
+  };
 
+  // Leaving the lobby also leaves the matchmaking queue
+  useEffect(() => {
     return () => {
-      if (roomPollingInterval) {
-        clearInterval(roomPollingInterval);
+      if (matchmakingSocket.current) matchmakingSocket.current.close();
+    };
+  }, []);
+
+  // Quick play: wait in the game's queue until the server has seated us in a
+  // fresh room with an opponent, instead of browsing and racing for a room.
+  const handleQuickPlay = () => {
+    if (!token || !selectedGame) {
+      setMessage("Please select a game to use quick play.");
+      return;
+    }
+    const wsUrl = `${BACKEND_URL.replace(/^http/, "ws")}/ws/matchmaking/${encodeURIComponent(
+      selectedGame.name
+    )}?token=${encodeURIComponent(token)}`;
+    const socket = new WebSocket(wsUrl);
+    matchmakingSocket.current = socket;
+    setSearching(true);
+    setMessage(`Looking for an opponent for ${selectedGame.name}...`);
+
+    socket.onmessage = (event) => {
+      const data = JSON.parse(event.data);
+      if (data.error) {
+        setMessage(`Failed to start quick play: ${data.error}`);
+      } else if (data.action === "matched") {
+        navigate(`/game/${data.room_id}`);
+      } else if (data.action === "cancelled") {
+        setMessage(data.message);
       }
     };
-  }, [fetchAvailableGames, fetchAvailableRooms, selectedGame]);
 
-  const handleCreateRoom = async () => {
+    socket.onclose = (event) => {
+      if (matchmakingSocket.current === socket) matchmakingSocket.current = null;
+      setSearching(false);
+      if (event.code === 1008 && event.reason === "Not authenticated") navigate("/login");
+    };
+  };
+
+  const handleCancelQuickPlay = () => {
+    // Any message leaves the queue; the server confirms by closing the socket
+    if (matchmakingSocket.current) matchmakingSocket.current.send(JSON.stringify({ action: "leave_queue" }));
+    setMessage("");
+  };
+
+  // vsComputer: the server takes the second seat and plays it perfectly (or less, by difficulty)
+  const handleCreateRoom = async (vsComputer = false) => {
     if (!token || !selectedGame) {
       setMessage("Please select a game to create a room.");
       return;
@@ -224,7 +323,11 @@ export default function Lobby() {
             "Content-Type": "application/json",
             Authorization: `Bearer ${token}`,
           },
-          body: JSON.stringify({ password: roomPassword || null }),
+          body: JSON.stringify(
+            vsComputer
+              ? { opponent: "bot" } // seated right away; nobody else can join
+              : { password: roomPassword || null }
+          ),
         }
       );
 
@@ -243,7 +346,11 @@ export default function Lobby() {
 
       const newRoom = await response.json();
       setMessage(`Room ${newRoom.id} created successfully! Joining...`);
-      navigate(`/game/${newRoom.id}`); // Navigate directly to the game room
+      if (vsComputer) {
+        navigate(`/game/${newRoom.id}?opponent=bot&difficulty=${botDifficulty}`);
+      } else {
+        navigate(`/game/${newRoom.id}`); // Navigate directly to the game room
+      }
     } catch (error) {
       console.error("Error creating room:", error);
       setMessage(`Failed to create room: ${error.message}`);
@@ -345,9 +452,9 @@ export default function Lobby() {
 
   const handleSelectGame = (game) => {
     setSelectedGame(game);
-    setRooms([]); // Clear rooms when selecting a new game
+    setRooms([]); // Clear rooms when selecting a new game; the lobby feed refills them
+    setNextCursor(null);
     setMessage("");
-    fetchAvailableRooms(game.name); // Fetch rooms for the selected game
   };
 
   const handleShowPasswordPrompt = (roomId) => {
@@ -439,31 +546,25 @@ export default function Lobby() {
                       }
                     >
                       <span>
-                        Room #{room.id} ({room.password ? "Private" : "Public"})
-                        - Players: {room.users ? room.users.length : 0}/
-                        {room.game ? room.game.number_of_players : "?"}
+                        Room #{room.id} ({room.private ? "Private" : "Public"})
+                        - Players: {room.players}/{room.max_players}
                       </span>
                       <button
                         onClick={() => handleShowPasswordPrompt(room.id)}
                         style={commonButtonStyles}
-                        disabled={
-                          !room.available &&
-                          (!room.users ||
-                            room.users.length ===
-                              (room.game ? room.game.number_of_players : 0))
-                        }
+                        disabled={!room.available}
                       >
-                        {!room.available &&
-                        room.users &&
-                        room.users.length ===
-                          (room.game ? room.game.number_of_players : 0)
-                          ? "Full"
-                          : "Join"}
+                        {room.available ? "Join" : "Full"}
                       </button>
                     </li>
                   ))}
                 </ul>
               )}
+              {nextCursor !== null && (
+                <button onClick={handleMoreRooms} style={secondaryButtonStyles}>
+                  More Rooms
+                </button>
+              )}
               <div style={{ marginTop: "20px" }}>
                 <h4>Create New Room</h4>
                 {showPasswordInput &&
@@ -507,12 +608,40 @@ export default function Lobby() {
                   </>
                 ) : (
                   <>
+                    {searching ? (
+                      <button onClick={handleCancelQuickPlay} style={warningButtonStyles}>
+                        Cancel Quick Play
+                      </button>
+                    ) : (
+                      <button onClick={handleQuickPlay} style={warningButtonStyles}>
+                        Quick Play
+                      </button>
+                    )}
                     <button
-                      onClick={handleCreateRoom}
+                      onClick={() => handleCreateRoom()}
                       style={successButtonStyles}
                     >
                       Create Room
                     </button>
+                    {selectedGame.name === "Tic Tac Toe" && (
+                      <>
+                        <select
+                          value={botDifficulty}
+                          onChange={(e) => setBotDifficulty(e.target.value)}
+                          style={inputStyle}
+                        >
+                          <option value="easy">Easy</option>
+                          <option value="medium">Medium</option>
+                          <option value="hard">Hard</option>
+                        </select>
+                        <button
+                          onClick={() => handleCreateRoom(true)}
+                          style={successButtonStyles}
+                        >
+                          Play vs Computer
+                        </button>
+                      </>
+                    )}
                     <button
                       onClick={() => setShowPasswordInput(!showPasswordInput)}
                       style={secondaryButtonStyles}